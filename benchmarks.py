@@ -0,0 +1,365 @@
+"""
+Benchmarks for the game engines and the bots' commands.
+
+Usage:
+python3 benchmarks.py
+python3 benchmarks.py -k ethnos.draw
+python3 benchmarks.py --save benchmarks.json
+python3 benchmarks.py --compare benchmarks.json
+
+Every benchmark is run for several rounds, each on a fresh game, and the
+fastest round is reported as time per operation. Benchmarks are run at a
+realistic scale and at a stress scale (more players, or many games in one
+process).
+
+--save stores the results as JSON. --compare runs the benchmarks again and
+lists every one that got slower than the stored result by more than
+--threshold, exiting with status 1 if any did.
+
+The command benchmarks run the real command functions against the fake
+Discord objects in fake_discord.py, so they need discord.py installed but
+no connection. They measure each command from the call until its handler
+returns, and until every message it queued has been sent.
+"""
+
+import argparse, asyncio, json, os, platform, random, shutil, sys, tempfile, time
+from types import SimpleNamespace
+
+from card_lexicon import CardLexicon
+from ethnos_engine import EthnosBot, COLORS, TRIBES
+from fake_discord import FakeContext, fake_bot, import_bot
+from game_sessions import GameSessions
+
+# name -> (function, keyword arguments)
+BENCHMARKS = {}
+
+def benchmark(name, *params):
+    """Registers the decorated function as a benchmark, once for every dict of
+    keyword arguments in params. The function must return the time taken and
+    the number of operations done in that time."""
+    def register(function):
+        for kwargs in params or [{}]:
+            label = ",".join(f"{key}={value}" for key, value in kwargs.items())
+            BENCHMARKS[f"{name}[{label}]" if label else name] = (function, kwargs)
+        return function
+    return register
+
+#########################################################
+### Engines
+#########################################################
+
+def ethnos_game(players):
+    """Returns a started game of Ethnos with players players."""
+    EB = EthnosBot()
+    for id in range(players):
+        EB.add_player(SimpleNamespace(id=id, name=f"Player {id}"))
+    EB.start()
+    return EB
+
+def ninety_nine_game(players):
+    """Returns a game of 99 with players players."""
+    NNB = import_bot("ninety_nine").NinetyNineBot()
+    for id in range(players):
+        NNB.add_player(SimpleNamespace(id=id, name=f"Player {id}"))
+    return NNB
+
+@benchmark("ethnos.draw", {"players": 4}, {"players": 12})
+def ethnos_draw(players):
+    EB = ethnos_game(players)
+    draws = len(EB.deck) - 3
+    start = time.perf_counter()
+    for turn in range(draws):
+        EB.draw(turn % players)
+    return time.perf_counter() - start, draws
+
+@benchmark("ethnos.journaled_draw", {"players": 4})
+def ethnos_journaled_draw(players):
+    EB = ethnos_game(players)
+    directory = tempfile.mkdtemp()
+    try:
+        EB.attach_journal(os.path.join(directory, "bench"))
+        draws = len(EB.deck) - 3
+        start = time.perf_counter()
+        for turn in range(draws):
+            EB.draw(turn % players)
+        elapsed = time.perf_counter() - start
+        EB.close_journal()
+    finally:
+        shutil.rmtree(directory)
+    return elapsed, draws
+
+@benchmark("ethnos.pickup_and_table", {"players": 4})
+def ethnos_pickup_and_table(players):
+    EB = ethnos_game(players)
+    cards = list(EB.available_cards)
+    start = time.perf_counter()
+    for _ in range(100):
+        for card in cards:
+            EB.pickup(0, card)
+        for card in cards:
+            EB.play(0, card)
+            EB.table_card(card)
+    return time.perf_counter() - start, 300 * len(cards)
+
+@benchmark("ethnos.hand", {"players": 4})
+def ethnos_hand(players):
+    EB = ethnos_game(players)
+    for turn in range(10 * players):
+        EB.draw(turn % players)
+    start = time.perf_counter()
+    for turn in range(10000):
+        str(EB.hand(turn % players))
+    return time.perf_counter() - start, 10000
+
+@benchmark("ethnos.cards_per_hand", {"players": 4}, {"players": 12})
+def ethnos_cards_per_hand(players):
+    EB = ethnos_game(players)
+    start = time.perf_counter()
+    for _ in range(10000):
+        EB.cards_per_hand()
+    return time.perf_counter() - start, 10000
+
+@benchmark("ethnos.turn_messages", {"players": 4}, {"players": 12})
+def ethnos_turn_messages(players):
+    """A draw followed by everything the draw command says about it."""
+    EB = ethnos_game(players)
+    draws = len(EB.deck) - 3
+    start = time.perf_counter()
+    for _ in range(draws):
+        id = EB.turn_order.current
+        EB.draw(id)
+        EB.end_turn()
+        str(EB.hand(id))
+        EB.cards_per_hand()
+        str(EB.available_cards)
+    return time.perf_counter() - start, draws
+
+@benchmark("ethnos.next_player", {"players": 4}, {"players": 12})
+def ethnos_next_player(players):
+    EB = ethnos_game(players)
+    id = 0
+    start = time.perf_counter()
+    for _ in range(100000):
+        id = EB.next_player(id)
+    return time.perf_counter() - start, 100000
+
+@benchmark("ethnos.snapshot", {"players": 4})
+def ethnos_snapshot(players):
+    EB = ethnos_game(players)
+    for turn in range(20):
+        EB.draw(turn % players)
+    start = time.perf_counter()
+    for _ in range(1000):
+        EthnosBot.from_bytes(EB.to_bytes())
+    return time.perf_counter() - start, 1000
+
+@benchmark("ethnos.parse_cards", {"typos": False}, {"typos": True})
+def ethnos_parse_cards(typos):
+    lexicon = CardLexicon(COLORS, TRIBES)
+    words = ["redd", "dwraf"] if typos else ["Red", "Dwarves,", "blu", "wiz"]
+    start = time.perf_counter()
+    for _ in range(10000):
+        lexicon.parse_cards(words)
+    return time.perf_counter() - start, 10000
+
+@benchmark("ninety_nine.draw", {"players": 4}, {"players": 50})
+def ninety_nine_draw(players):
+    NNB = ninety_nine_game(players)
+    draws = len(NNB.deck)
+    start = time.perf_counter()
+    for turn in range(draws):
+        NNB.draw(turn % players)
+    return time.perf_counter() - start, draws
+
+@benchmark("ninety_nine.play", {"players": 4}, {"players": 50})
+def ninety_nine_play(players):
+    NNB = ninety_nine_game(players)
+    for turn in range(len(NNB.deck)):
+        NNB.draw(turn % players)
+    plays = [(id, card) for id in range(players) for card in NNB.hand(id)]
+    start = time.perf_counter()
+    for id, card in plays:
+        if card in NNB.hand(id):
+            NNB.play(id, card)
+    return time.perf_counter() - start, len(plays)
+
+@benchmark("ninety_nine.cards_per_hand", {"players": 4}, {"players": 50})
+def ninety_nine_cards_per_hand(players):
+    NNB = ninety_nine_game(players)
+    start = time.perf_counter()
+    for _ in range(10000):
+        NNB.cards_per_hand()
+    return time.perf_counter() - start, 10000
+
+@benchmark("ninety_nine.next_player", {"players": 4}, {"players": 50})
+def ninety_nine_next_player(players):
+    NNB = ninety_nine_game(players)
+    id = 0
+    start = time.perf_counter()
+    for _ in range(100000):
+        id = NNB.next_player(id)
+    return time.perf_counter() - start, 100000
+
+@benchmark("sessions.open", {"games": 10}, {"games": 10000})
+def sessions_open(games):
+    sessions = GameSessions(lambda key: object(), max_idle=3600)
+    contexts = [SimpleNamespace(guild=SimpleNamespace(id=1), channel=SimpleNamespace(id=id))
+                for id in range(games)]
+    for ctx in contexts:
+        sessions.get(sessions.key(ctx))
+    order = [random.choice(contexts) for _ in range(10000)]
+
+    async def open_sessions():
+        start = time.perf_counter()
+        for ctx in order:
+            async with sessions.session(ctx):
+                pass
+        return time.perf_counter() - start
+
+    return asyncio.run(open_sessions()), len(order)
+
+#########################################################
+### Commands
+#########################################################
+
+async def timed_commands(module, commands, deliver):
+    """Awaits every (command, ctx, args) in commands. Returns the total time,
+    including sending each command's messages if deliver is True."""
+    start = time.perf_counter()
+    for command, ctx, args in commands:
+        await command.callback(ctx, *args)
+        if deliver:
+            await module.SCHEDULER.drain()
+    elapsed = time.perf_counter() - start
+
+    # Workers with queued messages can miss being cancelled when the loop
+    # closes, and then linger until their idle timeout
+    await module.SCHEDULER.drain()
+    return elapsed
+
+def ethnos_commands(module, users, games, players, turns):
+    """Returns the commands to set up games of Ethnos, and the commands to
+    benchmark on them."""
+    setup = []
+    turn_commands = []
+    tables = [[FakeContext(users.get_or_create(id), channel_id) for id in range(players)]
+              for channel_id in range(games)]
+    for contexts in tables:
+        setup.extend((module.join, ctx, ()) for ctx in contexts)
+        setup.append((module.start, contexts[0], ()))
+
+    # Players take their turns in order, with the games interleaved
+    for turn in range(turns):
+        for contexts in tables:
+            ctx = contexts[turn % players]
+            turn_commands.append((module.draw, ctx, ()))
+            turn_commands.append((module.hand, ctx, ()))
+    return setup, turn_commands
+
+@benchmark("command.ethnos", {"games": 1, "deliver": False}, {"games": 1, "deliver": True},
+           {"games": 200, "deliver": False})
+def command_ethnos(games, deliver, players=4, turns=20):
+    with fake_bot("ethnos_bot") as (module, users):
+        setup, commands = ethnos_commands(module, users, games, players, turns)
+
+        async def run():
+            await timed_commands(module, setup, False)
+            return await timed_commands(module, commands, deliver)
+
+        return asyncio.run(run()), len(commands)
+
+@benchmark("command.ninety_nine", {"games": 1, "deliver": False}, {"games": 1, "deliver": True},
+           {"games": 200, "deliver": False})
+def command_ninety_nine(games, deliver, players=4, turns=20):
+    with fake_bot("ninety_nine") as (module, users):
+        tables = [[FakeContext(users.get_or_create(id), channel_id) for id in range(players)]
+                  for channel_id in range(games)]
+        setup = [(module._99join, ctx, ()) for contexts in tables for ctx in contexts]
+        commands = [(module._99draw, contexts[turn % players], ())
+                    for turn in range(turns) for contexts in tables]
+
+        async def run():
+            await timed_commands(module, setup, False)
+            elapsed = await timed_commands(module, commands, deliver)
+
+            # Play every card that was drawn, taking turns
+            plays = []
+            hands = [[list(module.SESSIONS.get((1, channel_id)).hand(id)) for id in range(players)]
+                     for channel_id in range(games)]
+            for turn in range(turns):
+                for contexts, cards in zip(tables, hands):
+                    id = turn % players
+                    plays.append((module._99play, contexts[id], (str(cards[id][turn // players]),)))
+            return elapsed + await timed_commands(module, plays, deliver), len(commands) + len(plays)
+
+        return asyncio.run(run())
+
+#########################################################
+### Running and comparing
+#########################################################
+
+def run_benchmarks(names, rounds):
+    """Runs the named benchmarks. Returns a dict of seconds per operation."""
+    results = {}
+    for name in names:
+        function, kwargs = BENCHMARKS[name]
+        best = None
+        for _ in range(rounds):
+            elapsed, ops = function(**kwargs)
+            per_op = elapsed / ops
+            best = per_op if best is None else min(best, per_op)
+        results[name] = best
+        print(f"{name:50s} {best * 1e6:12.2f}us")
+    return results
+
+def compare(results, baseline, threshold):
+    """Prints how results differ from baseline. Returns the names of the
+    benchmarks that got slower by more than threshold (a fraction)."""
+    regressions = []
+    print()
+    print(f"{'benchmark':50s} {'baseline':>12s} {'now':>12s} {'change':>8s}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = now / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:50s} {before * 1e6:10.2f}us {now * 1e6:10.2f}us {100 * change:+7.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game engines and bot commands.")
+    parser.add_argument("-k", dest="filter", default="",
+                        help="only run benchmarks whose names contain this")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--save", metavar="FILE", help="store the results in FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with FILE")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown that counts as a regression (default 0.2 = 20%%)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run_benchmarks(names, args.rounds)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks regressed by more than {100 * args.threshold:.0f}%.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Parses the card names players type, like "red dwarf", "Dwarves, Red" or
+"blu wiz", into cards.
+
+A CardLexicon is built once from the colors and tribes. It maps every
+accepted word (the names themselves, plurals, aliases like "grey", and
+prefixes of at least MIN_PREFIX letters that only fit one name) to its color
+or tribe, so looking a word up is a single dict access. A word that isn't
+known is compared with the names and their plurals that share a deletion of
+up to MAX_DISTANCE letters with it, also looked up in a table built up front:
+if exactly one is within an edit of it, it is read as that name, and
+otherwise the names within MAX_DISTANCE edits are suggested.
+
+Usage:
+LEXICON = CardLexicon(COLORS, TRIBES)
+cards, notes = LEXICON.parse_cards(["red", "dwarves"])   # ["Red Dwarf"], []
+"""
+
+import re
+
+# Shortest prefix of a name that is accepted for it
+MIN_PREFIX = 3
+
+# Edits (insertions, deletions, substitutions and swaps of neighbouring
+# letters) within which a word is corrected, and within which names are
+# suggested for it
+MAX_CORRECTION = 1
+MAX_DISTANCE = 2
+
+# Plurals that aren't the name plus "s"
+IRREGULAR_PLURALS = {"Dwarf": ["dwarves", "dwarfs"],
+                     "Elf": ["elves"],
+                     "Merfolk": ["merfolk"],
+                     "Wingfolk": ["wingfolk"]}
+
+ALIASES = {"grey": "Gray"}
+
+COLOR = "color"
+TRIBE = "tribe"
+
+class CardNameError(ValueError):
+    """Raised when words don't name cards. The message says what was wrong,
+    and suggests what was meant if it can."""
+
+def deletions(word, limit):
+    """Returns the set of words made by deleting up to limit letters of word,
+    including word itself."""
+    words = {word}
+    frontier = {word}
+    for _ in range(limit):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        words |= frontier
+    return words
+
+def edit_distance(a, b, limit):
+    """Returns the number of edits (insertions, deletions, substitutions and
+    swaps of neighbouring letters) that turn a into b, or limit + 1 if it is
+    more than limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if (previous is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous, row = row, current
+    return min(row[-1], limit + 1)
+
+class CardLexicon:
+    """Lookup tables from the words players use to colors and tribes."""
+
+    def __init__(self, colors, tribes):
+        self.names = {COLOR: list(colors), TRIBE: list(tribes)}
+
+        # Whole words: the names, their plurals and aliases. These are also
+        # what unknown words are compared with.
+        self.words = {}
+        for kind, names in self.names.items():
+            for index, name in enumerate(names):
+                self.words[name.lower()] = (kind, index)
+                for plural in IRREGULAR_PLURALS.get(name, [name.lower() + "s"]):
+                    self.words[plural] = (kind, index)
+        for alias, name in ALIASES.items():
+            for kind, names in self.names.items():
+                if name in names:
+                    self.words[alias] = (kind, names.index(name))
+
+        # Prefixes that fit a single name
+        prefixes = {}
+        for word, meaning in self.words.items():
+            for length in range(MIN_PREFIX, len(word)):
+                prefixes.setdefault(word[:length], set()).add(meaning)
+        self.tokens = {prefix: meanings.pop() for prefix, meanings in prefixes.items() if len(meanings) == 1}
+        self.tokens.update(self.words)
+
+        # Deletions of the whole words, for finding the words near a typo:
+        # two words within MAX_DISTANCE edits share a deletion
+        self.near = {}
+        for word in self.words:
+            for deletion in deletions(word, MAX_DISTANCE):
+                self.near.setdefault(deletion, set()).add(word)
+
+    def name(self, meaning):
+        kind, index = meaning
+        return self.names[kind][index]
+
+    def lookup(self, word):
+        """Returns (COLOR or TRIBE, index) for word, correcting a small typo.
+        Returns (meaning, note), where note says what a typo was read as, or
+        None. Raises CardNameError if word can't be read."""
+        meaning = self.tokens.get(word)
+        if meaning is not None:
+            return meaning, None
+
+        candidates = set()
+        for deletion in deletions(word, MAX_DISTANCE):
+            candidates |= self.near.get(deletion, set())
+        distances = {}
+        for known in candidates:
+            known_meaning = self.words[known]
+            distance = edit_distance(word, known, MAX_DISTANCE)
+            if distance <= MAX_DISTANCE:
+                distances[known_meaning] = min(distance, distances.get(known_meaning, distance))
+        closest = [meaning for meaning, distance in distances.items() if distance <= MAX_CORRECTION]
+        if len(closest) == 1 and len(word) > MIN_PREFIX:
+            return closest[0], f"Reading '{word}' as {self.name(closest[0])}."
+
+        suggestions = [self.name(meaning) for meaning in sorted(distances, key=distances.get)]
+        if suggestions:
+            raise CardNameError(f"'{word}' is not a color or tribe. Did you mean {' or '.join(suggestions)}?")
+        raise CardNameError(f"'{word}' is not a color or tribe.")
+
+    def parse_cards(self, words):
+        """Parses words (a command's arguments) as cards, each named by a color
+        and a tribe in either order. Returns (cards, notes), where notes says
+        how any typos were read. Raises CardNameError if they aren't cards."""
+        tokens = re.findall("[a-z]+", " ".join(words).lower())
+        if len(tokens) % 2 != 0:
+            raise CardNameError("every card needs a color and a tribe, as in 'Red Dwarf'.")
+
+        cards = []
+        notes = []
+        for first, second in zip(tokens[::2], tokens[1::2]):
+            meanings = {}
+            for word in (first, second):
+                meaning, note = self.lookup(word)
+                if note is not None:
+                    notes.append(note)
+                if meaning[0] in meanings:
+                    raise CardNameError(f"'{first} {second}' needs a color and a tribe.")
+                meanings[meaning[0]] = meaning
+            cards.append(f"{self.name(meanings[COLOR])} {self.name(meanings[TRIBE])}")
+        return cards, notes
@@ -0,0 +1,65 @@
+"""
+Exact odds of how many more draws an age of Ethnos will last.
+
+When an Ethnos game starts, the three Dragons are shuffled into the bottom
+part of the deck (the "dragon zone"), and the age ends when the third one is
+drawn. Given the current deck size and the number of Dragons already drawn,
+the remaining Dragons are equally likely to be anywhere in what is left of
+the zone, so the position of the last of them has a closed form: with r
+Dragons among z cards, the last one is at position m (counting from 0 at the
+top of the zone) with probability C(m, r - 1) / C(z, r). Each distribution
+is counted in whole numbers in a few microseconds, and cached per game
+state.
+"""
+
+import bisect, functools, itertools, math
+
+@functools.lru_cache(maxsize=4096)
+def ways_age_ends(deck_size, dragons_drawn, zone_size):
+    """Returns (ways, total): element i of ways is the number of the total
+    equally likely placements of the remaining Dragons in which the age ends
+    on the i-th draw from now. deck_size counts the Dragons still in the
+    deck, and zone_size is the number of cards the Dragons were shuffled
+    into."""
+    remaining = 3 - dragons_drawn
+    if remaining <= 0 or deck_size <= 0:
+        return (1,), 1
+
+    # Cards above the zone hold no Dragons and come off the deck first
+    zone = min(zone_size, deck_size)
+    above = deck_size - zone
+    if zone < remaining:
+        # Fewer cards than Dragons left: they are all Dragons
+        return (0,) * (above + 1) + (1,), 1
+
+    # Every draw takes exactly one non-Dragon card, skipping Dragons, so the
+    # last Dragon turns up on the draw after all the non-Dragon cards above
+    # it are gone.
+    ways = [0] * (above + zone - remaining + 2)
+    for last_dragon in range(remaining - 1, zone):
+        ways[above + last_dragon - (remaining - 1) + 1] = math.comb(last_dragon, remaining - 1)
+    return tuple(ways), math.comb(zone, remaining)
+
+def draws_until_age_ends(deck_size, dragons_drawn, zone_size):
+    """Returns a list whose element i is the probability that the age ends
+    on the i-th draw from now."""
+    ways, total = ways_age_ends(deck_size, dragons_drawn, zone_size)
+    return [count / total for count in ways]
+
+def summary(deck_size, dragons_drawn, zone_size, players):
+    """Returns a dict of statistics about the draws left in the age: mean,
+    median, 10th and 90th percentile, and the chance the age ends within the
+    next round of draws."""
+    ways, total = ways_age_ends(deck_size, dragons_drawn, zone_size)
+    # Counted in whole numbers, so percentiles that fall exactly on a draw
+    # aren't pushed past it by rounding
+    cumulative = list(itertools.accumulate(ways))
+
+    def percentile(percent):
+        return bisect.bisect_left(cumulative, total * percent / 100)
+
+    return {"mean": sum(draws * count for draws, count in enumerate(ways)) / total,
+            "median": percentile(50),
+            "p10": percentile(10),
+            "p90": percentile(90),
+            "this_round": cumulative[min(players, len(cumulative) - 1)] / total}
@@ -4,231 +4,276 @@ Bot to implement Ethnos
 Usage:
 python3 ethnos_bot.py
 
-OR to unpickle a saved game:
-python3 ethnos_bot.py backup_ethnos_bot_DATETIME.dat
+OR to load a saved game into the home channel:
+python3 ethnos_bot.py backup_ethnos_bot_GUILD_CHANNEL_DATETIME.eth
+
+(!pickle saves these backups, keeping the newest BACKUP_KEEP per channel.
+Backups in the old dill format, backup_ethnos_bot_DATETIME.dat, still
+load, and ethnos_snapshot.py can migrate them.)
+
+OR to check saved games (a backup, or every journaled game) without
+connecting to Discord:
+python3 ethnos_bot.py --check [backup_ethnos_bot_GUILD_CHANNEL_DATETIME.eth]
+
+OR to run as N worker processes, each connected to Discord as one shard and
+hosting the games of that shard's guilds:
+python3 ethnos_bot.py --shards N
+
+Every channel gets its own game, so one process can host many tables.
+
+Every change to a game is journaled under games/, and games that were in
+progress when the bot stopped are recovered automatically on startup.
+
+Each game has a pinned status board showing whose turn it is, the deck, the
+table and how many cards each player holds, edited in place as the game goes
+on.
+
+Card commands take a color and a tribe in either order, and understand
+plurals ("Dwarves"), prefixes ("blu wiz") and small typos, suggesting what
+was meant when a name can't be read.
+
+Logs are written to stdout (or --log FILE) as JSON lines, and metrics
+(command latencies, sends, games and players) are dumped to
+ethnos_metrics.json (or --metrics FILE) every METRICS_INTERVAL seconds.
+
+Every game's players and moves are recorded in history.sqlite3 (or
+--history FILE), for the !stats and !leaderboard commands.
+
+With --spectate PORT, the public state of every game (turn, deck, Dragons,
+table, hand counts, bands and kingdoms) is served read-only on
+localhost:PORT, over HTTP and as WebSocket updates; see spectator.py. Each
+shard serves its own games on PORT plus its shard id.
 
 To do:
 """
 
+import time
+
+# Used to measure how long startup takes, to keep it within STARTUP_BUDGET
+STARTED_AT = time.perf_counter()
+
 import discord
 import discord.ext
 import discord.ext.commands
-import random, dill, time, sys
+import argparse, asyncio, logging, subprocess, sys, os
+
+from card_lexicon import CardLexicon, CardNameError
+import dragon_odds
+from ethnos_engine import EthnosBot, COLORS, TRIBES, save_backup
+from event_log import GameJournal, JournalLockedError
+from game_sessions import GameSessions
+from history import GameRecorder, HistoryStore
+from instrumentation import METRICS, game_fields, setup_logging
+from outbox import Outbox
+from send_scheduler import SendScheduler, TURN
+from spectator import SpectatorServer
+from status_board import StatusBoards
 
 client = discord.ext.commands.Bot(command_prefix = '!')
 
-with open("ethnos.key", "r") as f:
-    auth_key = f.read().strip()
+log = logging.getLogger("ethnos_bot")
 
-TRIBES = ["Centaur",
-          "Dwarf",
-          # "Elf",
-          "Giant",
-          # "Halfling",
-          # "Merfolk",
-          # "Minotaur",
-          # "Orc",
-          "Skeleton",
-          "Troll",
-          # "Wingfolk",
-          "Wizard"
-          ]
-
-# random.shuffle(TRIBES)
-# print(TRIBES[:6])
-# 1 / 0
-
-COLORS = ["Red", "Green", "Blue", "Gray", "Purple", "Orange"]
-
-class Player:
-    """Stores player data"""
-
-    def __init__(self, name):
-        self.name = name
-        self.cards = []
-
-    def __len__(self):
-        return len(self.cards)
-
-    def add_card(self, card):
-        self.cards.append(card)
-        self.cards.sort()
-
-    def remove_card(self, card):
-        self.cards.remove(card)
-
-    def empty_hand(self):
-        self.cards = []
-
-class EthnosBot:
-    """Implements control of Ethnos."""
-
-    def __init__(self):
-        self.deck = []
-        for tribe in TRIBES:
-            for color in COLORS:
-                card = f"{color} {tribe}"
-                if tribe == "Halfling":
-                    self.deck.extend([card] * 4)
-                else:
-                    self.deck.extend([card] * 2)
-
-        random.shuffle(self.deck)
-
-        self.started = False
-        self.dragons = 0
-        self.just_drew_dragon = False
-
-        self.players = {}
-        self.player_id_list = []
-        self.available_cards = []
-
-    @classmethod
-    def load_ethnos_bot(cls, filename):
-        with open(filename, "rb") as f:
-            bot = dill.load(f)
-            return bot
-
-    def pickle_ethnos_bot(self):
-        filename = f"backup_ethnos_bot_{time.strftime('%Y-%m-%d_%H-%M-%S')}.dat"
-        with open(filename, "wb") as f:
-            dill.dump(self, f)
-
-    def add_player(self, user):
-        """Adds this player to the game, if not already there."""
-        id = user.id
-        if id in self.player_id_list or self.started:
-            return
-
-        name = user.name
-        self.players[id] = Player(name)
-        self.player_id_list.append(id)
-
-        # Each player draws a single card at the start
-        return self.draw(id)
-
-    def start(self):
-        """Starts the game of Ethnos"""
-        if self.started:
-            return
-
-        self.started = True
-
-        # Deal out available cards
-        players = len(self.player_id_list)
-        for _ in range(players * 2):
-            self.available_cards.append(self.deck.pop())
-        self.available_cards.sort()
-
-        # Add dragon cards
-        half = len(self.deck) // 2
-        first_half = self.deck[:half]
-        second_half = self.deck[half:]
-
-        second_half.extend(["Dragon"] * 3)
-        random.shuffle(second_half)
-        self.deck = second_half + first_half
-
-    def available(self, card):
-        """Checks if card is available, ignoring caps."""
-        c = card.title()
-        return c in self.available_cards
-
-    def draw(self, id):
-        """Draws a card, adds it to player id's hand, and returns it."""
-        card = None
-
-        while len(self.deck) > 0:
-            card = self.deck.pop()
-            if card == "Dragon":
-                self.dragons += 1
-                self.just_drew_dragon = True
-            else:
-                break
-
-        self.players[id].add_card(card)
-        return card
-
-    def pickup(self, id, card):
-        """Has player pick up card, adds it to player id's hand."""
-        c = card.title()
-        self.players[id].add_card(c)
-        self.available_cards.remove(c)
-
-    def add_card(self, id, card):
-        """Has player add card to hand (out of thin air)."""
-        c = card.title()
-        self.players[id].add_card(c)
-
-    def hand(self, id):
-        """Returns hand of player given by id"""
-        return self.players[id].cards
-
-    def empty_hand(self, id):
-        """Empties the player's hand."""
-        self.players[id].empty_hand()
-
-    def play(self, id, card):
-        """Plays the card from hand of player id."""
-        self.players[id].remove_card(card)
-
-    def table_card(self, card):
-        """Adds card to available cards."""
-        self.available_cards.append(card)
-        self.available_cards.sort()
-
-    def detable_card(self, card):
-        """Removes card from available cards."""
-        c = card.title()
-        self.available_cards.remove(c)
-
-    def drew_a_dragon(self):
-        """Returns True if a Dragon was drawn. Resets self.just_drew_dragon to False"""
-        result = self.just_drew_dragon
-        self.just_drew_dragon = False
-        return result
-
-    def cards_per_hand(self):
-        """Returns a string of the number of cards per hand for each player."""
-        s = ""
-        for id in self.player_id_list:
-            name = self.players[id].name
-            cards = len(self.players[id])
-            s += "{} has {} cards.\n".format(name, cards)
-        return s[:-1]
-
-    def next_player(self, id):
-        """Finds the next player after name for player turn order. Return's that
-        player's id"""
-        index = self.player_id_list.index(id)
-        next_index = (index + 1) % len(self.player_id_list)
-        return self.player_id_list[next_index]
+# Seconds that startup may take before connecting to Discord
+STARTUP_BUDGET = 1.0
 
 #########################################################
-### Setting up EB and on_ready
+### Setting up SESSIONS and on_ready
 #########################################################
 
-if len(sys.argv) == 1:
+# Channel that the bot announces itself in, and that a game loaded from a
+# backup file is attached to.
+HOME_CHANNEL_ID = 720073170500976801
+
+# Directory holding the journal of every game in progress
+GAMES_DIR = "games"
+
+def journal_prefix(key):
+    """Returns the journal file prefix for the game with session key key."""
+    guild_id, channel_id = key
+    return os.path.join(GAMES_DIR, f"ethnos_{guild_id}_{channel_id}")
+
+# Games that go this long without a command are retired, so that stray games
+# don't keep their journals open and get recovered on every restart
+MAX_IDLE_SECONDS = 6 * 60 * 60
+
+def new_game(key):
+    """Creates a journaled game for the session key."""
     EB = EthnosBot()
-elif len(sys.argv) == 2:
-    EB = EthnosBot.load_ethnos_bot(sys.argv[1])
-else:
-    raise Exception("Incorrect command line arguments.")
+    EB.attach_journal(journal_prefix(key))
+    return EB
+
+def forget_game(key, EB, reason="idle"):
+    """Deletes the journal of a game that is no longer being played."""
+    EB.close_journal(remove=True)
+    BOARDS.forget(key)
+    if SPECTATORS is not None:
+        SPECTATORS.touch(key)
+    if HISTORY is not None:
+        HISTORY.end(key, reason)
+
+def recover_games():
+    """Loads every game with a journal in GAMES_DIR that this process hosts
+    into SESSIONS."""
+    for prefix in GameJournal.find(GAMES_DIR, "ethnos_"):
+        guild_id, channel_id = os.path.basename(prefix).split("_")[1:]
+        key = (int(guild_id), int(channel_id))
+        if not owns(key):
+            continue
+        try:
+            SESSIONS.add(key, EthnosBot.load_ethnos_bot(prefix + ".ckpt"))
+        except JournalLockedError:
+            log.warning("Could not recover the game in channel %s, which another process has open.", channel_id)
+            continue
+        log.info("Recovered the game in channel %s.", channel_id)
+
+# With --shards, this process is worker SHARD_ID of SHARD_COUNT, connected to
+# Discord as that shard and hosting the games of the guilds Discord sends to
+# it. Workers share GAMES_DIR and the history, so a worker restarted after a
+# crash recovers its games from their journals.
+SHARD_ID = None
+SHARD_COUNT = None
+
+# Seconds between starting workers, since Discord lets a bot connect one shard
+# every 5 seconds
+IDENTIFY_INTERVAL = 5.5
+
+# Seconds to wait before restarting a worker that crashed
+RESTART_DELAY = 5.0
+
+def shard_for(guild_id, shard_count):
+    """Returns the shard that Discord sends guild_id's events to. Direct
+    messages (guild id 0) go to shard 0."""
+    return (guild_id >> 22) % shard_count
+
+def owns(key):
+    """Returns True if this process hosts the game with session key key."""
+    return SHARD_COUNT is None or shard_for(key[0], SHARD_COUNT) == SHARD_ID
+
+def use_shard(shard_id, shard_count):
+    """Makes this process worker shard_id of shard_count."""
+    global SHARD_ID, SHARD_COUNT
+    SHARD_ID, SHARD_COUNT = shard_id, shard_count
+    client.shard_id = shard_id
+    client.shard_count = shard_count
+    # The client copies shard_count into its connection state when created
+    client._connection.shard_count = shard_count
+
+def shard_path(path):
+    """Returns path with the shard id added before its extension, for files
+    that each worker writes separately."""
+    if SHARD_ID is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard{SHARD_ID}{extension}"
+
+# All messages go out through SCHEDULER, which paces them per channel and DM
+SCHEDULER = SendScheduler()
+
+SESSIONS = GameSessions(new_game,
+                        max_idle=MAX_IDLE_SECONDS,
+                        on_evict=forget_game)
+
+# Game loaded from the command line, to be attached to the home channel
+LOADED_EB = None
+
+# Seconds that a status board waits after a change before it is edited, so
+# that a burst of commands costs one edit
+BOARD_DELAY = 2.0
+
+BOARDS = StatusBoards(lambda key: status_text(SESSIONS.games.get(key)), SCHEDULER, BOARD_DELAY)
+
+# Reads the card names players type in card commands, typos and all
+LEXICON = CardLexicon(COLORS, TRIBES)
+
+# Number of !pickle backups kept for each channel
+BACKUP_KEEP = 5
+
+def backup_prefix(key):
+    """Returns the backup file prefix for the game with session key key."""
+    guild_id, channel_id = key
+    return f"backup_ethnos_bot_{guild_id}_{channel_id}"
+
+# Where and how often metrics are dumped; main() starts the dumping
+METRICS_FILE = "ethnos_metrics.json"
+METRICS_INTERVAL = 60
+METRICS_TASK = None
+
+METRICS.gauge("games", lambda: len(SESSIONS))
+METRICS.gauge("players", lambda: sum(len(EB.turn_order) for EB in SESSIONS.games.values()))
+METRICS.gauge("sends", lambda: SCHEDULER.metrics())
+METRICS.gauge("boards", lambda: BOARDS.metrics())
+METRICS.gauge("spectators", lambda: SPECTATORS.metrics() if SPECTATORS is not None else {})
+METRICS.gauge("history_backlog", lambda: HISTORY.store.queue.qsize() if HISTORY is not None else 0)
+
+# Records every game for !stats and !leaderboard; main() opens it, and without
+# it nothing is recorded
+HISTORY_FILE = "history.sqlite3"
+HISTORY = None
+
+# Serves games to spectators if --spectate is given; main() creates it, and
+# on_ready starts it
+SPECTATE_HOST = "127.0.0.1"
+SPECTATE_PORT = None
+SPECTATORS = None
+
+@client.before_invoke
+async def start_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@client.after_invoke
+async def record_timing(ctx):
+    """Records how long the command took, including waiting for its game."""
+    METRICS.observe("command." + ctx.command.name, time.perf_counter() - ctx.started_at)
+    METRICS.increment("commands")
 
 @client.event
 async def on_ready():
     """ Displayed in the terminal when the bot is logged in. """
-    channel = client.get_channel(720073170500976801)
+    global LOADED_EB, METRICS_TASK
+    if METRICS_TASK is None:
+        METRICS_TASK = client.loop.create_task(METRICS.dump_periodically(METRICS_FILE, METRICS_INTERVAL))
+    if SPECTATORS is not None and SPECTATORS.runner is None:
+        await SPECTATORS.start(SPECTATE_HOST, SPECTATE_PORT)
+
+    channel = client.get_channel(HOME_CHANNEL_ID)
+    if channel is None:
+        # The home channel's guild belongs to another shard
+        log.info("Who wants to play Ethnos?")
+        return
+    if LOADED_EB is not None:
+        key = GameSessions.key(channel)
+        old_EB = SESSIONS.retire(key)
+        if old_EB is not None:
+            old_EB.close_journal()
+            if HISTORY is not None:
+                HISTORY.end(key, "replaced")
+        LOADED_EB.attach_journal(journal_prefix(key))
+        SESSIONS.add(key, LOADED_EB)
+        LOADED_EB = None
+        if SPECTATORS is not None:
+            SPECTATORS.touch(key)
     # await channel.send("Who wants to play Ethnos?")
-    print("Who wants to play Ethnos?")
+    log.info("Who wants to play Ethnos?")
 
     commands = """Here are the commands you will need:
 - `!join` - joins game before it starts
 - `!draw` - draw a random card from the deck
 - `!pickup color tribe` - pickup card from available cards with given color and tribe
-- `!band` - form a band from the cards in your hand.
+- `!band leader cards` - form a band of the given cards, led by the first one, putting the rest of your hand on the table. `!band` alone DMs you the largest bands you can form.
 - `!hand` - DMs you your current hand.
 - `!available` - Tells what cards are available on the table.
+- `!board` - Posts a new status board for the game, if the pinned one was lost.
+- `!kingdoms` - Tells how many control markers each player has in each kingdom.
+- `!odds` - Estimates how many more draws until the age ends.
+- `!skip` - skips the turn of the player whose turn it is.
+- `!leave` - leaves the game, putting your hand on the table.
+- `!end` - ends the game in this channel.
+- `!stats [@player]` - Tells how many games you (or another player) have played, and what you did in them.
+- `!leaderboard [games|wins|draws|pickups|bands]` - Lists the players with the most of them.
+
+Only the player whose turn it is can draw, pickup or form a band.
+
+Each channel has its own game, so several games can be played at once. Its status board, pinned in the channel, shows whose turn it is, the deck, the table and how many cards everyone holds.
 
 The following commands will be helpful in uncommon situations, and should be used only if the above commands don't do what you need:
 - `!add color tribe` - Adds card with given card and tribe to your hand out of thin air.
@@ -236,41 +281,141 @@ The following commands will be helpful in uncommon situations, and should be use
 - `!table color tribe` - Puts card with given card and tribe on the table out of thin air.
 - `!detable color tribe` - Removes card with given card and tribe from the table to nowhere.
 """
-    await channel.send(commands)
+    SCHEDULER.to_channel(channel, commands)
 
 #########################################################
 ### Helper functions that aren't commands
 #########################################################
 
-async def next_player_message(ctx):
-    """Used to tell who is the next player. Argument is context from which next
-    player can be determined."""
-    user = client.get_user(EB.next_player(ctx.message.author.id))
-    message = "It is now {}'s turn.".format(user.mention)
-    await ctx.send(message)
+# These add their messages to out, an Outbox, so that everything a command
+# says goes to the channel as a single message.
 
-async def available_cards_message(ctx):
+def next_player_message(out, EB):
+    """Used to tell whose turn it is now, if anyone is seated."""
+    if EB.turn_order.current is None:
+        return
+    user = client.get_user(EB.turn_order.current)
+    message = "It is now {}'s turn.".format(user.mention)
+    out.add(message, TURN)
+
+def check_turn(out, ctx, EB):
+    """Returns True if it is the turn of the player who sent the command.
+    Otherwise, says whose turn it is, or that nobody is seated."""
+    if EB.is_turn(ctx.message.author.id):
+        return True
+    if EB.turn_order.current is None:
+        out.add("Nobody has joined the game.")
+        return False
+    user = client.get_user(EB.turn_order.current)
+    out.add(f"Sorry {ctx.message.author.name}, it is {user.mention}'s turn.")
+    return False
+
+def available_cards_message(out, EB):
     """Tells what the available cards are."""
-    await ctx.send("Available cards: " + str(EB.available_cards))
+    out.add("Available cards: " + str(EB.available_cards))
 
-async def cards_per_hand(ctx):
-    """Used to tell number of cards in each hand."""
-    message = EB.cards_per_hand()
-    await ctx.send(message)
-
-async def dragons(ctx):
-    """Checks number of Dragons drawn"""
+def dragons(out, EB):
+    """Announces a Dragon being drawn, and the end of the Age. The size of the
+    deck is on the status board."""
     if EB.drew_a_dragon():
-        await ctx.send("**A Dragon card was drawn!!**")
-        await ctx.send(":dragon:")
-
-    message = f"There are now {len(EB.deck)} cards in the deck.\n{EB.dragons} Dragon cards have been drawn."
+        out.add("**A Dragon card was drawn!!**")
+        out.add(":dragon:")
+        if EB.dragons < 3:
+            out.add(f"{EB.dragons} Dragon cards have been drawn.")
 
     if EB.dragons == 3:
-        message = "==========================\n3 Dragon cards have been drawn! This Age is over!\n=========================="
-    await ctx.send(message)
+        out.add("==========================\n3 Dragon cards have been drawn! This Age is over!\n==========================")
     return EB.dragons
 
+def status_text(EB):
+    """Returns the text of the status board for EB, or None if there is no
+    game."""
+    if EB is None:
+        return None
+    if not EB.started:
+        names = ", ".join(EB.players[id].name for id in EB.turn_order)
+        return f"**Ethnos** - waiting to start\nPlayers: {names if names else 'nobody yet'}"
+
+    current = EB.turn_order.current
+    turn = EB.players[current].name if current is not None else "nobody"
+    return (f"**Ethnos** - {turn}'s turn\n"
+            f"Deck: {len(EB.deck)} cards, {EB.dragons} Dragons drawn\n"
+            f"Available cards: {EB.available_cards}\n"
+            f"{EB.cards_per_hand()}")
+
+def public_state(EB):
+    """Returns what anyone may see of EB, for spectators, or None if there is
+    no game."""
+    if EB is None:
+        return None
+    current = EB.turn_order.current
+    bands = {}
+    for id, leader, cards in EB.bands:
+        bands[id] = bands.get(id, 0) + 1
+    return {"game": "ethnos",
+            "started": EB.started,
+            "turn": EB.players[current].name if EB.started and current is not None else None,
+            "deck": len(EB.deck),
+            "dragons": EB.dragons,
+            "table": list(EB.available_cards),
+            "players": [{"name": EB.players[id].name, "cards": len(EB.players[id]), "bands": bands.get(id, 0)}
+                        for id in EB.turn_order],
+            "kingdoms": {color: {EB.players[id].name: count for id, count in markers.items() if id in EB.players}
+                         for color, markers in zip(COLORS, EB.markers)}}
+
+def update_board(ctx):
+    """Brings the status board of ctx's game, and what spectators see of it,
+    up to date, soon."""
+    key = GameSessions.key(ctx)
+    BOARDS.touch(ctx.channel, key)
+    if SPECTATORS is not None:
+        SPECTATORS.touch(key)
+
+def kingdoms_message(out, EB):
+    """Tells how many control markers each player has in each kingdom."""
+    lines = []
+    for color, markers in zip(COLORS, EB.markers):
+        holders = ", ".join(f"{EB.players[id].name} {count}"
+                            for id, count in sorted(markers.items(), key=lambda item: -item[1]))
+        lines.append(f"{color}: {holders if holders else 'no markers'}")
+    out.add("Control markers by kingdom:\n" + "\n".join(lines))
+
+def age_scores_message(out, ctx, EB):
+    """Scores the Age that just ended, says the scores, and records the
+    winners in HISTORY."""
+    scores = EB.score_age()
+    lines = [f"{place}. {EB.players[id].name}: {bands + kingdoms} points "
+             f"({bands} for bands, {kingdoms} for kingdoms)"
+             for place, (id, bands, kingdoms) in enumerate(scores, 1)]
+    out.add("Scores for this Age:\n" + "\n".join(lines))
+
+    if HISTORY is not None and scores:
+        key = GameSessions.key(ctx)
+        best = scores[0][1] + scores[0][2]
+        for id, bands, kingdoms in scores:
+            HISTORY.record(key, EB, id, "age_score", str(bands + kingdoms))
+            if bands + kingdoms == best:
+                HISTORY.record(key, EB, id, "age_win")
+
+def parse_cards(out, words):
+    """Returns the cards named by words, which are pairs of color and tribe in
+    either order, as read by LEXICON, and says how any typos were read.
+    Returns None, after saying what was wrong, if they aren't cards."""
+    try:
+        cards, notes = LEXICON.parse_cards(words)
+    except CardNameError as e:
+        out.add(f"Sorry, {e}")
+        return None
+    for note in notes:
+        out.add(note)
+    return cards
+
+def record(ctx, EB, action, detail=None):
+    """Records in HISTORY that the player who sent the command did action.
+    Only queues the record, so it costs the command next to nothing."""
+    if HISTORY is not None:
+        HISTORY.record(GameSessions.key(ctx), EB, ctx.message.author.id, action, detail)
+
 #########################################################
 ### Commands
 #########################################################
@@ -278,225 +423,597 @@ async def dragons(ctx):
 @client.command()
 async def join(ctx):
     """Adds this player to the game."""
-    card = EB.add_player(ctx.message.author)
-    if card == None:
-        return
-    hand = EB.hand(ctx.message.author.id)
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as EB:
+        card = EB.add_player(ctx.message.author)
+        if card == None:
+            return
+        hand = EB.hand(ctx.message.author.id)
+        if HISTORY is not None:
+            HISTORY.joined(GameSessions.key(ctx), EB, ctx.message.author)
 
-    await ctx.send("Welcome to the game, {}".format(ctx.message.author.name))
-    await ctx.message.author.send("You draw the card {}, and your hand is {}.".format(card, hand))
+        out.add("Welcome to the game, {}".format(ctx.message.author.name))
+        update_board(ctx)
+        SCHEDULER.to_user(ctx.message.author, "You draw the card {}, and your hand is {}.".format(card, hand))
 
-    print("Added {} to the game.".format(ctx.message.author.name))
+        log.info("Added %s to the game.", ctx.message.author.name, extra=game_fields(ctx))
 
 @client.command()
 async def start(ctx):
     """Starts the game."""
-    EB.start()
-    await ctx.send("Starting game of Ethnos!")
-    await available_cards_message(ctx)
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as EB:
+        if len(EB.turn_order) == 0:
+            out.add("Nobody has joined the game yet.")
+            return
+        EB.start()
+        out.add("Starting game of Ethnos!")
+        update_board(ctx)
+        next_player_message(out, EB)
 
 @client.command()
 async def draw(ctx):
     """Have player draw a random card"""
-    if not EB.started:
-        await ctx.send("You cannot draw a card until the game has been started.")
-        return
-
-    card = EB.draw(ctx.message.author.id)
-    hand = EB.hand(ctx.message.author.id)
-    await ctx.message.author.send("You draw the card {}, and your hand is {}.".format(card, hand))
-    print(ctx.message.author.name, "drew a card.")
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if not EB.started:
+            out.add("You cannot draw a card until the game has been started.")
+            return
+        if not check_turn(out, ctx, EB):
+            return
 
-    # Check dragons
-    await dragons(ctx)
+        dragons_before = EB.dragons
+        card = EB.draw(ctx.message.author.id)
+        EB.end_turn()
+        record(ctx, EB, "draw", card)
+        if dragons_before < 3 <= EB.dragons:
+            record(ctx, EB, "age_over")
+        hand = EB.hand(ctx.message.author.id)
+        SCHEDULER.to_user(ctx.message.author, "You draw the card {}, and your hand is {}.".format(card, hand))
+        log.info("%s drew a card.", ctx.message.author.name, extra=game_fields(ctx))
 
-    if EB.dragons < 3:
-        # Say number of cards in each hand
-        await cards_per_hand(ctx)
+        # Check dragons
+        dragons(out, EB)
+        if dragons_before < 3 <= EB.dragons:
+            age_scores_message(out, ctx, EB)
+            update_board(ctx)
 
-        # Available cards
-        await available_cards_message(ctx)
+        if EB.dragons < 3:
+            # Hand counts and the table are on the status board
+            update_board(ctx)
 
-        # Say next player's turn
-        await next_player_message(ctx)
+            # Say next player's turn
+            next_player_message(out, EB)
 
 @client.command()
 async def pickup(ctx, color, tribe):
     """Have player pickup a card from the table."""
-    if not EB.started:
-        await ctx.send("You cannot pickup a card until the game has been started.")
-        return
-
-    card = f"{color} {tribe}"
-    if EB.available(card):
-        EB.pickup(ctx.message.author.id, card)
-        hand = EB.hand(ctx.message.author.id)
-        await ctx.message.author.send("You pickup the card {}, and your hand is {}.".format(card, hand))
-        await ctx.send(f"{ctx.message.author.name} picked up the card {card}.")
-        print(ctx.message.author.name, "picked up the card", card)
-
-        # Say number of cards in each hand
-        await cards_per_hand(ctx)
-
-        # Available cards
-        await available_cards_message(ctx)
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if not EB.started:
+            out.add("You cannot pickup a card until the game has been started.")
+            return
+        if not check_turn(out, ctx, EB):
+            return
 
-        # Say next player's turn
-        await next_player_message(ctx)
-    else:
-        await ctx.send(f"Sorry, '{color} {tribe}' is not an available card.")
+        cards = parse_cards(out, (color, tribe))
+        if cards is None:
+            return
+        card = cards[0]
+        if EB.available(card):
+            EB.pickup(ctx.message.author.id, card)
+            EB.end_turn()
+            record(ctx, EB, "pickup", card)
+            hand = EB.hand(ctx.message.author.id)
+            SCHEDULER.to_user(ctx.message.author, "You pickup the card {}, and your hand is {}.".format(card, hand))
+            out.add(f"{ctx.message.author.name} picked up the card {card}.")
+            log.info("%s picked up the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
+
+            # Hand counts and the table are on the status board
+            update_board(ctx)
+
+            # Say next player's turn
+            next_player_message(out, EB)
+        else:
+            out.add(f"Sorry, '{card}' is not an available card.")
 
 @pickup.error
 async def pickup_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to pickup, as in `!pickup Red Dwarf` to pickup the card 'Red Dwarf'.")
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to pickup, as in `!pickup Red Dwarf` to pickup the card 'Red Dwarf'.")
 
 
 @client.command()
-async def band(ctx):
-    """Play the card 'card' from the hand."""
-    if not EB.started:
-        await ctx.send("You cannot form a band until the game has been started.")
-        return
+async def band(ctx, *words):
+    """Forms a band from the cards named, the first of which leads it, and puts
+    the rest of the hand on the table. With no cards named, DMs the player the
+    largest bands they could form."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if not EB.started:
+            out.add("You cannot form a band until the game has been started.")
+            return
+        if not check_turn(out, ctx, EB):
+            return
 
-    # Most of the band forming will have to happen manually.
-    hand = EB.hand(ctx.message.author.id)
+        id = ctx.message.author.id
+        if not words:
+            bands = EB.largest_bands(id)
+            if not bands:
+                out.add(f"Sorry {ctx.message.author.name}, you have no cards to form a band with.")
+                return
+            options = "\n".join(f"- {', '.join(band)}" for band in bands)
+            SCHEDULER.to_user(ctx.message.author, f"The largest bands you can form are:\n{options}\n"
+                                                  "Form one with `!band Leader Card Other Cards`, as in `!band Red Dwarf Blue Dwarf`.")
+            return
 
-    await ctx.send("{} is forming a band with the following cards:\n{}".format(ctx.message.author.name, hand))
-    await ctx.send(f"{ctx.message.author.name} should announce which cards are in the band, including the leader.\nThen, make remaining cards available with the `!table Color Tribe` command.")
+        cards = parse_cards(out, words)
+        if cards is None:
+            out.add("Please name every card by color and tribe, leader first, as in `!band Red Dwarf Blue Dwarf`.")
+            return
+        leader = cards[0]
+        problem = EB.band_problem(id, cards, leader)
+        if problem is not None:
+            out.add(f"Sorry {ctx.message.author.name}, you can't form that band. {problem}")
+            return
 
-    print(f"{ctx.message.author.name} is forming a band.")
+        tabled, kingdom = EB.form_band(id, cards, leader)
+        EB.end_turn()
+        record(ctx, EB, "band", ", ".join(cards))
 
+        out.add(f"{ctx.message.author.name} formed a band of {len(cards)} led by {leader}: {', '.join(cards)}.")
+        if kingdom is not None:
+            out.add(f"They placed a control marker in the {kingdom} kingdom.")
+        if tabled:
+            out.add(f"The rest of their hand went to the table: {', '.join(tabled)}.")
+        SCHEDULER.to_user(ctx.message.author, "You just made a band, and your hand is {}.".format(EB.hand(id)))
+        log.info("%s formed a band.", ctx.message.author.name, extra=game_fields(ctx, band=cards, leader=leader))
 
-    # Remove all cards from hand and tell them about it
-    EB.empty_hand(ctx.message.author.id)
+        # Hand counts and the table are on the status board
+        update_board(ctx)
 
-    hand = EB.hand(ctx.message.author.id)
-    await ctx.message.author.send("You just made a band, and your hand is {}.".format(hand))
+        # Say next player's turn
+        next_player_message(out, EB)
 
-    # Say number of cards in each hand
-    await cards_per_hand(ctx)
 
-    # Available cards
-    await available_cards_message(ctx)
+@client.command()
+async def skip(ctx):
+    """Skips the turn of the player whose turn it is, e.g. if they are away."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if not EB.started or EB.turn_order.current is None:
+            out.add("Nobody has a turn until the game has been started.")
+            return
+
+        skipped = client.get_user(EB.turn_order.current)
+        EB.end_turn()
+        record(ctx, EB, "skip", skipped.name)
+        out.add(f"{ctx.message.author.name} skipped {skipped.name}'s turn.")
+        update_board(ctx)
+        next_player_message(out, EB)
+        log.info("%s skipped %s's turn.", ctx.message.author.name, skipped.name, extra=game_fields(ctx))
 
-    # Say next player's turn
-    await next_player_message(ctx)
+@client.command()
+async def leave(ctx):
+    """Removes this player from the game, putting their hand on the table."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if ctx.message.author.id not in EB.players:
+            out.add(f"Sorry {ctx.message.author.name}, you are not in the game.")
+            return
 
+        record(ctx, EB, "leave")
+        EB.remove_player(ctx.message.author.id)
+        out.add(f"{ctx.message.author.name} has left the game.")
+        update_board(ctx)
+        if EB.started and len(EB.turn_order) > 0:
+            next_player_message(out, EB)
+        log.info("%s left the game.", ctx.message.author.name, extra=game_fields(ctx))
 
 @client.command()
 async def hand(ctx):
     """DMs the players hand to them."""
-    hand = EB.hand(ctx.message.author.id)
-    await ctx.message.author.send("Your current hand is {}.".format(hand))
-    print(ctx.message.author.name, "requested to see their hand.")
+    async with SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            SCHEDULER.to_channel(ctx.channel, "There is no game in this channel.")
+            return
+        hand = EB.hand(ctx.message.author.id)
+        SCHEDULER.to_user(ctx.message.author, "Your current hand is {}.".format(hand))
+        log.info("%s requested to see their hand.", ctx.message.author.name, extra=game_fields(ctx))
 
 @client.command()
 async def available(ctx):
     """Tells what cards are available."""
-    await available_cards_message(ctx)
-    print(ctx.message.author.name, "requested to see the available cards.")
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        available_cards_message(out, EB)
+        log.info("%s requested to see the available cards.", ctx.message.author.name, extra=game_fields(ctx))
+
+
+@client.command()
+async def kingdoms(ctx):
+    """Tells how many control markers each player has in each kingdom."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        kingdoms_message(out, EB)
+        log.info("%s requested to see the kingdoms.", ctx.message.author.name, extra=game_fields(ctx))
+
+
+@client.command()
+async def board(ctx):
+    """Posts a new status board for this channel's game, e.g. if the old one
+    was lost."""
+    async with SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            SCHEDULER.to_channel(ctx.channel, "There is no game in this channel.")
+            return
+        key = GameSessions.key(ctx)
+        BOARDS.forget(key)
+        BOARDS.touch(ctx.channel, key)
+
+
+@client.command()
+async def odds(ctx):
+    """Estimates how many more draws there will be before the third Dragon."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        if not EB.started:
+            out.add("The Dragons aren't in the deck until the game has been started.")
+            return
+        if EB.dragons >= 3:
+            out.add("This Age is already over!")
+            return
+        if EB.turn_order.current is None:
+            out.add("Nobody has joined the game.")
+            return
+
+        zone = EB.dragon_zone if EB.dragon_zone is not None else len(EB.deck)
+        stats = dragon_odds.summary(len(EB.deck), EB.dragons, zone, len(EB.turn_order))
+        out.add(f"Expect about {stats['mean']:.1f} more draws before the third Dragon "
+                f"(median {stats['median']}, 80% chance of {stats['p10']} to {stats['p90']}).\n"
+                f"Chance the Age ends within the next {len(EB.turn_order)} draws: {100 * stats['this_round']:.0f}%.")
+        log.info("%s requested the Dragon odds.", ctx.message.author.name, extra=game_fields(ctx))
 
 
 @client.command()
 async def add(ctx, color, tribe):
     """Adds card to player's hand.
     This should only be used for fixing erroneous situations."""
-    c = color.title()
-    t = tribe.title()
-    card = f"{c} {t}"
-    print(f"{ctx.message.author.name} is adding the card {card}.")
-
-    if c not in COLORS or t not in TRIBES:
-        await ctx.send(f"Sorry, {card} is not a legal card name; check spelling.")
-    else:
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        cards = parse_cards(out, (color, tribe))
+        if cards is None:
+            return
+        card = cards[0]
+        log.info("%s is adding the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
+
         EB.add_card(ctx.message.author.id, card)
-        await ctx.send(f"{ctx.message.author.name} added card {card} to their hand.")
+        out.add(f"{ctx.message.author.name} added card {card} to their hand.")
+        update_board(ctx)
         hand = EB.hand(ctx.message.author.id)
-        await ctx.message.author.send("You add the card {}, and your hand is {}.".format(card, hand))
+        SCHEDULER.to_user(ctx.message.author, "You add the card {}, and your hand is {}.".format(card, hand))
 
 @add.error
 async def add_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to add to your hand, as in `!add Red Dwarf` to add the card 'Red Dwarf' to your hand.")
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to add to your hand, as in `!add Red Dwarf` to add the card 'Red Dwarf' to your hand.")
 
 @client.command()
 async def discard(ctx, color, tribe):
     """Discards card from player's hand.
     This should only be used for fixing erroneous situations."""
-    c = color.title()
-    t = tribe.title()
-    card = f"{c} {t}"
-    print(f"{ctx.message.author.name} is discarding the card {card}.")
-
-    if c not in COLORS or t not in TRIBES:
-        await ctx.send(f"Sorry, {card} is not a legal card name; check spelling.")
-    elif card not in EB.hand(ctx.message.author.id):
-        await ctx.send(f"Sorry, {card} is not in your hand.")
-    else:
-        EB.play(ctx.message.author.id, card)
-        await ctx.send(f"{ctx.message.author.name} discarded card {card} from their hand.")
-        hand = EB.hand(ctx.message.author.id)
-        await ctx.message.author.send("You discard the card {}, and your hand is {}.".format(card, hand))
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        cards = parse_cards(out, (color, tribe))
+        if cards is None:
+            return
+        card = cards[0]
+        log.info("%s is discarding the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
+
+        if card not in EB.hand(ctx.message.author.id):
+            out.add(f"Sorry, {card} is not in your hand.")
+        else:
+            EB.play(ctx.message.author.id, card)
+            out.add(f"{ctx.message.author.name} discarded card {card} from their hand.")
+            update_board(ctx)
+            hand = EB.hand(ctx.message.author.id)
+            SCHEDULER.to_user(ctx.message.author, "You discard the card {}, and your hand is {}.".format(card, hand))
 
 @discard.error
 async def discard_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to discard from your hand, as in `!discard Red Dwarf` to discard the card 'Red Dwarf' from your hand.")
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to discard from your hand, as in `!discard Red Dwarf` to discard the card 'Red Dwarf' from your hand.")
 
 @client.command()
 async def table(ctx, color, tribe):
     """Puts card on Table out of thin air.
     This should only be used for fixing erroneous situations."""
-    c = color.title()
-    t = tribe.title()
-    card = f"{c} {t}"
-    print(f"{ctx.message.author.name} is tabling the card {card}.")
-
-    if c not in COLORS or t not in TRIBES:
-        await ctx.send(f"Sorry, {card} is not a legal card name; check spelling.")
-    else:
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        cards = parse_cards(out, (color, tribe))
+        if cards is None:
+            return
+        card = cards[0]
+        log.info("%s is tabling the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
+
         EB.table_card(card)
-        await available_cards_message(ctx)
+        available_cards_message(out, EB)
+        update_board(ctx)
 
 @table.error
 async def table_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to put on the table, as in `!table Red Dwarf` to put the card 'Red Dwarf' on the table.")
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to put on the table, as in `!table Red Dwarf` to put the card 'Red Dwarf' on the table.")
 
 @client.command()
 async def detable(ctx, color, tribe):
     """Removes card from Table to thin air.
     This should only be used for fixing erroneous situations."""
-    c = color.title()
-    t = tribe.title()
-    card = f"{c} {t}"
-    print(f"{ctx.message.author.name} is untabling the card {card}.")
-
-    if c not in COLORS or t not in TRIBES:
-        await ctx.send(f"Sorry, {card} is not a legal card name; check spelling.")
-    elif not EB.available(card):
-        await ctx.send(f"Sorry, {card} is not on the table.")
-    else:
-        EB.detable_card(card)
-        await available_cards_message(ctx)
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        cards = parse_cards(out, (color, tribe))
+        if cards is None:
+            return
+        card = cards[0]
+        log.info("%s is untabling the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
+
+        if not EB.available(card):
+            out.add(f"Sorry, {card} is not on the table.")
+        else:
+            EB.detable_card(card)
+            available_cards_message(out, EB)
+            update_board(ctx)
 
 @detable.error
 async def detable_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to remove from the table, as in `!detable Red Dwarf` to remove the card 'Red Dwarf' from the table.")
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to remove from the table, as in `!detable Red Dwarf` to remove the card 'Red Dwarf' from the table.")
 
 
 @client.command(aliases=["pickle"])
 async def pickle_cards(ctx):
     """Pickles gamestate for loading later."""
-    EB.pickle_ethnos_bot()
-    await ctx.send("Gamestate has been pickled.")
-    print("Gamestate has been pickled.")
+    started = time.perf_counter()
+
+    # Encoding the snapshot under the game's lock gets a consistent copy of
+    # the state, and is quick; the file is written in a thread
+    async with SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            SCHEDULER.to_channel(ctx.channel, "There is no game in this channel.")
+            return
+        data = EB.to_bytes()
+    try:
+        filename = await asyncio.get_event_loop().run_in_executor(
+            None, save_backup, data, backup_prefix(GameSessions.key(ctx)), BACKUP_KEEP)
+    except OSError as e:
+        SCHEDULER.to_channel(ctx.channel, "Sorry, the gamestate could not be saved.")
+        log.warning("Could not save a backup: %s", e, extra=game_fields(ctx))
+        return
+
+    seconds = time.perf_counter() - started
+    METRICS.observe("backup", seconds)
+    SCHEDULER.to_channel(ctx.channel, f"Gamestate has been pickled to {filename} in {1000 * seconds:.1f}ms.")
+    log.info("Gamestate has been pickled.", extra=game_fields(ctx, file=filename, bytes=len(data), seconds=seconds))
+
+@client.command()
+async def end(ctx):
+    """Ends the game in this channel, so a new one can be started."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx, create=False) as EB:
+        if EB is None:
+            out.add("There is no game in this channel.")
+            return
+        key = GameSessions.key(ctx)
+        SESSIONS.retire(key)
+        forget_game(key, EB, "finished" if EB.dragons >= 3 else "ended early")
+        out.add("The game in this channel has ended.")
+    log.info("%s ended the game in channel %s.", ctx.message.author.name, ctx.channel.id, extra=game_fields(ctx))
+
+
+# Leaderboards, by the argument to !leaderboard, and the action they count
+LEADERBOARDS = {"games": None, "wins": "age_win", "draws": "draw", "pickups": "pickup", "bands": "band"}
 
+@client.command()
+async def stats(ctx, user: discord.User = None):
+    """Tells how many games a player has played and what they did in them."""
+    user = user if user is not None else ctx.message.author
+    if HISTORY is None:
+        SCHEDULER.to_channel(ctx.channel, "Game history is not being recorded.")
+        return
 
+    # Queries run in a thread, so they never hold up other games' commands
+    stats = await asyncio.get_event_loop().run_in_executor(None, HISTORY.player_stats, user.id)
+    if stats is None:
+        SCHEDULER.to_channel(ctx.channel, f"{user.name} has not played any games of Ethnos yet.")
+        return
+    actions = stats["actions"]
+    last_played = time.strftime("%Y-%m-%d", time.localtime(stats["last_played"]))
+    SCHEDULER.to_channel(ctx.channel, f"{user.name} has played {stats['games']} games of Ethnos, most recently on {last_played}.\n"
+                                      f"Cards drawn: {actions.get('draw', 0)}, cards picked up: {actions.get('pickup', 0)}, "
+                                      f"bands formed: {actions.get('band', 0)}, Ages won: {actions.get('age_win', 0)}.")
 
-if auth_key == '':
-    print("Invalid auth key for bot")
-else:
-    client.run(auth_key)
+@client.command()
+async def leaderboard(ctx, board="games"):
+    """Lists the players with the most games, wins, draws, pickups or bands."""
+    if board not in LEADERBOARDS:
+        SCHEDULER.to_channel(ctx.channel, "Sorry, there are leaderboards for " + ", ".join(LEADERBOARDS) + ".")
+        return
+    if HISTORY is None:
+        SCHEDULER.to_channel(ctx.channel, "Game history is not being recorded.")
+        return
+
+    rows = await asyncio.get_event_loop().run_in_executor(None, HISTORY.leaderboard, LEADERBOARDS[board])
+    if not rows:
+        SCHEDULER.to_channel(ctx.channel, "Nobody has played any games of Ethnos yet.")
+        return
+    lines = [f"{rank}. {name}: {count}" for rank, (name, count) in enumerate(rows, 1)]
+    SCHEDULER.to_channel(ctx.channel, f"Most {board}:\n" + "\n".join(lines))
+
+
+@client.command()
+async def sendstats(ctx):
+    """Reports the outgoing message queues and send latencies."""
+    stats = SCHEDULER.metrics()
+    SCHEDULER.to_channel(ctx.channel, "\n".join(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+                                                for name, value in stats.items()))
+
+
+#########################################################
+### Starting the bot
+#########################################################
+
+def check_games(filenames):
+    """Loads and validates saved games without connecting to Discord. Returns
+    the number of games with problems."""
+    bad_games = 0
+    for filename in filenames:
+        try:
+            EB = EthnosBot.load_ethnos_bot(filename)
+        except JournalLockedError:
+            print(f"{filename}: in use by a running bot, skipped")
+            continue
+        EB.close_journal()
+        problems = EB.validate()
+        print(f"{filename}: {len(EB.turn_order)} players, {len(EB.deck)} cards in the deck, "
+              f"{EB.dragons} Dragons drawn: {'problems found' if problems else 'OK'}")
+        for problem in problems:
+            print("  " + problem)
+        bad_games += bool(problems)
+    return bad_games
+
+def supervise(shard_count, argv, backup=None):
+    """Runs shard_count worker processes with the command line arguments
+    argv, restarting any that crash, until they all exit cleanly or this
+    process is interrupted. The saved game backup, if given, is loaded only
+    when the workers first start: a restarted worker recovers its games from
+    their journals instead."""
+    workers = {}
+
+    def launch(shard_id, first=False):
+        loaded = [backup] if first and backup is not None else []
+        command = [sys.executable, os.path.abspath(__file__), *loaded, *argv,
+                   "--shard", str(shard_id), "--shards", str(shard_count)]
+        workers[shard_id] = subprocess.Popen(command)
+        log.info("Started shard %d of %d.", shard_id, shard_count)
+
+    try:
+        for shard_id in range(shard_count):
+            if shard_id > 0:
+                time.sleep(IDENTIFY_INTERVAL)
+            launch(shard_id, first=True)
+
+        while workers:
+            time.sleep(1)
+            for shard_id, process in list(workers.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                if code == 0:
+                    del workers[shard_id]
+                    continue
+                log.warning("Shard %d exited with code %d; restarting it.", shard_id, code)
+                time.sleep(RESTART_DELAY)
+                launch(shard_id)
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
+
+def main():
+    global LOADED_EB, METRICS_FILE, HISTORY, SPECTATORS, SPECTATE_PORT
+    parser = argparse.ArgumentParser(description="Discord bot for playing Ethnos.")
+    parser.add_argument("backup", nargs="?", help="saved game to load into the home channel")
+    parser.add_argument("--check", action="store_true",
+                        help="validate saved games and exit without connecting")
+    parser.add_argument("--log", metavar="FILE", help="write logs to FILE instead of stdout")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_FILE,
+                        help=f"file to dump metrics to (default {METRICS_FILE})")
+    parser.add_argument("--history", metavar="FILE", default=HISTORY_FILE,
+                        help=f"SQLite database of game history (default {HISTORY_FILE})")
+    parser.add_argument("--spectate", type=int, metavar="PORT",
+                        help=f"serve games read-only to spectators on {SPECTATE_HOST}:PORT")
+    parser.add_argument("--shards", type=int, metavar="N",
+                        help="run as N worker processes, one per Discord shard")
+    parser.add_argument("--shard", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.check:
+        if args.backup is not None:
+            filenames = [args.backup]
+        else:
+            filenames = [prefix + ".ckpt" for prefix in GameJournal.find(GAMES_DIR, "ethnos_")]
+        sys.exit(1 if check_games(filenames) else 0)
+
+    with open("ethnos.key", "r") as f:
+        auth_key = f.read().strip()
+    if auth_key == '':
+        print("Invalid auth key for bot")
+        return
+
+    if args.shards is not None and args.shard is None:
+        listener = setup_logging(args.log)
+        argv = []
+        if args.log is not None:
+            argv += ["--log", args.log]
+        argv += ["--metrics", args.metrics, "--history", args.history]
+        if args.spectate is not None:
+            argv += ["--spectate", str(args.spectate)]
+        try:
+            supervise(args.shards, argv, args.backup)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.stop()
+        return
+    if args.shard is not None:
+        if args.shards is None:
+            parser.error("--shard needs --shards")
+        use_shard(args.shard, args.shards)
+
+    listener = setup_logging(shard_path(args.log) if args.log is not None else None)
+    METRICS_FILE = shard_path(args.metrics)
+    recover_games()
+    HISTORY = GameRecorder(HistoryStore(args.history), "ethnos", owns)
+    HISTORY.end_missing(SESSIONS.games, "lost")
+    if args.backup is not None:
+        LOADED_EB = EthnosBot.load_ethnos_bot(args.backup)
+        LOADED_EB.close_journal()
+    if args.spectate is not None:
+        SPECTATE_PORT = args.spectate + (SHARD_ID or 0)
+        SPECTATORS = SpectatorServer(lambda key: public_state(SESSIONS.games.get(key)),
+                                     lambda: list(SESSIONS.games))
+
+    startup = time.perf_counter() - STARTED_AT
+    log.info("Started in %.3fs.", startup)
+    if startup > STARTUP_BUDGET:
+        log.warning("Startup took longer than the %ss budget.", STARTUP_BUDGET)
+    try:
+        client.run(auth_key)
+    finally:
+        HISTORY.close()
+        listener.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,671 @@
+"""
+Game engine for Ethnos, with no dependency on Discord.
+
+The Discord front end is ethnos_bot.py; ethnos_sim.py plays simulated games
+with this engine.
+"""
+
+import datetime, glob, itertools, os, random
+from collections import Counter
+
+from event_log import GameJournal
+from snapshots import write_atomically
+from turn_order import TurnOrder
+
+TRIBES = ["Centaur",
+          "Dwarf",
+          # "Elf",
+          "Giant",
+          # "Halfling",
+          # "Merfolk",
+          # "Minotaur",
+          # "Orc",
+          "Skeleton",
+          "Troll",
+          # "Wingfolk",
+          "Wizard"
+          ]
+
+# random.shuffle(TRIBES)
+# print(TRIBES[:6])
+# 1 / 0
+
+COLORS = ["Red", "Green", "Blue", "Gray", "Purple", "Orange"]
+
+# Every card is coded as the integer color index * len(TRIBES) + tribe index
+CARD_NAMES = [f"{color} {tribe}" for color in COLORS for tribe in TRIBES]
+CARD_IDS = {card: id for id, card in enumerate(CARD_NAMES)}
+
+# Card ids in alphabetical order of card name, the order cards are shown in
+SORTED_CARD_IDS = sorted(range(len(CARD_NAMES)), key=CARD_NAMES.__getitem__)
+
+# Points for a band of each size at the end of the Age; bands of more than 6
+# cards score as 6
+BAND_POINTS = [0, 0, 1, 3, 6, 10, 15]
+
+# Glory for the players with the most, second most and third most control
+# markers in a kingdom at the end of the Age. There is a kingdom for every
+# color, and a band places a marker in the kingdom of its leader's color.
+KINGDOM_GLORY = (8, 4, 2)
+
+def card_color(id):
+    """Returns the index in COLORS of the color of the card with id id."""
+    return id // len(TRIBES)
+
+def card_tribe(id):
+    """Returns the index in TRIBES of the tribe of the card with id id."""
+    return id % len(TRIBES)
+
+class CardMultiset:
+    """Multiset of cards, stored as a count for each card id, plus how many
+    cards there are of each tribe and of each color. Adding, removing and
+    checking for a card are O(1); cards come out in sorted order. The string
+    form is cached until the cards change."""
+
+    __slots__ = ("counts", "size", "text", "tribe_counts", "color_counts")
+
+    def __init__(self, cards=()):
+        self.counts = bytearray(len(CARD_NAMES))
+        self.size = 0
+        self.text = None
+        self.tribe_counts = [0] * len(TRIBES)
+        self.color_counts = [0] * len(COLORS)
+        for card in cards:
+            self.add(card)
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Returns a multiset holding counts[id] copies of each card id."""
+        cards = cls()
+        cards.counts[:] = counts
+        cards._reindex()
+        return cards
+
+    def _reindex(self):
+        counts = self.counts
+        tribes = len(TRIBES)
+        self.size = sum(counts)
+        self.tribe_counts = [sum(counts[tribe::tribes]) for tribe in range(tribes)]
+        self.color_counts = [sum(counts[color * tribes:(color + 1) * tribes]) for color in range(len(COLORS))]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, card):
+        id = CARD_IDS.get(card)
+        return id is not None and self.counts[id] > 0
+
+    def __iter__(self):
+        counts = self.counts
+        for id in SORTED_CARD_IDS:
+            for _ in range(counts[id]):
+                yield CARD_NAMES[id]
+
+    def __str__(self):
+        if self.text is None:
+            self.text = str(list(self))
+        return self.text
+
+    __repr__ = __str__
+
+    def count(self, card):
+        """Returns how many copies of card there are."""
+        id = CARD_IDS.get(card)
+        return self.counts[id] if id is not None else 0
+
+    def add(self, card):
+        id = CARD_IDS[card]
+        self.counts[id] += 1
+        self.size += 1
+        self.tribe_counts[card_tribe(id)] += 1
+        self.color_counts[card_color(id)] += 1
+        self.text = None
+
+    def remove(self, card):
+        """Removes one copy of card. Raises ValueError if it isn't present."""
+        if card not in self:
+            raise ValueError(f"{card} is not among the cards")
+        id = CARD_IDS[card]
+        self.counts[id] -= 1
+        self.size -= 1
+        self.tribe_counts[card_tribe(id)] -= 1
+        self.color_counts[card_color(id)] -= 1
+        self.text = None
+
+    def clear(self):
+        self.counts = bytearray(len(CARD_NAMES))
+        self.size = 0
+        self.tribe_counts = [0] * len(TRIBES)
+        self.color_counts = [0] * len(COLORS)
+        self.text = None
+
+    def groups(self):
+        """Returns (count, tribe or color) for every tribe and color among the
+        cards, largest first. Reads only the tribe and color counts."""
+        groups = [(count, TRIBES[tribe]) for tribe, count in enumerate(self.tribe_counts) if count]
+        groups += [(count, COLORS[color]) for color, count in enumerate(self.color_counts) if count]
+        groups.sort(key=lambda group: -group[0])
+        return groups
+
+    def group(self, name):
+        """Returns a list of the cards of the tribe or color name."""
+        if name in TRIBES:
+            ids = [CARD_IDS[f"{color} {name}"] for color in COLORS]
+        else:
+            ids = [CARD_IDS[f"{name} {tribe}"] for tribe in TRIBES]
+        return [CARD_NAMES[id] for id in sorted(ids, key=CARD_NAMES.__getitem__)
+                for _ in range(self.counts[id])]
+
+class Player:
+    """Stores player data"""
+
+    __slots__ = ("name", "cards")
+
+    def __init__(self, name):
+        self.name = name
+        self.cards = CardMultiset()
+
+    def __getstate__(self):
+        return {"name": self.name, "cards": list(self.cards)}
+
+    def __setstate__(self, state):
+        # Backups from the original bot stored hands as lists, and could hold
+        # None from drawing on an empty deck
+        self.name = state["name"]
+        self.cards = CardMultiset(c for c in state["cards"] if c is not None)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def add_card(self, card):
+        self.cards.add(card)
+
+    def remove_card(self, card):
+        self.cards.remove(card)
+
+    def empty_hand(self):
+        self.cards.clear()
+
+def full_deck():
+    """Returns a list of every card in the game, before the Dragons are added."""
+    deck = []
+    for tribe in TRIBES:
+        for color in COLORS:
+            card = f"{color} {tribe}"
+            if tribe == "Halfling":
+                deck.extend([card] * 4)
+            else:
+                deck.extend([card] * 2)
+    return deck
+
+# Number of copies of each card in the game
+CARD_COPIES = Counter(full_deck())
+
+class EthnosBot:
+    """Implements control of Ethnos."""
+
+    def __init__(self):
+        self.deck = full_deck()
+        random.shuffle(self.deck)
+
+        self.started = False
+        self.dragons = 0
+        self.just_drew_dragon = False
+
+        # Number of cards at the bottom of the deck that the Dragons were
+        # shuffled into; None until the game starts
+        self.dragon_zone = None
+
+        self.players = {}
+        self.turn_order = TurnOrder()
+        self.available_cards = CardMultiset()
+
+        # Every band formed, in order, as (player id, leader, cards)
+        self.bands = []
+
+        # Tallies kept up to date as bands are formed: control markers per
+        # player in each kingdom (indexed like COLORS), and band points per
+        # player
+        self.markers = [{} for _ in COLORS]
+        self.band_points = {}
+
+        # Write-ahead journal of state changes, and the sequence number of the
+        # last event recorded in it.
+        self.journal = None
+        self.seq = 0
+
+        # Cached result of cards_per_hand, cleared whenever a hand changes
+        self.hand_counts_text = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["journal"] = None
+        state["hand_counts_text"] = None
+        # The tallies are rebuilt from the bands
+        del state["markers"], state["band_points"]
+        return state
+
+    def __setstate__(self, state):
+        # Backups from before journaling lack these attributes
+        state.setdefault("journal", None)
+        state.setdefault("hand_counts_text", None)
+        state.setdefault("seq", 0)
+        state.setdefault("dragon_zone", None)
+        if isinstance(state["available_cards"], list):
+            state["available_cards"] = CardMultiset(state["available_cards"])
+        # Backups from before turns were tracked have a list of players, and
+        # start with the first player's turn
+        if "player_id_list" in state:
+            state["turn_order"] = TurnOrder(state.pop("player_id_list"))
+        state.setdefault("bands", [])
+        self.__dict__.update(state)
+        self._tally_bands()
+
+    @classmethod
+    def load_ethnos_bot(cls, filename):
+        """Loads a game from a backup, or from a journal checkpoint (.ckpt)
+        in which case the events logged since the checkpoint are replayed and
+        the journal is reattached. Both are compact snapshots, except for
+        backups written by the original bot (.dat), which are dill pickles."""
+        if filename.endswith(".ckpt"):
+            journal = GameJournal(filename[:-len(".ckpt")])
+            bot = cls.from_bytes(journal.read_checkpoint())
+            bot.replay(journal.read_events())
+            bot.journal = journal
+            return bot
+
+        with open(filename, "rb") as f:
+            return cls.from_bytes(f.read(), allow_dill=filename.endswith(".dat"))
+
+    @classmethod
+    def from_bytes(cls, data, allow_dill=False):
+        """Decodes a compact snapshot, or, if allow_dill is True, a dill pickle
+        written by the original bot. Unpickling can run arbitrary code, so
+        only backups the bot wrote itself should be allowed to be pickles."""
+        import ethnos_snapshot
+
+        if ethnos_snapshot.is_snapshot(data) or not allow_dill:
+            return ethnos_snapshot.loads(data)
+
+        import dill
+        return cls._upgrade(dill.loads(data))
+
+    @classmethod
+    def _upgrade(cls, old):
+        """Converts a game pickled by an older version of the bot to the current
+        classes. dill stores classes defined in __main__ along with the
+        object, so old backups unpickle as instances of the old classes, or,
+        when the running __main__ has imported classes of the same names, as
+        instances of the current classes holding the old attributes. Either
+        way the game is rebuilt from its attributes."""
+        state = dict(vars(old))
+        players = {}
+        for id, old_player in state["players"].items():
+            players[id] = Player.__new__(Player)
+            players[id].__setstate__({"name": old_player.name, "cards": list(old_player.cards)})
+        state["players"] = players
+
+        bot = cls.__new__(cls)
+        bot.__setstate__(state)
+        return bot
+
+    def to_bytes(self):
+        """Encodes the game as a compact snapshot."""
+        import ethnos_snapshot
+
+        return ethnos_snapshot.dumps(self)
+
+    def pickle_ethnos_bot(self, prefix="backup_ethnos_bot", keep=None):
+        """Saves a snapshot of the game to a new timestamped backup file. See
+        save_backup. Returns the file name."""
+        return save_backup(self.to_bytes(), prefix, keep)
+
+    def attach_journal(self, prefix):
+        """Starts journaling this game to files starting with prefix, beginning
+        with a checkpoint of the current state."""
+        self.journal = GameJournal(prefix)
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Folds the journal's log into a fresh checkpoint."""
+        self.journal.write_checkpoint(self.to_bytes())
+
+    def close_journal(self, remove=False):
+        """Stops journaling, deleting the journal's files if remove is True."""
+        if self.journal is None:
+            return
+        if remove:
+            self.journal.remove()
+        else:
+            self.journal.close()
+        self.journal = None
+
+    def _record(self, *event):
+        """Appends a state-changing event to the journal, if there is one."""
+        if self.journal is None:
+            return
+        self.seq += 1
+        self.journal.append([self.seq, *event])
+        if self.journal.needs_compaction():
+            self.checkpoint()
+
+    def replay(self, records):
+        """Re-applies journal records that are newer than this state."""
+        journal, self.journal = self.journal, None
+        try:
+            for seq, name, *args in records:
+                if seq <= self.seq:
+                    continue
+                getattr(self, self.REPLAY.get(name, name))(*args)
+                self.seq = seq
+        finally:
+            self.journal = journal
+
+    # Methods used to replay events whose recorded arguments differ from the
+    # public method's arguments
+    REPLAY = {"add_player": "_add_player"}
+
+    def add_player(self, user):
+        """Adds this player to the game, if not already there."""
+        card = self._add_player(user.id, user.name)
+        if card is not None:
+            self._record("add_player", user.id, user.name)
+        return card
+
+    def _add_player(self, id, name):
+        if id in self.turn_order or self.started:
+            return
+
+        self.players[id] = Player(name)
+        self.turn_order.add(id)
+        self.hand_counts_text = None
+
+        # Each player draws a single card at the start
+        return self._draw(id)
+
+    def start(self, deck=None):
+        """Starts the game of Ethnos. When replaying, deck is the deck that
+        resulted from shuffling in the dragons."""
+        if self.started:
+            return
+
+        self.started = True
+
+        # Deal out available cards
+        players = len(self.turn_order)
+        for _ in range(players * 2):
+            self.available_cards.add(self.deck.pop())
+
+        # Add dragon cards
+        half = len(self.deck) // 2
+        first_half = self.deck[:half]
+        second_half = self.deck[half:]
+
+        second_half.extend(["Dragon"] * 3)
+        random.shuffle(second_half)
+        self.deck = second_half + first_half
+        self.dragon_zone = len(second_half)
+
+        if deck is not None:
+            self.deck = deck
+        self._record("start", self.deck)
+
+    def available(self, card):
+        """Checks if card is available, ignoring caps."""
+        c = card.title()
+        return c in self.available_cards
+
+    def draw(self, id):
+        """Draws a card, adds it to player id's hand, and returns it."""
+        card = self._draw(id)
+        self._record("draw", id)
+        return card
+
+    def _draw(self, id):
+        card = None
+
+        while len(self.deck) > 0:
+            card = self.deck.pop()
+            if card == "Dragon":
+                self.dragons += 1
+                self.just_drew_dragon = True
+            else:
+                break
+
+        if card is not None and card != "Dragon":
+            self.players[id].add_card(card)
+            self.hand_counts_text = None
+        return card
+
+    def pickup(self, id, card):
+        """Has player pick up card, adds it to player id's hand."""
+        c = card.title()
+        self.players[id].add_card(c)
+        self.available_cards.remove(c)
+        self.hand_counts_text = None
+        self._record("pickup", id, c)
+
+    def add_card(self, id, card):
+        """Has player add card to hand (out of thin air)."""
+        c = card.title()
+        self.players[id].add_card(c)
+        self.hand_counts_text = None
+        self._record("add_card", id, c)
+
+    def hand(self, id):
+        """Returns hand of player given by id, as a CardMultiset"""
+        return self.players[id].cards
+
+    def empty_hand(self, id):
+        """Empties the player's hand."""
+        self.players[id].empty_hand()
+        self.hand_counts_text = None
+        self._record("empty_hand", id)
+
+    def play(self, id, card):
+        """Plays the card from hand of player id."""
+        self.players[id].remove_card(card)
+        self.hand_counts_text = None
+        self._record("play", id, card)
+
+    def largest_bands(self, id, limit=3):
+        """Returns up to limit of the largest bands player id could form from
+        their hand, largest first, each a list of cards sharing a tribe or a
+        color. A tribe and a color holding the same cards (e.g. a single
+        card) give one band."""
+        hand = self.players[id].cards
+        bands = []
+        for _, name in hand.groups():
+            band = hand.group(name)
+            if band not in bands:
+                bands.append(band)
+                if len(bands) == limit:
+                    break
+        return bands
+
+    def band_problem(self, id, cards, leader):
+        """Returns why player id can't form a band of cards (a list) led by
+        leader, or None if they can."""
+        if not cards:
+            return "A band needs at least one card."
+        if leader not in cards:
+            return f"The leader, {leader}, must be one of the cards in the band."
+        hand = self.players[id].cards
+        for card, count in Counter(cards).items():
+            if card not in CARD_IDS:
+                return f"{card} is not a legal card name; check spelling."
+            if hand.count(card) < count:
+                return f"You don't have {'that many copies of ' if hand.count(card) else ''}{card} in your hand."
+        ids = [CARD_IDS[card] for card in cards]
+        if len({card_tribe(id) for id in ids}) > 1 and len({card_color(id) for id in ids}) > 1:
+            return "The cards in a band must all be of the same tribe or all of the same color."
+        return None
+
+    def form_band(self, id, cards, leader):
+        """Player id forms a band of cards (a list) led by leader, and the rest
+        of their hand goes on the table. Returns the cards put on the table.
+        Raises ValueError if the band isn't legal."""
+        problem = self.band_problem(id, cards, leader)
+        if problem is not None:
+            raise ValueError(problem)
+
+        hand = self.players[id].cards
+        for card in cards:
+            hand.remove(card)
+        leftovers = list(hand)
+        for card in leftovers:
+            self.available_cards.add(card)
+        hand.clear()
+        self.hand_counts_text = None
+
+        band = (id, leader, tuple(cards))
+        self.bands.append(band)
+        placed = self._tally_band(band)
+        self._record("form_band", id, list(cards), leader)
+        return leftovers, COLORS[card_color(CARD_IDS[leader])] if placed else None
+
+    def _tally_band(self, band):
+        """Adds band to the tallies. A band places a control marker in the
+        kingdom of its leader's color if it has more cards than the player
+        has markers there. Returns True if it placed one."""
+        id, leader, cards = band
+        self.band_points[id] = self.band_points.get(id, 0) + BAND_POINTS[min(len(cards), len(BAND_POINTS) - 1)]
+        markers = self.markers[card_color(CARD_IDS[leader])]
+        if len(cards) > markers.get(id, 0):
+            markers[id] = markers.get(id, 0) + 1
+            return True
+        return False
+
+    def _tally_bands(self):
+        """Rebuilds the tallies from the bands."""
+        self.markers = [{} for _ in COLORS]
+        self.band_points = {}
+        for band in self.bands:
+            self._tally_band(band)
+
+    def score_age(self):
+        """Returns the scores at the end of the Age, as a list of (id, band
+        points, kingdom points) for every player, highest total first. Players
+        tied for places in a kingdom split the glory for those places, rounded
+        down. Takes O(kingdoms x players) work on the tallies."""
+        kingdom_points = dict.fromkeys(self.turn_order, 0)
+        for markers in self.markers:
+            ranked = sorted(markers.items(), key=lambda item: -item[1])
+            place = 0
+            while place < min(len(ranked), len(KINGDOM_GLORY)):
+                tied = [id for id, count in ranked[place:] if count == ranked[place][1]]
+                glory = sum(KINGDOM_GLORY[place:place + len(tied)])
+                for id in tied:
+                    kingdom_points[id] += glory // len(tied)
+                place += len(tied)
+
+        scores = [(id, self.band_points.get(id, 0), kingdom_points[id]) for id in self.turn_order]
+        scores.sort(key=lambda score: -(score[1] + score[2]))
+        return scores
+
+    def table_card(self, card):
+        """Adds card to available cards."""
+        self.available_cards.add(card)
+        self._record("table_card", card)
+
+    def detable_card(self, card):
+        """Removes card from available cards."""
+        c = card.title()
+        self.available_cards.remove(c)
+        self._record("detable_card", c)
+
+    def drew_a_dragon(self):
+        """Returns True if a Dragon was drawn. Resets self.just_drew_dragon to False"""
+        result = self.just_drew_dragon
+        self.just_drew_dragon = False
+        if result:
+            self._record("drew_a_dragon")
+        return result
+
+    def validate(self):
+        """Checks the game state for inconsistencies. Returns a list of
+        problems, which is empty if the state is consistent."""
+        problems = []
+        if sorted(self.players) != sorted(self.turn_order):
+            problems.append("The players and the turn order don't match.")
+        if self.players and self.turn_order.current not in self.players:
+            problems.append("It is the turn of someone who isn't playing.")
+
+        dragons_in_deck = self.deck.count("Dragon")
+        if self.started and self.dragons + dragons_in_deck != 3:
+            problems.append(f"{self.dragons} Dragons were drawn but {dragons_in_deck} are left in the deck.")
+        if not self.started and dragons_in_deck:
+            problems.append("There are Dragons in the deck before the game has started.")
+
+        counts = Counter(card for card in self.deck if card != "Dragon")
+        counts.update(self.available_cards)
+        for player in self.players.values():
+            counts.update(player.cards)
+        for card, count in sorted(counts.items()):
+            if card not in CARD_COPIES:
+                problems.append(f"Unknown card {card}.")
+            elif count > CARD_COPIES[card]:
+                problems.append(f"There are {count} copies of {card}, but only {CARD_COPIES[card]} in the game.")
+        return problems
+
+    def cards_per_hand(self):
+        """Returns a string of the number of cards per hand for each player."""
+        if self.hand_counts_text is None:
+            self.hand_counts_text = "\n".join("{} has {} cards.".format(self.players[id].name, len(self.players[id]))
+                                              for id in self.turn_order)
+        return self.hand_counts_text
+
+    def next_player(self, id):
+        """Returns the id of the player seated after player id."""
+        return self.turn_order.next_after(id)
+
+    def is_turn(self, id):
+        """Returns True if it is player id's turn."""
+        return self.turn_order.current == id
+
+    def end_turn(self):
+        """Ends the current player's turn. Returns the id of the player whose
+        turn it is now."""
+        current = self.turn_order.advance()
+        self._record("end_turn")
+        return current
+
+    def remove_player(self, id):
+        """Removes player id from the game, putting their hand on the table. If
+        it was their turn, it is now the next player's."""
+        player = self.players.pop(id)
+        self.turn_order.remove(id)
+        self.hand_counts_text = None
+        for card in player.cards:
+            self.available_cards.add(card)
+        # Their bands and markers leave with them
+        if any(band[0] == id for band in self.bands):
+            self.bands = [band for band in self.bands if band[0] != id]
+            self._tally_bands()
+        self._record("remove_player", id)
+
+def save_backup(data, prefix="backup_ethnos_bot", keep=None):
+    """Atomically writes data, a snapshot, to a new backup file
+    prefix_DATETIME.eth, then deletes all but the newest keep backups with
+    prefix, if keep is given. DATETIME has microseconds, and gets a counter
+    if another backup has the same name, so backups saved at the same time
+    never overwrite each other. Returns the file name. Only does file I/O,
+    so it can run in a thread."""
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+    for attempt in itertools.count():
+        filename = f"{prefix}_{stamp}{f'_{attempt}' if attempt else ''}.eth"
+        try:
+            write_atomically(filename, data, replace=False)
+            break
+        except FileExistsError:
+            continue
+
+    if keep is not None:
+        backups = sorted(glob.glob(glob.escape(prefix) + "_????-??-??_??-??-??-??????*.eth"))
+        for old in backups[:-keep]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                # Another backup being saved at the same time deleted it
+                pass
+    return filename
@@ -0,0 +1,144 @@
+"""
+Plays randomized games of Ethnos with the engine, without Discord, and
+reports statistics about them.
+
+Usage:
+python3 ethnos_sim.py --games 1000000 --players 4
+
+Games are spread over a pool of worker processes (one per core by default).
+Each simulated player takes a random action every turn: draw a card, pick up
+a card from the table, or form a band from the largest group of cards of one
+tribe or color in their hand. A player with a full hand always forms a band.
+A game lasts one age, ending when the third Dragon is drawn.
+"""
+
+import argparse, multiprocessing, os, random, statistics, time
+from types import SimpleNamespace
+
+from ethnos_engine import EthnosBot
+
+# Players must form a band when they have this many cards
+HAND_LIMIT = 10
+
+# Relative chances of each action when a player has a choice
+DRAW_WEIGHT = 5
+PICKUP_WEIGHT = 3
+BAND_WEIGHT = 1
+
+# Stops a game that somehow never ends
+MAX_TURNS = 1000
+
+def form_band(EB, id):
+    """Forms the largest band possible, led by its first card, putting the
+    rest of the hand on the table. Returns the band."""
+    band = EB.largest_bands(id, 1)[0]
+    EB.form_band(id, band, band[0])
+    return band
+
+def play_game(players):
+    """Plays one random game and returns a dict describing it."""
+    EB = EthnosBot()
+    for id in range(players):
+        EB.add_player(SimpleNamespace(id=id, name=f"Player {id}"))
+    EB.start()
+
+    dragon_turns = []
+    bands = 0
+    exhausted = False
+    turn = 0
+    while EB.dragons < 3 and turn < MAX_TURNS:
+        turn += 1
+        id = EB.turn_order.current
+        hand_size = len(EB.players[id])
+
+        if hand_size >= HAND_LIMIT:
+            action = "band"
+        else:
+            choices = ["draw"]
+            weights = [DRAW_WEIGHT]
+            if len(EB.available_cards) > 0:
+                choices.append("pickup")
+                weights.append(PICKUP_WEIGHT)
+            if hand_size > 0:
+                choices.append("band")
+                weights.append(BAND_WEIGHT)
+            action = random.choices(choices, weights)[0]
+
+        if action == "draw":
+            if len(EB.deck) == 0:
+                exhausted = True
+                break
+            dragons = EB.dragons
+            EB.draw(id)
+            dragon_turns.extend([turn] * (EB.dragons - dragons))
+        elif action == "pickup":
+            EB.pickup(id, random.choice(list(EB.available_cards)))
+        else:
+            form_band(EB, id)
+            bands += 1
+
+        EB.end_turn()
+
+    return {"turns": turn,
+            "dragon_turns": dragon_turns,
+            "bands": bands,
+            "exhausted": exhausted,
+            "deck_left": len(EB.deck)}
+
+def simulate_batch(args):
+    """Plays count games and returns their summaries. Run in worker processes."""
+    seed, count, players = args
+    random.seed(seed)
+    return [play_game(players) for _ in range(count)]
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def describe(name, values):
+    """Returns a line summarizing values."""
+    if not values:
+        return f"{name}: no data"
+    values = sorted(values)
+    return (f"{name}: mean {statistics.fmean(values):.1f}, "
+            f"median {percentile(values, 0.5)}, "
+            f"5th-95th percentile {percentile(values, 0.05)}-{percentile(values, 0.95)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate random games of Ethnos.")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=500, help="games per task sent to a worker")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    seeds = random.Random(args.seed)
+    batches = []
+    remaining = args.games
+    while remaining > 0:
+        count = min(args.batch, remaining)
+        batches.append((seeds.getrandbits(64), count, args.players))
+        remaining -= count
+
+    start = time.perf_counter()
+    results = []
+    with multiprocessing.Pool(args.workers) as pool:
+        for batch in pool.imap_unordered(simulate_batch, batches):
+            results.extend(batch)
+    elapsed = time.perf_counter() - start
+
+    print(f"Played {len(results)} games with {args.players} players "
+          f"on {args.workers} workers in {elapsed:.2f}s "
+          f"({len(results) / elapsed:.0f} games/second).")
+    print(describe("Game length (turns)", [r["turns"] for r in results]))
+    for dragon in range(3):
+        turns = [r["dragon_turns"][dragon] for r in results if len(r["dragon_turns"]) > dragon]
+        print(describe(f"Dragon {dragon + 1} drawn on turn", turns))
+    print(describe("Bands formed", [r["bands"] for r in results]))
+    print(describe("Cards left in deck", [r["deck_left"] for r in results]))
+    exhausted = sum(r["exhausted"] for r in results)
+    print(f"Deck exhausted before the age ended: {exhausted} games "
+          f"({100 * exhausted / len(results):.2f}%).")
+
+if __name__ == "__main__":
+    main()
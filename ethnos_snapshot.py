@@ -0,0 +1,268 @@
+"""
+Compact binary snapshots of EthnosBot.
+
+A snapshot stores the deck, the table and every hand as packed arrays of
+integer card ids instead of pickled objects, so it is small, fast to write,
+independent of the engine's class layout and safe to load from an untrusted
+file (unlike the dill pickles the original bot wrote as .dat backups, which
+are only loaded from files with that extension). The layout of the colors and tribes used for card ids is stored in the
+snapshot, so snapshots still load if TRIBES changes.
+
+Format (little-endian):
+    header      magic "ETHN", version u16, flags u8 (1 = started,
+                2 = just drew a Dragon), dragons u8, dragon zone u16
+                (0xFFFF = none), journal sequence number u64, layout
+                length u16, deck length u16, player count u16, seat of the
+                player whose turn it is u16 (0xFFFF = none), band count u16,
+                bands length in bytes u32
+    layout      "Color,Color,...|Tribe,Tribe,..." in UTF-8
+    table       one count byte per card id
+    deck        one byte per card, from the bottom of the deck up; 255 is a
+                Dragon
+    bands       per band in the order they were formed: seat of the player
+                who formed it u16, leader card id u8, card count u8, then
+                the card ids
+    players     per player in seat order: id u64, name offset u32, name
+                length u16, then one count byte per card id
+    names       the players' names in UTF-8
+
+Every section has a size given by the header, so a SnapshotView can decode
+any part on its own. Loading reads the whole snapshot and decodes all of it.
+
+Usage:
+python3 ethnos_snapshot.py migrate backup_ethnos_bot_DATETIME.dat ...
+python3 ethnos_snapshot.py bench
+"""
+
+import struct, sys, time
+
+from ethnos_engine import EthnosBot, Player, CardMultiset, CARD_IDS, CARD_NAMES, COLORS, TRIBES
+from turn_order import TurnOrder
+
+MAGIC = b"ETHN"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHBBHQHHHHHI")
+PLAYER = struct.Struct("<QIH")
+BAND = struct.Struct("<HBB")
+
+STARTED = 1
+JUST_DREW_DRAGON = 2
+
+DRAGON = 255
+NO_ZONE = 0xFFFF
+NO_PLAYER = 0xFFFF
+
+def layout():
+    """Returns the current card id layout, as stored in snapshots."""
+    return ",".join(COLORS) + "|" + ",".join(TRIBES)
+
+def is_snapshot(data):
+    """Returns True if data (bytes) starts like a snapshot."""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+def dumps(EB):
+    """Encodes EB as snapshot bytes."""
+    card_layout = layout().encode()
+    flags = (STARTED if EB.started else 0) | (JUST_DREW_DRAGON if EB.just_drew_dragon else 0)
+    zone = NO_ZONE if EB.dragon_zone is None else EB.dragon_zone
+    seats = list(EB.turn_order)
+    seat_of = {id: seat for seat, id in enumerate(seats)}
+    current = NO_PLAYER if EB.turn_order.current is None else seat_of[EB.turn_order.current]
+    bands = b"".join(BAND.pack(seat_of[id], CARD_IDS[leader], len(cards)) + bytes(CARD_IDS[card] for card in cards)
+                     for id, leader, cards in EB.bands)
+
+    parts = [HEADER.pack(MAGIC, VERSION, flags, EB.dragons, zone, EB.seq,
+                         len(card_layout), len(EB.deck), len(seats), current,
+                         len(EB.bands), len(bands)),
+             card_layout,
+             bytes(EB.available_cards.counts),
+             bytes(DRAGON if card == "Dragon" else CARD_IDS[card] for card in EB.deck),
+             bands]
+
+    names = []
+    offset = 0
+    for id in seats:
+        player = EB.players[id]
+        name = player.name.encode()
+        parts.append(PLAYER.pack(id, offset, len(name)))
+        parts.append(bytes(player.cards.counts))
+        names.append(name)
+        offset += len(name)
+    parts.extend(names)
+    return b"".join(parts)
+
+def loads(data):
+    """Decodes snapshot bytes into an EthnosBot."""
+    return SnapshotView(data).to_bot()
+
+class SnapshotView:
+    """Read-only view of a snapshot that decodes sections on demand."""
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        if not is_snapshot(self.buffer):
+            raise ValueError("Not an Ethnos snapshot.")
+        (_, version, flags, self.dragons, zone, self.seq, layout_length, self.deck_size,
+         self.player_count, current, self.band_count, bands_length) = HEADER.unpack_from(self.buffer)
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}.")
+        self.current_seat = None if current == NO_PLAYER else current
+
+        self.started = bool(flags & STARTED)
+        self.just_drew_dragon = bool(flags & JUST_DREW_DRAGON)
+        self.dragon_zone = None if zone == NO_ZONE else zone
+
+        offset = HEADER.size
+        colors, tribes = bytes(self.buffer[offset:offset + layout_length]).decode().split("|")
+        offset += layout_length
+        colors = colors.split(",")
+        tribes = tribes.split(",")
+        self.card_count = len(colors) * len(tribes)
+
+        # Maps card ids in the snapshot to card ids in the running code
+        if colors == COLORS and tribes == TRIBES:
+            self.id_map = None
+        else:
+            self.id_map = [CARD_IDS.get(f"{color} {tribe}") for color in colors for tribe in tribes]
+
+        self.table_offset = offset
+        self.deck_offset = self.table_offset + self.card_count
+        self.bands_offset = self.deck_offset + self.deck_size
+        self.players_offset = self.bands_offset + bands_length
+        self.player_size = PLAYER.size + self.card_count
+        self.names_offset = self.players_offset + self.player_count * self.player_size
+
+    def _multiset(self, offset):
+        counts = self.buffer[offset:offset + self.card_count]
+        if self.id_map is None:
+            return CardMultiset.from_counts(counts)
+
+        remapped = bytearray(len(CARD_NAMES))
+        for id, count in enumerate(counts):
+            if count:
+                if self.id_map[id] is None:
+                    raise ValueError("Snapshot holds cards of a tribe that is no longer in the game.")
+                remapped[self.id_map[id]] += count
+        return CardMultiset.from_counts(remapped)
+
+    def table(self):
+        """Returns the available cards as a CardMultiset."""
+        return self._multiset(self.table_offset)
+
+    def _card(self, id):
+        """Returns the name of the card with id id in the snapshot."""
+        if self.id_map is None:
+            return CARD_NAMES[id]
+        if self.id_map[id] is None:
+            raise ValueError("Snapshot holds cards of a tribe that is no longer in the game.")
+        return CARD_NAMES[self.id_map[id]]
+
+    def deck(self):
+        """Returns the deck as a list of card names."""
+        return ["Dragon" if id == DRAGON else self._card(id)
+                for id in self.buffer[self.deck_offset:self.bands_offset]]
+
+    def bands(self):
+        """Returns the bands as a list of (seat, leader, cards)."""
+        bands = []
+        offset = self.bands_offset
+        for _ in range(self.band_count):
+            seat, leader, count = BAND.unpack_from(self.buffer, offset)
+            offset += BAND.size
+            cards = tuple(self._card(id) for id in self.buffer[offset:offset + count])
+            offset += count
+            bands.append((seat, self._card(leader), cards))
+        return bands
+
+    def player(self, index):
+        """Returns (id, name, hand) of the player in seat index."""
+        offset = self.players_offset + index * self.player_size
+        id, name_offset, name_length = PLAYER.unpack_from(self.buffer, offset)
+        start = self.names_offset + name_offset
+        name = bytes(self.buffer[start:start + name_length]).decode()
+        return id, name, self._multiset(offset + PLAYER.size)
+
+    def to_bot(self):
+        """Decodes the whole snapshot into an EthnosBot."""
+        state = {"deck": self.deck(),
+                 "started": self.started,
+                 "dragons": self.dragons,
+                 "just_drew_dragon": self.just_drew_dragon,
+                 "dragon_zone": self.dragon_zone,
+                 "available_cards": self.table(),
+                 "players": {},
+                 "turn_order": TurnOrder(),
+                 "seq": self.seq}
+        seats = []
+        for index in range(self.player_count):
+            id, name, hand = self.player(index)
+            seats.append(id)
+            player = Player(name)
+            player.cards = hand
+            state["players"][id] = player
+            state["turn_order"].add(id)
+            if index == self.current_seat:
+                state["turn_order"].set_current(id)
+        state["bands"] = [(seats[seat], leader, cards) for seat, leader, cards in self.bands()]
+
+        # __setstate__ fills in defaults for anything not stored here
+        EB = EthnosBot.__new__(EthnosBot)
+        EB.__setstate__(state)
+        return EB
+
+#########################################################
+### Migration and benchmark
+#########################################################
+
+def migrate(filename):
+    """Converts a dill backup to a snapshot next to it. Returns the new
+    file's name."""
+    EB = EthnosBot.load_ethnos_bot(filename)
+    new_filename = filename.rsplit(".", 1)[0] + ".eth"
+    with open(new_filename, "wb") as f:
+        f.write(dumps(EB))
+    return new_filename
+
+def sample_game(players=5, turns=40):
+    """Returns a game partway through, for benchmarking."""
+    from types import SimpleNamespace
+
+    EB = EthnosBot()
+    for id in range(players):
+        EB.add_player(SimpleNamespace(id=10 ** 17 + id, name=f"Player {id}"))
+    EB.start()
+    for turn in range(turns):
+        EB.draw(EB.turn_order.current)
+        EB.end_turn()
+    return EB
+
+def bench(repeat=2000):
+    """Prints the size and save/load times of snapshots and dill pickles."""
+    import dill
+
+    EB = sample_game()
+    for name, save, load in (("snapshot", dumps, loads), ("dill", dill.dumps, dill.loads)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            data = save(EB)
+        save_time = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            load(data)
+        load_time = (time.perf_counter() - start) / repeat
+
+        print(f"{name:>8}: {len(data):6d} bytes, save {save_time * 1e6:8.1f}us, load {load_time * 1e6:8.1f}us")
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "migrate":
+        for filename in sys.argv[2:]:
+            print(f"{filename} -> {migrate(filename)}")
+    elif len(sys.argv) == 2 and sys.argv[1] == "bench":
+        bench()
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main()
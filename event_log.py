@@ -0,0 +1,126 @@
+"""
+Write-ahead journal for game state.
+
+A journal is a checkpoint file (PREFIX.ckpt) holding a full snapshot of a
+game, plus an append-only log (PREFIX.log) of the events applied since that
+snapshot, one JSON list per line. Every event carries a sequence number and
+the snapshot records the last sequence number it includes, so replaying the
+log after a crash never applies an event twice.
+
+Writes are flushed to the OS on every append, but fsync is batched: it runs
+after every sync_every events or once sync_interval seconds have passed since
+the last one.
+
+A journal is locked (with flock, where available) while it is open, so
+several bot processes sharing a games directory never write the same game.
+The lock dies with its process, so after a crash any process can take the
+game over.
+"""
+
+import glob, json, os, time
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows, where the bot only runs as one process
+    fcntl = None
+
+from snapshots import write_atomically
+
+class JournalLockedError(Exception):
+    """Raised when opening a journal that another process has open."""
+
+class GameJournal:
+    """Checkpoint plus event log for a single game."""
+
+    def __init__(self, prefix, sync_every=16, sync_interval=1.0, compact_every=500):
+        self.prefix = prefix
+        self.checkpoint_path = prefix + ".ckpt"
+        self.log_path = prefix + ".log"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.log = open(self.log_path, "a", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.log.close()
+                raise JournalLockedError(f"{prefix} is open in another process") from None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.entries = sum(1 for _ in self.read_events())
+
+    @staticmethod
+    def find(directory, name_prefix):
+        """Returns the prefixes of all journals in directory whose file names
+        start with name_prefix."""
+        pattern = os.path.join(directory, glob.escape(name_prefix) + "*.ckpt")
+        return sorted(path[:-len(".ckpt")] for path in glob.glob(pattern))
+
+    def append(self, record):
+        """Appends record (a JSON-serializable list) to the log."""
+        self.log.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.log.flush()
+        self.entries += 1
+        self.unsynced += 1
+
+        if (self.unsynced >= self.sync_every
+                or time.monotonic() - self.last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """Forces all appended events to disk."""
+        if self.unsynced:
+            os.fsync(self.log.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        """Returns True once the log is long enough to fold into a checkpoint."""
+        return self.entries >= self.compact_every
+
+    def write_checkpoint(self, data):
+        """Atomically replaces the checkpoint with data (bytes) and empties the
+        log. The data must include the sequence number of the last event."""
+        write_atomically(self.checkpoint_path, data)
+
+        # If we crash before truncating, replay skips the events already in
+        # the checkpoint by their sequence numbers.
+        self.log.truncate(0)
+        self.sync()
+        self.entries = 0
+
+    def read_checkpoint(self):
+        """Returns the bytes of the checkpoint."""
+        with open(self.checkpoint_path, "rb") as f:
+            return f.read()
+
+    def read_events(self):
+        """Yields the records in the log, in order. A torn final line from a
+        crash in the middle of a write is ignored."""
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return
+                yield json.loads(line)
+
+    def close(self):
+        """Syncs and closes the log."""
+        if not self.log.closed:
+            self.sync()
+            self.log.close()
+
+    def remove(self):
+        """Closes the journal and deletes its files."""
+        self.close()
+        for path in (self.checkpoint_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,201 @@
+"""
+In-process stand-ins for the discord.py objects the bots' commands use, so
+commands can be run without connecting to Discord.
+
+A FakeGateway stands in for Discord's API when messages are sent or edited:
+it can add latency to every request, and enforce Discord's per-destination
+rate limit, making a request that exceeds it wait out the 429 response's
+retry-after as discord.py does.
+
+Usage:
+with fake_bot("ethnos_bot", FakeGateway(latency=0.05)) as (ethnos_bot, users):
+    ctx = FakeContext(users.get_or_create(1), channel_id=10)
+    await ethnos_bot.draw.callback(ctx)
+"""
+
+import asyncio, collections, contextlib, importlib, random, shutil, sys, tempfile, time, types
+
+from game_sessions import GameSessions
+from send_scheduler import SendScheduler
+from status_board import StatusBoards
+
+class FakeGateway:
+    """Simulates the time Discord takes to accept messages. Every send takes
+    latency seconds plus up to jitter more. If rate_limit is given, as
+    (messages, seconds), a destination that has been sent that many messages
+    within the last that many seconds answers with a 429, and the send waits
+    until it would be accepted."""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=(5, 5.0)):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.recent = {}
+
+        # Metrics
+        self.sent = 0
+        self.edited = 0
+        self.rate_limited = 0
+        self.retry_wait = 0.0
+
+    async def deliver(self, destination, text):
+        """Sends text to destination. Returns the FakeMessage."""
+        await self._request(destination)
+        destination.sent.append(text)
+        self.sent += 1
+        return FakeMessage(destination, text)
+
+    async def edit(self, message, text):
+        await self._request(message.channel)
+        message.content = text
+        message.edits += 1
+        self.edited += 1
+
+    async def _request(self, destination):
+        """Waits as long as Discord would take to accept a request to
+        destination."""
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+
+        if self.rate_limit is not None:
+            messages, seconds = self.rate_limit
+            recent = self.recent.setdefault(id(destination), collections.deque())
+            while True:
+                now = time.monotonic()
+                while recent and now - recent[0] >= seconds:
+                    recent.popleft()
+                if len(recent) < messages:
+                    break
+                retry_after = recent[0] + seconds - now
+                self.rate_limited += 1
+                self.retry_wait += retry_after
+                await asyncio.sleep(retry_after)
+            recent.append(time.monotonic())
+
+class FakeMessageable:
+    """Something that can be sent messages: a user's DMs or a channel. Keeps
+    everything sent to it in sent."""
+
+    def __init__(self, id, gateway=None):
+        self.id = id
+        self.gateway = gateway
+        self.sent = []
+
+    async def send(self, text):
+        if self.gateway is None:
+            self.sent.append(text)
+            return FakeMessage(self, text)
+        return await self.gateway.deliver(self, text)
+
+class FakeMessage:
+    """A message sent to channel, which can be edited and pinned."""
+
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.edits = 0
+        self.pinned = False
+
+    async def edit(self, content):
+        if self.channel.gateway is None:
+            self.content = content
+            self.edits += 1
+        else:
+            await self.channel.gateway.edit(self, content)
+
+    async def pin(self):
+        self.pinned = True
+
+class FakeUser(FakeMessageable):
+
+    def __init__(self, id, name=None, gateway=None):
+        super().__init__(id, gateway)
+        self.name = name if name is not None else f"Player {id}"
+        self.mention = f"<@{id}>"
+
+class FakeChannel(FakeMessageable):
+    pass
+
+class FakeGuild:
+
+    def __init__(self, id):
+        self.id = id
+
+class FakeContext:
+    """Context of a command sent by user in the channel with id channel_id.
+    Contexts for the same channel share their FakeChannel through channels,
+    which sends through the gateway of the first user seen in the channel."""
+
+    channels = {}
+
+    def __init__(self, user, channel_id, guild_id=1):
+        self.author = user
+        self.message = types.SimpleNamespace(author=user)
+        self.guild = FakeGuild(guild_id) if guild_id else None
+        self.channel = self.channels.get((guild_id, channel_id))
+        if self.channel is None:
+            self.channel = FakeChannel(channel_id, user.gateway)
+            self.channels[(guild_id, channel_id)] = self.channel
+
+    async def send(self, text):
+        return await self.channel.send(text)
+
+class FakeUsers(dict):
+    """FakeUsers by id, all sending through gateway."""
+
+    def __init__(self, gateway=None):
+        super().__init__()
+        self.gateway = gateway
+
+    def get_or_create(self, id, name=None):
+        user = self.get(id)
+        if user is None:
+            user = FakeUser(id, name, self.gateway)
+            self[id] = user
+        return user
+
+def use_fake_users(bot_module, users):
+    """Makes bot_module's client look users up in users (a FakeUsers) rather
+    than in its cache of Discord users, which is empty without a connection."""
+    bot_module.client.get_user = users.get
+
+def import_bot(name):
+    """Imports the bot module name. discord.py's client needs a current event
+    loop when it is created, and asyncio.run leaves none behind."""
+    if name not in sys.modules:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    return importlib.import_module(name)
+
+@contextlib.contextmanager
+def fake_bot(module_name, gateway=None, scheduler=None):
+    """Imports the bot module_name and points it at fake Discord users, fresh
+    sessions and a temporary games directory. Messages go out through
+    scheduler, which by default is unthrottled. Yields the module and its
+    FakeUsers, and puts the module back as it was afterwards."""
+    module = import_bot(module_name)
+    saved = {name: getattr(module, name) for name in ("SESSIONS", "SCHEDULER", "GAMES_DIR", "BOARDS")}
+    directory = tempfile.mkdtemp()
+    users = FakeUsers(gateway)
+    use_fake_users(module, users)
+    FakeContext.channels.clear()
+
+    module.SESSIONS = GameSessions(module.SESSIONS.factory,
+                                   max_idle=module.SESSIONS.max_idle,
+                                   on_evict=module.SESSIONS.on_evict)
+    if scheduler is None:
+        scheduler = SendScheduler(limit=None, global_limit=None)
+    module.SCHEDULER = scheduler
+    module.GAMES_DIR = directory
+    module.BOARDS = StatusBoards(module.BOARDS.render, scheduler, module.BOARDS.delay)
+    try:
+        yield module, users
+    finally:
+        module.BOARDS.close()
+        for game in module.SESSIONS.games.values():
+            if hasattr(game, "close_journal"):
+                game.close_journal()
+        if hasattr(module, "WRITER"):
+            module.WRITER.flush()
+        for name, value in saved.items():
+            setattr(module, name, value)
+        shutil.rmtree(directory)
@@ -0,0 +1,107 @@
+"""
+Registry of concurrent games, so a single bot process can host a separate
+game in every channel.
+
+Usage:
+SESSIONS = GameSessions(lambda key: EthnosBot())
+
+async with SESSIONS.session(ctx) as game:
+    ...
+"""
+
+import asyncio
+import contextlib
+import time
+
+class GameSessions:
+    """Maps (guild id, channel id) keys to game objects, creating games on
+    demand. Every game has its own asyncio.Lock, so commands within one game
+    run one at a time while commands for other games proceed.
+
+    If max_idle is given (in seconds), games that haven't been used for that
+    long are evicted. Eviction is checked lazily when sessions are opened, at
+    most once every sweep_interval seconds, and on_evict(key, game) is called
+    for every evicted game."""
+
+    def __init__(self, factory, max_idle=None, sweep_interval=60, on_evict=None):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.games = {}
+        self.locks = {}
+        self.last_used = {}
+        self.max_idle = max_idle
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, key):
+        return key in self.games
+
+    @staticmethod
+    def key(ctx):
+        """Returns the session key for the channel a command was sent in.
+        Direct messages have no guild, so they use 0 for the guild id."""
+        guild_id = ctx.guild.id if ctx.guild is not None else 0
+        return (guild_id, ctx.channel.id)
+
+    def get(self, key, create=True):
+        """Returns the game for key, creating it if needed and create is True."""
+        game = self.games.get(key)
+        if game is None and create:
+            game = self.factory(key)
+            self.games[key] = game
+        return game
+
+    def add(self, key, game):
+        """Registers an existing game (e.g. one loaded from a backup) under key."""
+        self.games[key] = game
+        self.last_used[key] = time.monotonic()
+
+    def retire(self, key):
+        """Removes the game for key and returns it, or None if there wasn't one."""
+        self.locks.pop(key, None)
+        self.last_used.pop(key, None)
+        return self.games.pop(key, None)
+
+    def lock(self, key):
+        """Returns the lock that serializes commands for the game at key."""
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[key] = lock
+        return lock
+
+    def evict_idle(self, now=None):
+        """Retires every game that has been idle for longer than max_idle and
+        isn't in use. Returns the list of evicted keys."""
+        if now is None:
+            now = time.monotonic()
+        self.last_sweep = now
+        if self.max_idle is None:
+            return []
+
+        evicted = []
+        for key, last_used in list(self.last_used.items()):
+            if now - last_used > self.max_idle and not self.lock(key).locked():
+                game = self.retire(key)
+                evicted.append(key)
+                if self.on_evict is not None:
+                    self.on_evict(key, game)
+        return evicted
+
+    @contextlib.asynccontextmanager
+    async def session(self, ctx, create=True):
+        """Holds the lock for ctx's game and yields the game."""
+        now = time.monotonic()
+        if now - self.last_sweep > self.sweep_interval:
+            self.evict_idle(now)
+
+        key = self.key(ctx)
+        async with self.lock(key):
+            try:
+                yield self.get(key, create)
+            finally:
+                if key in self.games:
+                    self.last_used[key] = time.monotonic()
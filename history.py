@@ -0,0 +1,244 @@
+"""
+SQLite store of every game's players, actions and outcomes, for player
+statistics and leaderboards.
+
+Writes never touch the database on the caller's thread: they are queued and
+a background thread inserts them in batches, one transaction per batch.
+Queries open their own connection, so the bots run them in an executor.
+
+Tables:
+    players         user_id, latest name
+    games           id, bot, guild_id, channel_id, started_at, ended_at,
+                    outcome (NULL while the game is in progress)
+    game_players    game_id, user_id, seat
+    actions         game_id, user_id, action, detail, at
+
+A bot records its games through a GameRecorder, which keeps track of the
+history id of the game in each channel.
+
+Usage:
+HISTORY = GameRecorder(HistoryStore("history.sqlite3"), "ethnos")
+HISTORY.joined(key, EB, user)
+HISTORY.record(key, EB, user.id, "draw", "Red Dwarf")
+HISTORY.end(key, "finished")
+"""
+
+import logging, queue, sqlite3, threading, time, uuid
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    bot TEXT NOT NULL,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    outcome TEXT
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    PRIMARY KEY (game_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS actions (
+    game_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    detail TEXT,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_open ON games (bot, ended_at);
+CREATE INDEX IF NOT EXISTS game_players_user ON game_players (user_id);
+CREATE INDEX IF NOT EXISTS actions_user ON actions (user_id, action);
+CREATE INDEX IF NOT EXISTS actions_game ON actions (game_id);
+"""
+
+class HistoryStore:
+    """Game history in the SQLite database at path, written from a background
+    thread in batches of up to batch_size, at most flush_interval seconds
+    after they are queued."""
+
+    def __init__(self, path, batch_size=500, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+        self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    #########################################################
+    ### Writing
+    #########################################################
+
+    def _write(self, sql, params):
+        self.queue.put((sql, params))
+
+    def start_game(self, bot, key):
+        """Records a new game of bot in the channel with session key key.
+        Returns the game's id."""
+        game_id = uuid.uuid4().hex
+        guild_id, channel_id = key
+        self._write("INSERT INTO games (id, bot, guild_id, channel_id, started_at) VALUES (?, ?, ?, ?, ?)",
+                    (game_id, bot, guild_id, channel_id, time.time()))
+        return game_id
+
+    def add_player(self, game_id, user_id, name, seat):
+        self._write("INSERT INTO players (user_id, name) VALUES (?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET name = excluded.name",
+                    (user_id, name))
+        self._write("INSERT OR IGNORE INTO game_players (game_id, user_id, seat) VALUES (?, ?, ?)",
+                    (game_id, user_id, seat))
+
+    def record(self, game_id, user_id, action, detail=None):
+        """Records that user_id did action (e.g. "draw") in the game, with
+        optional detail (e.g. the card)."""
+        self._write("INSERT INTO actions (game_id, user_id, action, detail, at) VALUES (?, ?, ?, ?, ?)",
+                    (game_id, user_id, action, detail, time.time()))
+
+    def end_game(self, game_id, outcome):
+        self._write("UPDATE games SET ended_at = ?, outcome = ? WHERE id = ?",
+                    (time.time(), outcome, game_id))
+
+    def _run(self):
+        connection = self.connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            try:
+                with connection:
+                    for sql, params in batch:
+                        connection.execute(sql, params)
+            except sqlite3.Error as e:
+                log.warning("Could not write %d history records: %s", len(batch), e)
+            if stopping:
+                connection.close()
+                return
+
+    def close(self):
+        """Writes everything queued so far and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    #########################################################
+    ### Queries
+    #########################################################
+
+    def open_games(self, bot):
+        """Returns {session key: game id} for bot's games that haven't ended."""
+        with self.connect() as connection:
+            rows = connection.execute("SELECT guild_id, channel_id, id FROM games "
+                                      "WHERE bot = ? AND ended_at IS NULL", (bot,)).fetchall()
+        return {(guild_id, channel_id): game_id for guild_id, channel_id, game_id in rows}
+
+    def player_stats(self, bot, user_id):
+        """Returns a dict of user_id's games of bot and how many times they did
+        each action, or None if they have never played."""
+        with self.connect() as connection:
+            games, last_played = connection.execute(
+                "SELECT COUNT(*), MAX(g.started_at) FROM game_players p JOIN games g ON g.id = p.game_id "
+                "WHERE p.user_id = ? AND g.bot = ?", (user_id, bot)).fetchone()
+            if games == 0:
+                return None
+            actions = connection.execute(
+                "SELECT a.action, COUNT(*) FROM actions a JOIN games g ON g.id = a.game_id "
+                "WHERE a.user_id = ? AND g.bot = ? GROUP BY a.action", (user_id, bot)).fetchall()
+        return {"games": games, "last_played": last_played, "actions": dict(actions)}
+
+    def leaderboard(self, bot, action=None, limit=10):
+        """Returns [(name, count)] for the players of bot who played the most
+        games, or who did action the most times if it is given."""
+        with self.connect() as connection:
+            if action is None:
+                return connection.execute(
+                    "SELECT pl.name, COUNT(*) AS n FROM game_players p "
+                    "JOIN games g ON g.id = p.game_id JOIN players pl ON pl.user_id = p.user_id "
+                    "WHERE g.bot = ? GROUP BY p.user_id ORDER BY n DESC LIMIT ?", (bot, limit)).fetchall()
+            return connection.execute(
+                "SELECT pl.name, COUNT(*) AS n FROM actions a "
+                "JOIN games g ON g.id = a.game_id JOIN players pl ON pl.user_id = a.user_id "
+                "WHERE g.bot = ? AND a.action = ? GROUP BY a.user_id ORDER BY n DESC LIMIT ?",
+                (bot, action, limit)).fetchall()
+
+class GameRecorder:
+    """Records one bot's games in store. Games are identified by their session
+    key; a game's history begins the first time anything is recorded for it,
+    with the players already seated in it. Games whose history was left open
+    when the bot last stopped carry on where they left off.
+
+    When the bot runs as several processes, owns(key) says whether this one
+    hosts the game with session key key; other processes' games are left
+    alone."""
+
+    def __init__(self, store, bot, owns=None):
+        self.store = store
+        self.bot = bot
+        self.ids = {key: game_id for key, game_id in store.open_games(bot).items()
+                    if owns is None or owns(key)}
+
+    def game_id(self, key, game):
+        """Returns the history id of game, the game with session key key."""
+        game_id = self.ids.get(key)
+        if game_id is None:
+            game_id = self.ids[key] = self.store.start_game(self.bot, key)
+            for seat, id in enumerate(game.turn_order):
+                self.store.add_player(game_id, id, game.players[id].name, seat)
+        return game_id
+
+    def joined(self, key, game, user):
+        """Records that user was just seated in game."""
+        if key not in self.ids:
+            self.game_id(key, game)
+        else:
+            self.store.add_player(self.ids[key], user.id, user.name, len(game.turn_order) - 1)
+
+    def record(self, key, game, user_id, action, detail=None):
+        self.store.record(self.game_id(key, game), user_id, action, detail)
+
+    def end(self, key, outcome):
+        """Records that the game with session key key is over, if it has a
+        history."""
+        game_id = self.ids.pop(key, None)
+        if game_id is not None:
+            self.store.end_game(game_id, outcome)
+
+    def end_missing(self, keys, outcome):
+        """Ends the history of every open game whose key isn't in keys, e.g.
+        because its saved state was lost."""
+        for key in set(self.ids) - set(keys):
+            self.end(key, outcome)
+
+    def player_stats(self, user_id):
+        return self.store.player_stats(self.bot, user_id)
+
+    def leaderboard(self, action=None, limit=10):
+        return self.store.leaderboard(self.bot, action, limit)
+
+    def close(self):
+        self.store.close()
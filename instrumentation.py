@@ -0,0 +1,167 @@
+"""
+Metrics and structured logging for the bots.
+
+Metrics are kept in memory, cheaply enough to record on every command:
+counters, gauges (functions read when the metrics are dumped) and
+histograms with fixed buckets. METRICS.dump_periodically writes them all as
+JSON to a file every so often, off the event loop.
+
+Logs are JSON objects, one per line. Handlers only put records on a queue;
+a background thread formats and writes them, so a slow stdout never blocks
+the event loop.
+
+Usage:
+log = logging.getLogger("ethnos_bot")
+listener = setup_logging()
+log.info("drew a card", extra=game_fields(ctx))
+METRICS.observe("command.draw", seconds)
+"""
+
+import asyncio, bisect, json, logging, logging.handlers, queue, sys, time
+
+from snapshots import write_atomically
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf")]
+
+class Histogram:
+    """Counts of observed values in BUCKETS, plus their count, sum and
+    maximum. Percentiles are estimated as the upper bound of the bucket they
+    fall in."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Returns an upper bound on the given percentile (0-1)."""
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns a JSON-serializable dict describing the histogram."""
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+                "max": self.max,
+                "buckets": {str(bound): count for bound, count in zip(BUCKETS, self.counts) if count}}
+
+class Metrics:
+    """Named counters, gauges and histograms."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, function):
+        """Registers function, which returns the current value of name."""
+        self.gauges[name] = function
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[name] = histogram
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def snapshot(self):
+        """Returns every metric as a JSON-serializable dict."""
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {"time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": gauges,
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+    async def dump_periodically(self, path, interval):
+        """Writes a snapshot of the metrics to path every interval seconds. The
+        snapshot is taken on the event loop, and written from a thread."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            data = json.dumps(self.snapshot(), indent=1).encode()
+            try:
+                await loop.run_in_executor(None, write_atomically, path, data)
+            except OSError as e:
+                logging.getLogger(__name__).warning("Could not write metrics to %s: %s", path, e)
+
+METRICS = Metrics()
+
+#########################################################
+### Logging
+#########################################################
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects. Fields passed as
+    extra={"fields": {...}} are included."""
+
+    def format(self, record):
+        entry = {"time": round(record.created, 3),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(filename=None, level=logging.INFO):
+    """Sends log records to filename, or stdout, as JSON lines written from a
+    background thread. Returns the QueueListener; call its stop method to
+    flush the logs on exit."""
+    if filename is None:
+        handler = logging.StreamHandler(sys.stdout)
+    else:
+        handler = logging.FileHandler(filename, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(records))
+
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
+
+def game_fields(ctx, **fields):
+    """Returns the extra argument for logging about a command: the game's
+    session key and the player, plus any other fields given."""
+    guild_id = ctx.guild.id if ctx.guild is not None else 0
+    fields.update(game=f"{guild_id}/{ctx.channel.id}",
+                  user=ctx.message.author.id,
+                  name=ctx.message.author.name)
+    return {"fields": fields}
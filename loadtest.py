@@ -0,0 +1,280 @@
+"""
+Load test for the bots: a scripted load generator drives their real command
+functions against the fake Discord gateway in fake_discord.py.
+
+Usage:
+python3 loadtest.py --bot ethnos --games 200 --rate 2000 --duration 10
+python3 loadtest.py --bot ninety_nine --latency 0.05 --no-rate-limit
+
+Commands arrive at --rate per second on average (Poisson arrivals), each for
+a random one of --games tables of --players players. Every table plays its
+game through: players join, the game starts, players draw, pick up, form
+bands and play cards, each on their own turn, while other players look at
+their hands and the table, and when a game ends a new one begins. Commands are
+not awaited one by one, so commands for the same game queue on its lock as
+they would in the bot.
+
+A command's latency runs from when it was due to arrive until its handler
+returns, so a backed-up event loop shows up as latency instead of quietly
+lowering the rate. Messages go out through a SendScheduler with the bot's
+real pacing, to a gateway that takes --latency seconds per send and answers
+with a 429 when a destination gets more than 5 messages in 5 seconds.
+
+Reported: throughput, command latency percentiles, messages sent, 429s and
+delivery latency, status board edits, and event loop lag, measured by a task that sleeps
+LAG_INTERVAL seconds at a time and records how late it wakes up.
+"""
+
+import abc, argparse, asyncio, random, time
+from collections import Counter
+
+from fake_discord import FakeContext, FakeGateway, fake_bot
+from send_scheduler import SendScheduler
+
+# Seconds between event loop lag samples
+LAG_INTERVAL = 0.01
+
+# Relative chances of each command during a game
+ETHNOS_WEIGHTS = {"draw": 60, "pickup": 12, "band": 5, "hand": 10, "available": 10, "odds": 3}
+NINETY_NINE_WEIGHTS = {"draw": 45, "play": 45, "hand": 10}
+
+class Table(abc.ABC):
+    """A channel with players, and the commands its game needs next. Each bot
+    has a subclass that knows its commands."""
+
+    def __init__(self, module, channel_id, users, first_user_id, players):
+        self.module = module
+        self.key = (1, channel_id)
+        self.contexts = [FakeContext(users.get_or_create(first_user_id + i), channel_id)
+                         for i in range(players)]
+        self.by_id = {ctx.message.author.id: ctx for ctx in self.contexts}
+
+        # Joining, starting, ending and taking a turn are sent one at a time,
+        # so that every command is valid when it runs. Meanwhile players only
+        # look at their hands.
+        self.busy = False
+        self.joined = 0
+
+    def game(self):
+        return self.module.SESSIONS.games.get(self.key)
+
+    def turn_command(self, name):
+        """Returns the command name from the player whose turn it is, marking
+        the table busy until it is done, since it ends the turn."""
+        self.busy = True
+        return name, getattr(self.module, name), self.by_id[self.game().turn_order.current], ()
+
+    def lifecycle(self, name, ctx):
+        """Returns the command name from ctx, marking the table busy until it is
+        done."""
+        self.busy = True
+        return name, getattr(self.module, name), ctx, ()
+
+    @abc.abstractmethod
+    def next_command(self):
+        """Returns (name, command, ctx, args) for the next command, or None if
+        there is nothing to send until a command finishes."""
+
+    def look(self, name, game_ready):
+        """Returns the command name from a random player if game_ready, to send
+        while the table is busy."""
+        if not game_ready:
+            return None
+        return name, getattr(self.module, name), random.choice(self.contexts), ()
+
+class EthnosTable(Table):
+
+    def next_command(self):
+        EB = self.game()
+        if self.busy:
+            return self.look("hand", EB is not None and EB.started)
+        if EB is None or self.joined < len(self.contexts):
+            self.joined += 1
+            return self.lifecycle("join", self.contexts[self.joined - 1])
+        if not EB.started:
+            return self.lifecycle("start", self.contexts[0])
+        if EB.dragons >= 3 or len(EB.deck) == 0:
+            self.joined = 0
+            return self.lifecycle("end", self.contexts[0])
+
+        name = random.choices(list(ETHNOS_WEIGHTS), list(ETHNOS_WEIGHTS.values()))[0]
+        if name == "pickup" and len(EB.available_cards) == 0:
+            name = "draw"
+        if name == "band" and len(EB.hand(EB.turn_order.current)) == 0:
+            name = "draw"
+        if name == "pickup":
+            name, command, ctx, _ = self.turn_command(name)
+            return name, command, ctx, tuple(random.choice(list(EB.available_cards)).split())
+        if name == "band":
+            band = EB.largest_bands(EB.turn_order.current, 1)[0]
+            name, command, ctx, _ = self.turn_command(name)
+            return name, command, ctx, tuple(" ".join(band).split())
+        if name == "draw":
+            return self.turn_command(name)
+        return name, getattr(self.module, name), random.choice(self.contexts), ()
+
+class NinetyNineTable(Table):
+
+    def next_command(self):
+        NNB = self.game()
+        if self.busy:
+            return self.look("_99hand", NNB is not None and self.joined == len(self.contexts))
+        if NNB is None or self.joined < len(self.contexts):
+            self.joined += 1
+            return self.lifecycle("_99join", self.contexts[self.joined - 1])
+        if len(NNB.deck) == 0 and all(len(player) == 0 for player in NNB.players.values()):
+            # 99 has no command to end a game, so drop it as an idle game
+            # would be
+            self.module.SESSIONS.retire(self.key)
+            self.module.forget_game(self.key, NNB)
+            self.joined = 0
+            return self.next_command()
+
+        name = random.choices(list(NINETY_NINE_WEIGHTS), list(NINETY_NINE_WEIGHTS.values()))[0]
+        if name == "hand":
+            return "_99hand", self.module._99hand, random.choice(self.contexts), ()
+
+        hand = NNB.hand(NNB.turn_order.current)
+        if name == "draw" and len(NNB.deck) == 0:
+            name = "play"
+        if name == "play" and len(hand) == 0:
+            # Nothing to play or draw, so pass
+            name = "skip" if len(NNB.deck) == 0 else "draw"
+        name, command, ctx, _ = self.turn_command("_99" + name)
+        if name == "_99play":
+            return name, command, ctx, (str(random.choice(list(hand))),)
+        return name, command, ctx, ()
+
+BOTS = {"ethnos": ("ethnos_bot", EthnosTable),
+        "ninety_nine": ("ninety_nine", NinetyNineTable)}
+
+def percentiles(values, fractions=(0.5, 0.9, 0.99, 0.999)):
+    """Returns a line of the given percentiles and the maximum of values, in
+    milliseconds."""
+    if not values:
+        return "no data"
+    values = sorted(values)
+    parts = [f"p{100 * f:g} {1000 * values[min(len(values) - 1, int(f * len(values)))]:.2f}ms"
+             for f in fractions]
+    return ", ".join(parts + [f"max {1000 * values[-1]:.2f}ms"])
+
+async def run_load(module, tables, rate, duration):
+    """Sends commands to tables at rate per second for duration seconds.
+    Returns a dict of what happened."""
+    latencies = []
+    lag = []
+    counts = Counter()
+    errors = Counter()
+    skipped = 0
+    in_flight = set()
+    done = False
+
+    async def monitor():
+        while not done:
+            before = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag.append(time.monotonic() - before - LAG_INTERVAL)
+
+    async def issue(table, exclusive, name, command, ctx, args, due):
+        try:
+            await command.callback(ctx, *args)
+        except Exception as e:
+            errors[f"{name}: {type(e).__name__}"] += 1
+        finally:
+            if exclusive:
+                table.busy = False
+        latencies.append(time.monotonic() - due)
+
+    monitor_task = asyncio.get_event_loop().create_task(monitor())
+    start = time.monotonic()
+    due = start
+    while due - start < duration:
+        due += random.expovariate(rate)
+        ahead = due - time.monotonic()
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+        table = random.choice(tables)
+        was_busy = table.busy
+        command = table.next_command()
+        if command is None:
+            skipped += 1
+            continue
+        counts[command[0]] += 1
+        exclusive = table.busy and not was_busy
+        task = asyncio.get_event_loop().create_task(issue(table, exclusive, *command, due))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.wait(list(in_flight))
+    elapsed = time.monotonic() - start
+    done = True
+    await monitor_task
+
+    return {"elapsed": elapsed,
+            "latencies": latencies,
+            "lag": lag,
+            "counts": counts,
+            "errors": errors,
+            "skipped": skipped,
+            "scheduler": module.SCHEDULER.metrics(),
+            "boards": module.BOARDS.metrics()}
+
+def report(results, gateway, rate):
+    commands = len(results["latencies"])
+    print(f"Ran {commands} commands in {results['elapsed']:.2f}s: "
+          f"{commands / results['elapsed']:.0f} commands/second (target {rate:g}).")
+    print("Commands: " + ", ".join(f"{name} {count}" for name, count in results["counts"].most_common()))
+    if results["skipped"]:
+        print(f"Arrivals skipped while a table was setting up a game: {results['skipped']}")
+    print("Command latency: " + percentiles(results["latencies"]))
+    for error, count in results["errors"].most_common():
+        print(f"  Error {error}: {count}")
+
+    stats = results["scheduler"]
+    print(f"Messages: {stats['sent']} sent, {stats['failed']} failed, {stats['queued']} still queued "
+          f"(deepest queue {stats['max_depth']}), {gateway.rate_limited} 429 responses "
+          f"({gateway.retry_wait:.1f}s waited in all)")
+    print(f"Delivery latency: mean {1000 * stats['mean_latency']:.1f}ms, max {1000 * stats['max_latency']:.1f}ms")
+    boards = results["boards"]
+    print(f"Status boards: {boards['posted']} posted, {boards['edited']} edits, "
+          f"{boards['skipped']} unchanged updates skipped, {boards['failed']} failed")
+    print("Event loop lag: " + percentiles(results["lag"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a bot against a fake Discord gateway.")
+    parser.add_argument("--bot", choices=sorted(BOTS), default="ethnos")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=1000, help="commands per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per send")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per send")
+    parser.add_argument("--no-rate-limit", action="store_true", help="never answer with a 429")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="send without the scheduler's pacing")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    gateway = FakeGateway(args.latency, args.jitter, None if args.no_rate_limit else (5, 5.0))
+    scheduler = SendScheduler(limit=None, global_limit=None) if args.unthrottled else SendScheduler()
+    module_name, table_class = BOTS[args.bot]
+
+    with fake_bot(module_name, gateway, scheduler) as (module, users):
+        tables = [table_class(module, channel_id, users, channel_id * args.players, args.players)
+                  for channel_id in range(args.games)]
+
+        async def run():
+            try:
+                return await run_load(module, tables, args.rate, args.duration)
+            finally:
+                module.SCHEDULER.close()
+                module.BOARDS.close()
+
+        results = asyncio.run(run())
+    report(results, gateway, args.rate)
+
+if __name__ == "__main__":
+    main()
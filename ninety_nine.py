@@ -1,33 +1,148 @@
 """
 Bot to implement Game of 99
 
-To do:
-- pickle the contents of NNB after every play so I could resume a crashed game.
+Every channel gets its own game (and its own deck), so several groups can
+play at once.
+
+Every game is saved to games/ after each change, and games that were in
+progress when the bot stopped are restored on startup.
+
+Each game has a pinned status board showing whose turn it is, the deck and
+how many cards each player holds, edited in place as the game goes on.
+
+Logs are written to stdout (or --log FILE) as JSON lines, and metrics
+(command latencies, sends, games and players) are dumped to
+ninety_nine_metrics.json (or --metrics FILE) every METRICS_INTERVAL seconds.
+
+Every game's players and moves are recorded in history.sqlite3 (or
+--history FILE), for the 99stats and 99leaderboard commands.
+
+With --spectate PORT, the public state of every game (turn, deck and hand
+counts) is served read-only on localhost:PORT, over HTTP and as WebSocket
+updates; see spectator.py.
+
+Usage:
+python3 ninety_nine.py
+
+OR to check the saved games without connecting to Discord:
+python3 ninety_nine.py --check
 """
 
+import time
+
+# Used to measure how long startup takes, to keep it within STARTUP_BUDGET
+STARTED_AT = time.perf_counter()
+
 import discord
 import discord.ext
 import discord.ext.commands
-import random
+import argparse, asyncio, random, json, glob, logging, os, sys
+
+from game_sessions import GameSessions
+from history import GameRecorder, HistoryStore
+from instrumentation import METRICS, game_fields, setup_logging
+from outbox import Outbox
+from send_scheduler import SendScheduler, TURN
+from snapshots import SnapshotWriter
+from spectator import SpectatorServer
+from status_board import StatusBoards
+from turn_order import TurnOrder
 
 client = discord.ext.commands.Bot(command_prefix = '99')
 
-with open("ninety_nine.key", "r") as f:
-    auth_key = f.read().strip()
+log = logging.getLogger("ninety_nine")
+
+# Seconds that startup may take before connecting to Discord
+STARTUP_BUDGET = 1.0
+
+DECK_SIZE = 100
+
+class CardSet:
+    """Set of cards 0-99, stored as the bits of an int. Adding, removing,
+    checking for a card and finding the lowest or highest card are O(1). The
+    string form is cached until the cards change."""
+
+    __slots__ = ("bits", "size", "text")
+
+    def __init__(self, cards=()):
+        self.bits = 0
+        self.size = 0
+        self.text = None
+        for card in cards:
+            self.add(card)
+
+    @classmethod
+    def from_bits(cls, bits):
+        card_set = cls()
+        card_set.bits = bits
+        card_set.size = bin(bits).count("1")
+        return card_set
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, card):
+        return 0 <= card < DECK_SIZE and (self.bits >> card) & 1 == 1
+
+    def __iter__(self):
+        """Yields the cards in increasing order."""
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def __str__(self):
+        if self.text is None:
+            self.text = str(list(self))
+        return self.text
+
+    __repr__ = __str__
+
+    def add(self, card):
+        if card not in self:
+            self.bits |= 1 << card
+            self.size += 1
+            self.text = None
+
+    def remove(self, card):
+        """Removes card. Raises ValueError if it isn't present."""
+        if card not in self:
+            raise ValueError(f"{card} is not among the cards")
+        self.bits ^= 1 << card
+        self.size -= 1
+        self.text = None
+
+    def lowest(self):
+        """Returns the lowest card, or None if there are no cards."""
+        return (self.bits & -self.bits).bit_length() - 1 if self.bits else None
+
+    def highest(self):
+        """Returns the highest card, or None if there are no cards."""
+        return self.bits.bit_length() - 1 if self.bits else None
+
+    def pop_random(self):
+        """Removes and returns a card chosen uniformly at random."""
+        index = random.randrange(self.size)
+        for card in self:
+            if index == 0:
+                self.remove(card)
+                return card
+            index -= 1
 
 class Player:
 
-    def __init__(self, name, user):
+    __slots__ = ("name", "cards")
+
+    def __init__(self, name):
         self.name = name
-        self.user = user
-        self.cards = []
+        self.cards = CardSet()
 
     def __len__(self):
         return len(self.cards)
 
     def add_card(self, card):
-        self.cards.append(card)
-        self.cards.sort()
+        self.cards.add(card)
 
     def remove_card(self, card):
         self.cards.remove(card)
@@ -35,76 +150,279 @@ class Player:
 class NinetyNineBot:
 
     def __init__(self):
-        self.deck = list(range(100))
-        random.shuffle(self.deck)
+        # Drawing a random card from the remaining ones is the same as drawing
+        # from the top of a shuffled deck
+        self.deck = CardSet.from_bits((1 << DECK_SIZE) - 1)
 
         self.players = {}
-        self.player_id_list = []
+        self.turn_order = TurnOrder()
+
+        # Cached result of cards_per_hand, cleared whenever a hand changes
+        self.hand_counts_text = None
+
+    def to_state(self):
+        """Returns the game state as a JSON-serializable dict. Card sets are
+        stored as their bits, and players are listed in seat order."""
+        return {"deck": self.deck.bits,
+                "players": [[id, self.players[id].name, self.players[id].cards.bits]
+                            for id in self.turn_order],
+                "current": self.turn_order.current}
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuilds a game from a dict made by to_state."""
+        bot = cls()
+        bot.deck = CardSet.from_bits(state["deck"])
+        for id, name, cards in state["players"]:
+            bot.players[id] = Player(name)
+            bot.players[id].cards = CardSet.from_bits(cards)
+            bot.turn_order.add(id)
+        if state["current"] is not None:
+            bot.turn_order.set_current(state["current"])
+        return bot
 
     def add_player(self, user):
-        """Adds this player to the game."""
+        """Adds this player to the game. Returns False if they were already in
+        it."""
         id = user.id
         name = user.name
-        self.players[id] = Player(name, user)
-        self.player_id_list.append(id)
+        if id in self.turn_order:
+            return False
+        self.players[id] = Player(name)
+        self.turn_order.add(id)
+        self.hand_counts_text = None
+        return True
 
     def draw(self, id):
         """Draws a card, adds it to player id's hand, and returns it."""
-        card = self.deck.pop()
+        card = self.deck.pop_random()
         self.players[id].add_card(card)
+        self.hand_counts_text = None
         return card
 
     def hand(self, id):
-        """Returns hand of player given by id"""
+        """Returns hand of player given by id, as a CardSet"""
         return self.players[id].cards
 
     def play(self, id, card):
         """Plays the card from hand of player id."""
         self.players[id].remove_card(card)
+        self.hand_counts_text = None
+
+    def validate(self):
+        """Checks the game state for inconsistencies. Returns a list of
+        problems, which is empty if the state is consistent."""
+        problems = []
+        if sorted(self.players) != sorted(self.turn_order):
+            problems.append("The players and the turn order don't match.")
+        if self.players and self.turn_order.current not in self.players:
+            problems.append("It is the turn of someone who isn't playing.")
+
+        seen = self.deck.bits
+        for id in self.turn_order:
+            player = self.players.get(id)
+            if player is None:
+                continue
+            duplicates = seen & player.cards.bits
+            if duplicates:
+                problems.append(f"{player.name} holds cards that are also elsewhere: {CardSet.from_bits(duplicates)}")
+            seen |= player.cards.bits
+        return problems
 
     def cards_per_hand(self):
         """Returns a string of the number of cards per hand for each player."""
-        s = ""
-        for id in self.player_id_list:
-            name = self.players[id].name
-            cards = len(self.players[id])
-            s += "{} has {} cards.\n".format(name, cards)
-        return s[:-1]
+        if self.hand_counts_text is None:
+            self.hand_counts_text = "\n".join("{} has {} cards.".format(self.players[id].name, len(self.players[id]))
+                                              for id in self.turn_order)
+        return self.hand_counts_text
 
     def next_player(self, id):
-        """Finds the next player after name for player turn order. Return's that
-        player's user"""
-        index = self.player_id_list.index(id)
-        next_index = (index + 1) % len(self.player_id_list)
-        return self.players[self.player_id_list[next_index]].user
+        """Returns the id of the player seated after player id."""
+        return self.turn_order.next_after(id)
+
+    def is_turn(self, id):
+        """Returns True if it is player id's turn."""
+        return self.turn_order.current == id
+
+    def end_turn(self):
+        """Ends the current player's turn. Returns the id of the player whose
+        turn it is now."""
+        return self.turn_order.advance()
+
+    def remove_player(self, id):
+        """Removes player id from the game, discarding their hand. If it was
+        their turn, it is now the next player's."""
+        del self.players[id]
+        self.turn_order.remove(id)
+        self.hand_counts_text = None
 
 #########################################################
-### Setting up NNB and on_ready
+### Setting up SESSIONS and on_ready
 #########################################################
 
-NNB = NinetyNineBot()
+# Games with no commands for this many seconds are dropped.
+MAX_IDLE_SECONDS = 6 * 60 * 60
+
+# Directory holding the saved state of every game in progress
+GAMES_DIR = "games"
+
+WRITER = SnapshotWriter()
+
+def save_path(key):
+    """Returns the file the game with session key key is saved to."""
+    guild_id, channel_id = key
+    return os.path.join(GAMES_DIR, f"ninety_nine_{guild_id}_{channel_id}.json")
+
+def save_game(ctx, NNB):
+    """Queues the game for ctx's channel to be saved in the background."""
+    data = json.dumps(NNB.to_state()).encode()
+    WRITER.save(save_path(GameSessions.key(ctx)), data)
+
+def forget_game(key, NNB):
+    """Deletes the save file of a game that is no longer being played."""
+    WRITER.remove(save_path(key))
+    BOARDS.forget(key)
+    if SPECTATORS is not None:
+        SPECTATORS.touch(key)
+    if HISTORY is not None:
+        HISTORY.end(key, "idle")
+
+def saved_games():
+    """Yields the session key and game for every game saved in GAMES_DIR."""
+    for path in sorted(glob.glob(os.path.join(GAMES_DIR, "ninety_nine_*.json"))):
+        guild_id, channel_id = os.path.basename(path)[:-len(".json")].split("_")[2:]
+        with open(path, "r") as f:
+            NNB = NinetyNineBot.from_state(json.load(f))
+        yield (int(guild_id), int(channel_id)), NNB
+
+def restore_games():
+    """Loads every game saved in GAMES_DIR into SESSIONS."""
+    for key, NNB in saved_games():
+        SESSIONS.add(key, NNB)
+        log.info("Restored the game in channel %s.", key[1])
+
+# All messages go out through SCHEDULER, which paces them per channel and DM
+SCHEDULER = SendScheduler()
+
+# Seconds that a status board waits after a change before it is edited, so
+# that a burst of commands costs one edit
+BOARD_DELAY = 2.0
+
+BOARDS = StatusBoards(lambda key: status_text(SESSIONS.games.get(key)), SCHEDULER, BOARD_DELAY)
+
+SESSIONS = GameSessions(lambda key: NinetyNineBot(),
+                        max_idle=MAX_IDLE_SECONDS,
+                        on_evict=forget_game)
+
+# Where and how often metrics are dumped; main() starts the dumping
+METRICS_FILE = "ninety_nine_metrics.json"
+METRICS_INTERVAL = 60
+METRICS_TASK = None
+
+METRICS.gauge("games", lambda: len(SESSIONS))
+METRICS.gauge("players", lambda: sum(len(NNB.turn_order) for NNB in SESSIONS.games.values()))
+METRICS.gauge("sends", lambda: SCHEDULER.metrics())
+METRICS.gauge("boards", lambda: BOARDS.metrics())
+METRICS.gauge("spectators", lambda: SPECTATORS.metrics() if SPECTATORS is not None else {})
+METRICS.gauge("history_backlog", lambda: HISTORY.store.queue.qsize() if HISTORY is not None else 0)
+
+# Records every game for 99stats and 99leaderboard; main() opens it, and
+# without it nothing is recorded
+HISTORY_FILE = "history.sqlite3"
+HISTORY = None
+
+# Serves games to spectators if --spectate is given; main() creates it, and
+# on_ready starts it
+SPECTATE_HOST = "127.0.0.1"
+SPECTATE_PORT = None
+SPECTATORS = None
+
+@client.before_invoke
+async def start_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@client.after_invoke
+async def record_timing(ctx):
+    """Records how long the command took, including waiting for its game."""
+    METRICS.observe("command." + ctx.command.name, time.perf_counter() - ctx.started_at)
+    METRICS.increment("commands")
 
 @client.event
 async def on_ready():
     """ Displayed in the terminal when the bot is logged in. """
+    global METRICS_TASK
+    if METRICS_TASK is None:
+        METRICS_TASK = client.loop.create_task(METRICS.dump_periodically(METRICS_FILE, METRICS_INTERVAL))
+    if SPECTATORS is not None and SPECTATORS.runner is None:
+        await SPECTATORS.start(SPECTATE_HOST, SPECTATE_PORT)
+
     # channel = client.get_channel(695669957891194952)
     # await channel.send("Who wants to play The Game of 99?")
-    print("Who wants to play The Game of 99?")
+    log.info("Who wants to play The Game of 99?")
 
 #########################################################
 ### Helper functions that aren't commands
 #########################################################
 
-async def next_player_message(ctx):
-    """Used to tell who is the next player. Argument is context from which next
-    player can be determined."""
-    message = "It is now {}'s turn.".format(NNB.next_player(ctx.message.author.id).mention)
-    await ctx.send(message)
-
-async def cards_per_hand(ctx):
-    """Used to tell number of cards in each hand."""
-    message = NNB.cards_per_hand()
-    await ctx.send(message)
+# These add their messages to out, an Outbox, so that everything a command
+# says goes to the channel as a single message.
+
+def next_player_message(out, NNB):
+    """Used to tell whose turn it is now, if anyone is seated."""
+    if NNB.turn_order.current is None:
+        return
+    user = client.get_user(NNB.turn_order.current)
+    message = "It is now {}'s turn.".format(user.mention)
+    out.add(message, TURN)
+
+def check_turn(out, ctx, NNB):
+    """Returns True if it is the turn of the player who sent the command.
+    Otherwise, says whose turn it is, or that nobody is seated."""
+    if NNB.is_turn(ctx.message.author.id):
+        return True
+    if NNB.turn_order.current is None:
+        out.add("Nobody has joined the game yet.")
+        return False
+    user = client.get_user(NNB.turn_order.current)
+    out.add(f"Sorry {ctx.message.author.name}, it is {user.mention}'s turn.")
+    return False
+
+def status_text(NNB):
+    """Returns the text of the status board for NNB, or None if there is no
+    game."""
+    if NNB is None:
+        return None
+    current = NNB.turn_order.current
+    turn = NNB.players[current].name if current is not None else "nobody"
+    return (f"**The Game of 99** - {turn}'s turn\n"
+            f"Deck: {len(NNB.deck)} cards\n"
+            f"{NNB.cards_per_hand()}")
+
+def public_state(NNB):
+    """Returns what anyone may see of NNB, for spectators, or None if there is
+    no game."""
+    if NNB is None:
+        return None
+    current = NNB.turn_order.current
+    return {"game": "ninety_nine",
+            "turn": NNB.players[current].name if current is not None else None,
+            "deck": len(NNB.deck),
+            "players": [{"name": NNB.players[id].name, "cards": len(NNB.players[id])}
+                        for id in NNB.turn_order]}
+
+def update_board(ctx):
+    """Brings the status board of ctx's game, and what spectators see of it,
+    up to date, soon."""
+    key = GameSessions.key(ctx)
+    BOARDS.touch(ctx.channel, key)
+    if SPECTATORS is not None:
+        SPECTATORS.touch(key)
+
+def record(ctx, NNB, action, detail=None):
+    """Records in HISTORY that the player who sent the command did action.
+    Only queues the record, so it costs the command next to nothing."""
+    if HISTORY is not None:
+        HISTORY.record(GameSessions.key(ctx), NNB, ctx.message.author.id, action, detail)
 
 #########################################################
 ### Commands
@@ -113,24 +431,41 @@ async def cards_per_hand(ctx):
 @client.command(aliases=['join'])
 async def _99join(ctx):
     """Adds this player to the game."""
-    NNB.add_player(ctx.message.author)
-    await ctx.send("Welcome to the game, {}".format(ctx.message.author.name))
-    print("Added {} to the game.".format(ctx.message.author.name))
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as NNB:
+        if not NNB.add_player(ctx.message.author):
+            out.add("You are already in the game, {}.".format(ctx.message.author.name))
+            return
+        save_game(ctx, NNB)
+        if HISTORY is not None:
+            HISTORY.joined(GameSessions.key(ctx), NNB, ctx.message.author)
+        out.add("Welcome to the game, {}".format(ctx.message.author.name))
+        update_board(ctx)
+        log.info("Added %s to the game.", ctx.message.author.name, extra=game_fields(ctx))
 
 
 @client.command(aliases=['draw'])
 async def _99draw(ctx):
     """Run with the 99draw command"""
-    card = NNB.draw(ctx.message.author.id)
-    hand = NNB.hand(ctx.message.author.id)
-    await ctx.message.author.send("You draw the card {}, and your hand is {}.".format(card, hand))
-    print(ctx.message.author.name, "drew a card.")
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as NNB:
+        if not check_turn(out, ctx, NNB):
+            return
+        if len(NNB.deck) == 0:
+            out.add("There are no cards left in the deck.")
+            return
+
+        card = NNB.draw(ctx.message.author.id)
+        NNB.end_turn()
+        save_game(ctx, NNB)
+        record(ctx, NNB, "draw", str(card))
+        hand = NNB.hand(ctx.message.author.id)
+        SCHEDULER.to_user(ctx.message.author, "You draw the card {}, and your hand is {}.".format(card, hand))
+        log.info("%s drew a card.", ctx.message.author.name, extra=game_fields(ctx))
 
-    # Say number of cards in each hand
-    await cards_per_hand(ctx)
+        # Hand counts are on the status board
+        update_board(ctx)
 
-    # Say next player's turn
-    await next_player_message(ctx)
+        # Say next player's turn
+        next_player_message(out, NNB)
 
 
 @client.command(aliases=['play'])
@@ -139,42 +474,205 @@ async def _99play(ctx, card):
     try:
         card = int(card)
     except Exception:
-        await ctx.send("Sorry {}, you did not provide a reasonable card number.".format(ctx.message.author.name))
+        SCHEDULER.to_channel(ctx.channel, "Sorry {}, you did not provide a reasonable card number.".format(ctx.message.author.name))
+        return
 
-    if card in NNB.hand(ctx.message.author.id):
-        NNB.play(ctx.message.author.id, card)
-        hand = NNB.hand(ctx.message.author.id)
-        await ctx.send("{} played the card {}.".format(ctx.message.author.name, card))
-        await ctx.message.author.send("You played the card {}, and your hand is {}.".format(card, hand))
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as NNB:
+        if not check_turn(out, ctx, NNB):
+            return
 
-        print(ctx.message.author.name, "played the card", card)
+        if card in NNB.hand(ctx.message.author.id):
+            NNB.play(ctx.message.author.id, card)
+            NNB.end_turn()
+            save_game(ctx, NNB)
+            record(ctx, NNB, "play", str(card))
+            hand = NNB.hand(ctx.message.author.id)
+            out.add("{} played the card {}.".format(ctx.message.author.name, card))
+            SCHEDULER.to_user(ctx.message.author, "You played the card {}, and your hand is {}.".format(card, hand))
 
-        # Say number of cards in each hand
-        await cards_per_hand(ctx)
+            log.info("%s played the card %s.", ctx.message.author.name, card, extra=game_fields(ctx, card=card))
 
-        # Say next player's turn
-        await next_player_message(ctx)
+            # Hand counts are on the status board
+            update_board(ctx)
 
-    else:
-        await ctx.send("Sorry {}, you do not have card {} in your hand.".format(ctx.message.author.name, card))
+            # Say next player's turn
+            next_player_message(out, NNB)
+
+        else:
+            out.add("Sorry {}, you do not have card {} in your hand.".format(ctx.message.author.name, card))
 
 @_99play.error
 async def _99play_error(ctx, error):
     if isinstance(error, discord.ext.commands.errors.MissingRequiredArgument):
-        await ctx.send("Please tell me which card to play, as in `99play 29` to play card 29.")
-
+        SCHEDULER.to_channel(ctx.channel, "Please tell me which card to play, as in `99play 29` to play card 29.")
+
+
+
+@client.command(aliases=['skip'])
+async def _99skip(ctx):
+    """Skips the turn of the player whose turn it is, e.g. if they are away."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as NNB:
+        if NNB.turn_order.current is None:
+            out.add("Nobody has joined the game yet.")
+            return
+
+        skipped = client.get_user(NNB.turn_order.current)
+        NNB.end_turn()
+        save_game(ctx, NNB)
+        record(ctx, NNB, "skip", skipped.name)
+        out.add(f"{ctx.message.author.name} skipped {skipped.name}'s turn.")
+        update_board(ctx)
+        next_player_message(out, NNB)
+        log.info("%s skipped %s's turn.", ctx.message.author.name, skipped.name, extra=game_fields(ctx))
+
+
+@client.command(aliases=['leave'])
+async def _99leave(ctx):
+    """Removes this player from the game, discarding their hand."""
+    async with Outbox(ctx, SCHEDULER) as out, SESSIONS.session(ctx) as NNB:
+        if ctx.message.author.id not in NNB.players:
+            out.add(f"Sorry {ctx.message.author.name}, you are not in the game.")
+            return
+
+        record(ctx, NNB, "leave")
+        NNB.remove_player(ctx.message.author.id)
+        save_game(ctx, NNB)
+        out.add(f"{ctx.message.author.name} has left the game.")
+        update_board(ctx)
+        if NNB.turn_order.current is not None:
+            next_player_message(out, NNB)
+        log.info("%s left the game.", ctx.message.author.name, extra=game_fields(ctx))
 
 
 @client.command(aliases=['hand'])
 async def _99hand(ctx):
     """DMs the players hand to them."""
-    hand = NNB.hand(ctx.message.author.id)
-    await ctx.message.author.send("Your current hand is {}.".format(hand))
-    print(ctx.message.author.name, "requested to see their hand.")
+    async with SESSIONS.session(ctx) as NNB:
+        hand = NNB.hand(ctx.message.author.id)
+        SCHEDULER.to_user(ctx.message.author, "Your current hand is {}.".format(hand))
+        log.info("%s requested to see their hand.", ctx.message.author.name, extra=game_fields(ctx))
+
+
+# Leaderboards, by the argument to 99leaderboard, and the action they count
+LEADERBOARDS = {"games": None, "draws": "draw", "plays": "play"}
+
+@client.command(aliases=['stats'])
+async def _99stats(ctx, user: discord.User = None):
+    """Tells how many games a player has played and what they did in them."""
+    user = user if user is not None else ctx.message.author
+    if HISTORY is None:
+        SCHEDULER.to_channel(ctx.channel, "Game history is not being recorded.")
+        return
+
+    # Queries run in a thread, so they never hold up other games' commands
+    stats = await asyncio.get_event_loop().run_in_executor(None, HISTORY.player_stats, user.id)
+    if stats is None:
+        SCHEDULER.to_channel(ctx.channel, f"{user.name} has not played any games of 99 yet.")
+        return
+    actions = stats["actions"]
+    last_played = time.strftime("%Y-%m-%d", time.localtime(stats["last_played"]))
+    SCHEDULER.to_channel(ctx.channel, f"{user.name} has played {stats['games']} games of 99, most recently on {last_played}.\n"
+                                      f"Cards drawn: {actions.get('draw', 0)}, cards played: {actions.get('play', 0)}.")
+
+@client.command(aliases=['leaderboard'])
+async def _99leaderboard(ctx, board="games"):
+    """Lists the players with the most games, draws or plays."""
+    if board not in LEADERBOARDS:
+        SCHEDULER.to_channel(ctx.channel, "Sorry, there are leaderboards for " + ", ".join(LEADERBOARDS) + ".")
+        return
+    if HISTORY is None:
+        SCHEDULER.to_channel(ctx.channel, "Game history is not being recorded.")
+        return
+
+    rows = await asyncio.get_event_loop().run_in_executor(None, HISTORY.leaderboard, LEADERBOARDS[board])
+    if not rows:
+        SCHEDULER.to_channel(ctx.channel, "Nobody has played any games of 99 yet.")
+        return
+    lines = [f"{rank}. {name}: {count}" for rank, (name, count) in enumerate(rows, 1)]
+    SCHEDULER.to_channel(ctx.channel, f"Most {board}:\n" + "\n".join(lines))
+
+
+@client.command(aliases=['board'])
+async def _99board(ctx):
+    """Posts a new status board for this channel's game, e.g. if the old one
+    was lost."""
+    async with SESSIONS.session(ctx, create=False) as NNB:
+        if NNB is None:
+            SCHEDULER.to_channel(ctx.channel, "There is no game in this channel.")
+            return
+        key = GameSessions.key(ctx)
+        BOARDS.forget(key)
+        BOARDS.touch(ctx.channel, key)
+
+
+@client.command()
+async def sendstats(ctx):
+    """Reports the outgoing message queues and send latencies."""
+    stats = SCHEDULER.metrics()
+    SCHEDULER.to_channel(ctx.channel, "\n".join(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+                                                for name, value in stats.items()))
 
 
+#########################################################
+### Starting the bot
+#########################################################
 
-if auth_key == '':
-    print("Invalid auth key for bot")
-else:
-    client.run(auth_key)
+def check_games():
+    """Validates the saved games without connecting to Discord. Returns the
+    number of games with problems."""
+    bad_games = 0
+    for key, NNB in saved_games():
+        problems = NNB.validate()
+        print(f"Channel {key[1]}: {len(NNB.turn_order)} players, {len(NNB.deck)} cards in the deck: "
+              f"{'problems found' if problems else 'OK'}")
+        for problem in problems:
+            print("  " + problem)
+        bad_games += bool(problems)
+    return bad_games
+
+def main():
+    global METRICS_FILE, HISTORY, SPECTATORS, SPECTATE_PORT
+    parser = argparse.ArgumentParser(description="Discord bot for playing The Game of 99.")
+    parser.add_argument("--check", action="store_true",
+                        help="validate saved games and exit without connecting")
+    parser.add_argument("--log", metavar="FILE", help="write logs to FILE instead of stdout")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_FILE,
+                        help=f"file to dump metrics to (default {METRICS_FILE})")
+    parser.add_argument("--history", metavar="FILE", default=HISTORY_FILE,
+                        help=f"SQLite database of game history (default {HISTORY_FILE})")
+    parser.add_argument("--spectate", type=int, metavar="PORT",
+                        help=f"serve games read-only to spectators on {SPECTATE_HOST}:PORT")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check_games() else 0)
+
+    with open("ninety_nine.key", "r") as f:
+        auth_key = f.read().strip()
+    if auth_key == '':
+        print("Invalid auth key for bot")
+        return
+
+    listener = setup_logging(args.log)
+    METRICS_FILE = args.metrics
+    restore_games()
+    HISTORY = GameRecorder(HistoryStore(args.history), "ninety_nine")
+    HISTORY.end_missing(SESSIONS.games, "lost")
+    if args.spectate is not None:
+        SPECTATE_PORT = args.spectate
+        SPECTATORS = SpectatorServer(lambda key: public_state(SESSIONS.games.get(key)),
+                                     lambda: list(SESSIONS.games))
+
+    startup = time.perf_counter() - STARTED_AT
+    log.info("Started in %.3fs.", startup)
+    if startup > STARTUP_BUDGET:
+        log.warning("Startup took longer than the %ss budget.", STARTUP_BUDGET)
+    try:
+        client.run(auth_key)
+    finally:
+        WRITER.flush()
+        HISTORY.close()
+        listener.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Coalesces the messages a command posts to a channel into as few sends as
+possible.
+
+Usage:
+async with Outbox(ctx, SCHEDULER) as out:
+    out.add("first line")
+    out.add("It is now Bob's turn.", TURN)
+# Both lines are queued as a single message here.
+"""
+
+from send_scheduler import INFO
+
+# Longest message Discord accepts
+MESSAGE_LIMIT = 2000
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Splits text into chunks of at most limit characters, breaking between
+    lines where possible."""
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+class Outbox:
+    """Buffers messages for the channel of a command context and sends them
+    joined by newlines on flush. With a SendScheduler, the message is queued
+    on it at the most urgent priority of its parts rather than sent
+    directly."""
+
+    def __init__(self, ctx, scheduler=None):
+        self.ctx = ctx
+        self.scheduler = scheduler
+        self.parts = []
+        self.priority = INFO
+
+    def add(self, text, priority=INFO):
+        """Queues text to be sent on the next flush."""
+        self.parts.append(text)
+        self.priority = min(self.priority, priority)
+
+    async def flush(self):
+        """Sends (or schedules) everything queued so far."""
+        if not self.parts:
+            return
+        text = "\n".join(self.parts)
+        priority = self.priority
+        self.parts = []
+        self.priority = INFO
+        for chunk in split_message(text):
+            if self.scheduler is None:
+                await self.ctx.send(chunk)
+            else:
+                self.scheduler.to_channel(self.ctx.channel, chunk, priority)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush()
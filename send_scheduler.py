@@ -0,0 +1,206 @@
+"""
+Paces outgoing Discord messages so that bursts don't stall command handlers.
+
+Every destination (a channel, or a user's DMs) has its own queue and worker
+task, so DMs to different players are delivered concurrently and a busy
+channel doesn't hold up the others. Workers pace themselves with sliding
+windows, one per destination allowing Discord's 5 messages in any 5 seconds
+plus one shared by the whole process, staying under Discord's rate limits
+instead of running into its 429 responses. Queued turn notifications are
+sent before informational messages. Other requests to a channel, like
+editing or pinning a message in it, go through the same queue and windows.
+
+Usage:
+SCHEDULER = SendScheduler()
+SCHEDULER.to_channel(ctx.channel, "It is now Bob's turn.", TURN)
+SCHEDULER.to_user(ctx.message.author, "Your hand is ...")
+await SCHEDULER.request(channel, lambda: message.edit(content="..."))
+"""
+
+import asyncio, collections, itertools, logging, time
+
+from instrumentation import Histogram
+
+log = logging.getLogger(__name__)
+
+# Message priorities; lower numbers are sent first
+TURN = 0
+INFO = 1
+
+class RateWindow:
+    """Allows up to messages requests in any window of seconds seconds."""
+
+    def __init__(self, messages, seconds):
+        self.seconds = seconds
+        # When the latest requests were made, oldest first
+        self.times = collections.deque(maxlen=messages)
+
+    def wait(self):
+        """Returns how many seconds to wait before the next request."""
+        if len(self.times) < self.times.maxlen:
+            return 0
+        return max(0, self.times[0] + self.seconds - time.monotonic())
+
+    def record(self):
+        """Counts a request made now."""
+        self.times.append(time.monotonic())
+
+class SendScheduler:
+    """Queues messages per destination and sends them from worker tasks. Each
+    destination gets at most limit[0] requests in any limit[1] seconds, and
+    all of them together at most global_limit[0] in global_limit[1] seconds;
+    a limit of None doesn't pace them at all."""
+
+    def __init__(self, limit=(5, 5.0), global_limit=(40, 1.0), idle_timeout=60):
+        self.limit = limit
+        self.global_window = RateWindow(*global_limit) if global_limit else None
+        self.idle_timeout = idle_timeout
+        self.counter = itertools.count()
+
+        self.queues = {}
+        self.workers = {}
+        self.closed = False
+        # Futures of the messages that haven't been sent yet
+        self.unsent = set()
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latency = Histogram()
+
+    def to_channel(self, channel, text, priority=INFO):
+        """Queues text for channel. Returns a future that resolves to True once
+        it has been sent, or False if sending failed."""
+        return self.send(("channel", channel.id), channel, text, priority)
+
+    def to_user(self, user, text, priority=INFO):
+        """Queues text to be DMed to user."""
+        return self.send(("user", user.id), user, text, priority)
+
+    def send(self, key, destination, text, priority=INFO):
+        """Queues text for destination, which is anything with an async send
+        method. Messages with the same key go out in priority order, and in
+        the order they were queued within a priority."""
+        async def request():
+            await destination.send(text)
+            return True
+        return self._queue(key, request, priority, False)
+
+    def request(self, channel, request, priority=INFO):
+        """Queues request, an async function of no arguments that makes one
+        request to channel (e.g. lambda: message.edit(content=text)), to be
+        made in turn with the messages for channel. Returns a future that
+        resolves to what request returns, or raises what it raised."""
+        return self._queue(("channel", channel.id), request, priority, None)
+
+    def _queue(self, key, request, priority, failed):
+        """Queues request for the destination with key key. If it raises, its
+        future resolves to failed, or if failed is None, raises the error."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = asyncio.PriorityQueue()
+            self.queues[key] = queue
+            self.workers[key] = loop.create_task(self._worker(key, queue))
+
+        queue.put_nowait((priority, next(self.counter), request, failed, time.monotonic(), future))
+        self.unsent.add(future)
+        future.add_done_callback(self.unsent.discard)
+        self.max_depth = max(self.max_depth, queue.qsize())
+        return future
+
+    async def _worker(self, key, queue):
+        window = RateWindow(*self.limit) if self.limit else None
+        while not self.closed:
+            try:
+                item = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self.queues[key]
+                    del self.workers[key]
+                    return
+                continue
+
+            # wait_for returns the item rather than raising if it is
+            # cancelled just as the item arrives
+            if self.closed:
+                return
+
+            _, _, request, failed, queued_at, future = item
+            # Whoever queued it has stopped waiting, e.g. a status board
+            # update that was cancelled
+            if future.cancelled():
+                continue
+            await self._wait_turn(window)
+
+            try:
+                result = await request()
+            except Exception as e:
+                self.failed += 1
+                if failed is not None:
+                    log.warning("Could not send message to %s: %s", key, e)
+                if future.done():
+                    continue
+                if failed is None:
+                    future.set_exception(e)
+                else:
+                    future.set_result(failed)
+                continue
+            finally:
+                # Counted once Discord has answered, which is no earlier
+                # than when it counted the request
+                if window is not None:
+                    window.record()
+
+            latency = time.monotonic() - queued_at
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.latency.observe(latency)
+            if not future.done():
+                future.set_result(result)
+
+    async def _wait_turn(self, window):
+        """Waits until both window and the global window allow a request,
+        and takes the global window's place."""
+        while True:
+            wait = max(window.wait() if window else 0,
+                       self.global_window.wait() if self.global_window else 0)
+            if wait <= 0:
+                break
+            # Other workers may take the global window's place meanwhile
+            await asyncio.sleep(wait)
+        if self.global_window is not None:
+            self.global_window.record()
+
+    def queue_depths(self):
+        """Returns the number of waiting messages for each destination."""
+        return {key: queue.qsize() for key, queue in self.queues.items()}
+
+    def metrics(self):
+        """Returns a dict of queue and latency statistics."""
+        depths = self.queue_depths().values()
+        return {"destinations": len(self.queues),
+                "queued": sum(depths),
+                "max_depth": self.max_depth,
+                "sent": self.sent,
+                "failed": self.failed,
+                "mean_latency": self.total_latency / self.sent if self.sent else 0.0,
+                "p99_latency": self.latency.percentile(0.99),
+                "max_latency": self.max_latency}
+
+    async def drain(self):
+        """Waits until every queued message has been sent."""
+        while self.unsent:
+            await asyncio.wait(list(self.unsent))
+
+    def close(self):
+        """Stops the workers, leaving any queued messages unsent."""
+        self.closed = True
+        for worker in self.workers.values():
+            worker.cancel()
@@ -0,0 +1,88 @@
+"""
+Crash-safe snapshot files written off the event loop.
+
+Files are replaced atomically: the data goes to a temporary file that is
+fsynced and then renamed over the old file, so a crash leaves either the old
+snapshot or the new one, never a partial file.
+"""
+
+import logging, os, tempfile, threading
+
+log = logging.getLogger(__name__)
+
+def write_atomically(path, data, replace=True):
+    """Replaces the file at path with data (bytes). The data is first written
+    to a temporary file of its own, so concurrent writes never share one. If
+    replace is False, raises FileExistsError instead of replacing a file
+    that is already at path."""
+    directory, name = os.path.split(path)
+    tmp = tempfile.NamedTemporaryFile(dir=directory or ".", prefix=name + ".", suffix=".tmp", delete=False)
+    try:
+        with tmp as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if replace:
+            os.replace(tmp.name, path)
+        else:
+            # Unlike a rename, a link fails if path exists
+            os.link(tmp.name, path)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+class SnapshotWriter:
+    """Writes snapshots from a background thread, so saving never blocks the
+    event loop. While a file is waiting to be written, a newer snapshot of it
+    replaces the older one, so a burst of saves costs a single write."""
+
+    def __init__(self):
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.busy = False
+        self.thread = None
+
+    def save(self, path, data):
+        """Queues data (bytes) to be written to path."""
+        self._queue(path, data)
+
+    def remove(self, path):
+        """Queues path to be deleted."""
+        self._queue(path, None)
+
+    def _queue(self, path, data):
+        with self.condition:
+            self.pending[path] = data
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def flush(self):
+        """Blocks until every queued snapshot has been written."""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending and not self.busy)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                batch, self.pending = self.pending, {}
+                self.busy = True
+
+            for path, data in batch.items():
+                try:
+                    if data is None:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    else:
+                        directory = os.path.dirname(path)
+                        if directory:
+                            os.makedirs(directory, exist_ok=True)
+                        write_atomically(path, data)
+                except OSError as e:
+                    log.warning("Could not write snapshot %s: %s", path, e)
+
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
@@ -0,0 +1,218 @@
+"""
+Read-only HTTP and WebSocket API for watching games from outside Discord,
+so spectators don't have to ask the bot for the table or scroll the channel.
+
+The server runs in the bot's event loop. A game's public state is rendered
+into an immutable snapshot (the state and its JSON text) only when something
+asks for it after the game changed, and every request for it until the next
+change is served from that snapshot. WebSocket spectators are sent the whole
+state when they connect, and then only what changed, encoded once for all of
+them.
+
+Endpoints:
+    GET /games                          session keys of the games, as [[guild, channel], ...]
+    GET /games/{guild}/{channel}        the game's public state
+    GET /games/{guild}/{channel}/ws     WebSocket: {"version": n, "state": {...}}, then
+                                        {"version": n, "changed": {...}, "removed": [...]}
+                                        after every change, and {"version": n, "ended": true}
+                                        when the game ends
+
+Usage:
+SPECTATORS = SpectatorServer(lambda key: public_state(SESSIONS.games.get(key)),
+                             lambda: list(SESSIONS.games))
+await SPECTATORS.start("127.0.0.1", 8099)
+SPECTATORS.touch(GameSessions.key(ctx))
+"""
+
+import asyncio, json, logging
+from types import MappingProxyType
+
+from aiohttp import web, WSMsgType
+
+log = logging.getLogger(__name__)
+
+class Snapshot:
+    """The public state of a game at one version, frozen."""
+
+    __slots__ = ("version", "state", "text")
+
+    def __init__(self, version, state):
+        self.version = version
+        self.state = MappingProxyType(state)
+        self.text = json.dumps(state)
+
+def diff(old, new):
+    """Returns the keys of new whose values differ from old's, with their new
+    values, and the keys of old that new lacks."""
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+class SpectatorServer:
+    """Serves the public state of games by session key. render(key) returns
+    the state of the game with session key key as a JSON-serializable dict,
+    or None if there is no game; keys() returns the keys of the games.
+
+    touch(key) must be called whenever the game with key key changes."""
+
+    def __init__(self, render, keys):
+        self.render = render
+        self.keys = keys
+        self.snapshots = {}
+        self.stale = set()
+        self.sockets = {}
+        # Snapshot each game's spectators last saw
+        self.seen = {}
+        self.pending = {}
+        self.runner = None
+
+        # Metrics
+        self.rendered = 0
+        self.served = 0
+        self.pushed = 0
+
+        self.app = web.Application()
+        self.app.add_routes([web.get("/games", self.list_games),
+                             web.get("/games/{guild}/{channel}", self.get_game),
+                             web.get("/games/{guild}/{channel}/ws", self.watch_game)])
+
+    async def start(self, host, port):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        log.info("Serving game state for spectators on %s:%d.", host, port)
+
+    async def close(self):
+        """Stops serving, disconnecting every spectator."""
+        self.sockets.clear()
+        for task in list(self.pending.values()):
+            task.cancel()
+        self.pending.clear()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    #########################################################
+    ### Snapshots
+    #########################################################
+
+    def touch(self, key):
+        """Marks the snapshot of the game with key key out of date, and
+        schedules sending its spectators what changed."""
+        self.stale.add(key)
+        if self.sockets.get(key) and key not in self.pending:
+            self.pending[key] = asyncio.get_event_loop().create_task(self._push(key))
+
+    def snapshot(self, key):
+        """Returns the current Snapshot of the game with key key, or None if
+        there is no game."""
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and key not in self.stale:
+            return snapshot
+        self.stale.discard(key)
+
+        state = self.render(key)
+        if state is None:
+            self.snapshots.pop(key, None)
+            return None
+        if snapshot is None or dict(snapshot.state) != state:
+            self.rendered += 1
+            snapshot = Snapshot(snapshot.version + 1 if snapshot is not None else 1, state)
+            self.snapshots[key] = snapshot
+        return snapshot
+
+    async def _push(self, key):
+        """Sends the spectators of the game with key key what changed since
+        the snapshot they last saw."""
+        try:
+            # Let the command that changed the game finish, so a burst of
+            # changes goes out as one diff
+            await asyncio.sleep(0)
+            old = self.seen.get(key)
+            new = self.snapshot(key)
+            if new is old:
+                return
+            self.seen[key] = new
+            if new is None:
+                message = json.dumps({"version": old.version + 1 if old is not None else 1, "ended": True})
+            elif old is None:
+                message = json.dumps({"version": new.version, "state": dict(new.state)})
+            else:
+                changed, removed = diff(old.state, new.state)
+                message = json.dumps({"version": new.version, "changed": changed, "removed": removed})
+
+            sockets = list(self.sockets.get(key, ()))
+            results = await asyncio.gather(*(socket.send_str(message) for socket in sockets),
+                                           return_exceptions=True)
+            self.pushed += len(sockets)
+            for socket, result in zip(sockets, results):
+                if isinstance(result, Exception):
+                    log.info("Dropping a spectator of channel %s: %s", key[1], result)
+                    self._unwatch(key, socket)
+            if new is None:
+                for socket in sockets:
+                    await socket.close()
+        finally:
+            self.pending.pop(key, None)
+            # Changes made while sending go out next
+            if key in self.stale and self.sockets.get(key):
+                self.touch(key)
+
+    def _unwatch(self, key, socket):
+        sockets = self.sockets.get(key)
+        if sockets is not None:
+            sockets.discard(socket)
+            if not sockets:
+                del self.sockets[key]
+                self.seen.pop(key, None)
+
+    #########################################################
+    ### Handlers
+    #########################################################
+
+    @staticmethod
+    def _key(request):
+        try:
+            return int(request.match_info["guild"]), int(request.match_info["channel"])
+        except ValueError:
+            raise web.HTTPNotFound()
+
+    async def list_games(self, request):
+        self.served += 1
+        return web.json_response([list(key) for key in self.keys()])
+
+    async def get_game(self, request):
+        snapshot = self.snapshot(self._key(request))
+        if snapshot is None:
+            raise web.HTTPNotFound(text="There is no game in this channel.")
+        self.served += 1
+        return web.Response(text=snapshot.text, content_type="application/json",
+                            headers={"ETag": f'"{snapshot.version}"'})
+
+    async def watch_game(self, request):
+        key = self._key(request)
+        snapshot = self.snapshot(key)
+        if snapshot is None:
+            raise web.HTTPNotFound(text="There is no game in this channel.")
+
+        socket = web.WebSocketResponse(heartbeat=30)
+        await socket.prepare(request)
+        await socket.send_str(json.dumps({"version": snapshot.version, "state": dict(snapshot.state)}))
+        if key not in self.sockets:
+            self.seen[key] = snapshot
+        self.sockets.setdefault(key, set()).add(socket)
+        try:
+            # Spectators only listen; anything they send is ignored
+            async for message in socket:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._unwatch(key, socket)
+        return socket
+
+    def metrics(self):
+        return {"snapshots": len(self.snapshots),
+                "spectators": sum(len(sockets) for sockets in self.sockets.values()),
+                "rendered": self.rendered,
+                "served": self.served,
+                "pushed": self.pushed}
@@ -0,0 +1,113 @@
+"""
+A status message for every game, edited in place as the game changes, so
+the channel isn't flooded with hand counts and tables after every turn.
+
+Usage:
+BOARDS = StatusBoards(lambda key: status_text(SESSIONS.games.get(key)), SCHEDULER)
+BOARDS.touch(ctx.channel, GameSessions.key(ctx))
+"""
+
+import asyncio, logging
+
+log = logging.getLogger(__name__)
+
+class StatusBoards:
+    """Status boards by session key. render(key) returns the text of the board
+    for the game with session key key, or None if there is no game.
+
+    touch asks for a board to be brought up to date. Updates are debounced:
+    the board is rendered delay seconds after it is first touched, so a burst
+    of commands costs a single edit, and nothing is sent if the text hasn't
+    changed. The first update posts the board and pins it; later ones edit
+    it. Updates of one board never overlap.
+
+    Posts, pins and edits are made through scheduler, a SendScheduler, so
+    they are paced and counted with the channel's other messages."""
+
+    def __init__(self, render, scheduler, delay=2.0):
+        self.render = render
+        self.scheduler = scheduler
+        self.delay = delay
+        self.messages = {}
+        self.texts = {}
+        self.pending = {}
+        # Boards touched while their update was already underway
+        self.dirty = set()
+
+        # Metrics
+        self.posted = 0
+        self.edited = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def touch(self, channel, key):
+        """Schedules an update of the board for key in channel."""
+        task = self.pending.get(key)
+        if task is not None and not task.done():
+            self.dirty.add(key)
+            return
+        self.pending[key] = asyncio.get_event_loop().create_task(self._update(channel, key))
+
+    async def _update(self, channel, key):
+        try:
+            while True:
+                await asyncio.sleep(self.delay)
+                self.dirty.discard(key)
+                await self._send(channel, key)
+                if key not in self.dirty:
+                    return
+        finally:
+            if self.pending.get(key) is asyncio.current_task():
+                del self.pending[key]
+
+    async def _send(self, channel, key):
+        text = self.render(key)
+        if text is None or text == self.texts.get(key):
+            self.skipped += 1
+            return
+
+        message = self.messages.get(key)
+        try:
+            if message is None:
+                message = await self.scheduler.request(channel, lambda: channel.send(text))
+                self.messages[key] = message
+                self.posted += 1
+                try:
+                    await self.scheduler.request(channel, message.pin)
+                except Exception as e:
+                    log.info("Could not pin the status board in channel %s: %s", channel.id, e)
+            else:
+                await self.scheduler.request(channel, lambda: message.edit(content=text))
+                self.edited += 1
+        except Exception as e:
+            # Post a new board next time, in case this one was deleted
+            self.failed += 1
+            self.messages.pop(key, None)
+            self.texts.pop(key, None)
+            log.warning("Could not update the status board in channel %s: %s", channel.id, e)
+            return
+        self.texts[key] = text
+
+    def forget(self, key):
+        """Stops updating the board for key, e.g. when its game ends."""
+        task = self.pending.pop(key, None)
+        if task is not None:
+            task.cancel()
+        self.dirty.discard(key)
+        self.messages.pop(key, None)
+        self.texts.pop(key, None)
+
+    def close(self):
+        """Cancels every pending update."""
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
+        self.dirty.clear()
+
+    def metrics(self):
+        return {"boards": len(self.messages),
+                "pending": len(self.pending),
+                "posted": self.posted,
+                "edited": self.edited,
+                "skipped": self.skipped,
+                "failed": self.failed}
@@ -0,0 +1,86 @@
+"""
+Tests of how CardLexicon reads the card names players type.
+
+Usage:
+python3 -m pytest test_card_lexicon.py
+"""
+
+import pytest
+
+from card_lexicon import COLOR, TRIBE, CardLexicon, CardNameError
+from ethnos_engine import COLORS, TRIBES
+
+LEXICON = CardLexicon(COLORS, TRIBES)
+
+# Every tribe in the game, including those the bot leaves out
+ALL_TRIBES = ["Centaur", "Dwarf", "Elf", "Giant", "Halfling", "Merfolk",
+              "Minotaur", "Orc", "Skeleton", "Troll", "Wingfolk", "Wizard"]
+
+def read(word, lexicon=LEXICON):
+    """Returns the name word is read as, and the note about it."""
+    meaning, note = lexicon.lookup(word)
+    return lexicon.name(meaning), note
+
+@pytest.mark.parametrize("word, name", [
+    ("red", "Red"), ("dwarf", "Dwarf"), ("skeleton", "Skeleton"),
+    # Prefixes that fit only one name
+    ("blu", "Blue"), ("wiz", "Wizard"), ("cent", "Centaur"), ("purp", "Purple"),
+    # Plurals, regular and not, and aliases
+    ("reds", "Red"), ("giants", "Giant"), ("dwarves", "Dwarf"), ("dwarfs", "Dwarf"), ("grey", "Gray"),
+])
+def test_known_words(word, name):
+    assert read(word) == (name, None)
+
+@pytest.mark.parametrize("word, name", [("elves", "Elf"), ("merfolk", "Merfolk"), ("halflings", "Halfling"),
+                                        ("orcs", "Orc"), ("min", "Minotaur"), ("mer", "Merfolk")])
+def test_every_tribe(word, name):
+    assert read(word, CardLexicon(COLORS, ALL_TRIBES)) == (name, None)
+
+@pytest.mark.parametrize("word, name", [("dwraf", "Dwarf"), ("wizzard", "Wizard"), ("purpel", "Purple"),
+                                        ("grean", "Green"), ("skeletn", "Skeleton")])
+def test_one_typo_is_corrected(word, name):
+    assert read(word) == (name, f"Reading '{word}' as {name}.")
+
+@pytest.mark.parametrize("word, suggestions", [
+    # A prefix of both Green and Gray's alias grey
+    ("gre", ["Gray", "Green", "Red"]),
+    # One edit from both Green and grey
+    ("gren", ["Gray", "Green", "Red"]),
+    # Too short to correct
+    ("rad", ["Red", "Gray"]),
+    ("gr", ["Gray"]),
+])
+def test_ambiguous_words_are_rejected_with_suggestions(word, suggestions):
+    with pytest.raises(CardNameError) as error:
+        LEXICON.lookup(word)
+    message = str(error.value)
+    assert message.startswith(f"'{word}' is not a color or tribe. Did you mean ")
+    assert sorted(message[message.index("mean ") + 5:-1].split(" or ")) == sorted(suggestions)
+
+def test_unknown_words_are_rejected():
+    with pytest.raises(CardNameError, match="^'banana' is not a color or tribe.$"):
+        LEXICON.lookup("banana")
+
+def test_lookup_returns_the_kind_of_name():
+    assert LEXICON.lookup("red") == ((COLOR, COLORS.index("Red")), None)
+    assert LEXICON.lookup("dwarf") == ((TRIBE, TRIBES.index("Dwarf")), None)
+
+@pytest.mark.parametrize("words, cards, notes", [
+    (["Red", "Dwarf"], ["Red Dwarf"], []),
+    (["Dwarves,", "Red"], ["Red Dwarf"], []),
+    (["blu", "wiz"], ["Blue Wizard"], []),
+    (["dwarf", "red", "giant", "GREY"], ["Red Dwarf", "Gray Giant"], []),
+    (["red", "dwraf"], ["Red Dwarf"], ["Reading 'dwraf' as Dwarf."]),
+])
+def test_parse_cards(words, cards, notes):
+    assert LEXICON.parse_cards(words) == (cards, notes)
+
+@pytest.mark.parametrize("words, message", [
+    (["red"], "every card needs a color and a tribe, as in 'Red Dwarf'."),
+    (["red", "blue"], "'red blue' needs a color and a tribe."),
+    (["dwarf", "giants"], "'dwarf giants' needs a color and a tribe."),
+])
+def test_parse_cards_needs_a_color_and_a_tribe(words, message):
+    with pytest.raises(CardNameError) as error:
+        LEXICON.parse_cards(words)
+    assert str(error.value) == message
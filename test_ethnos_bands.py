@@ -0,0 +1,86 @@
+"""
+Tests of which bands the Ethnos engine lets players form, and which it
+suggests.
+
+Usage:
+python3 -m pytest test_ethnos_bands.py
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from ethnos_engine import EthnosBot
+
+HAND = ["Red Dwarf", "Red Dwarf", "Blue Dwarf", "Green Dwarf", "Red Giant", "Red Troll", "Blue Wizard"]
+
+def game_with_hand(cards):
+    """Returns a game whose only player, 1, holds cards."""
+    EB = EthnosBot()
+    EB.add_player(SimpleNamespace(id=1, name="Player 1"))
+    EB.empty_hand(1)
+    for card in cards:
+        EB.add_card(1, card)
+    return EB
+
+@pytest.mark.parametrize("cards, leader", [
+    (["Red Dwarf"], "Red Dwarf"),
+    (["Red Dwarf", "Blue Dwarf", "Green Dwarf"], "Blue Dwarf"),
+    (["Red Dwarf", "Red Dwarf", "Blue Dwarf"], "Red Dwarf"),
+    (["Red Giant", "Red Dwarf", "Red Troll"], "Red Troll"),
+    (["Red Dwarf", "Red Dwarf", "Red Giant", "Red Troll"], "Red Giant"),
+])
+def test_legal_bands(cards, leader):
+    EB = game_with_hand(HAND)
+    assert EB.band_problem(1, cards, leader) is None
+
+    tabled, kingdom = EB.form_band(1, cards, leader)
+    rest = list(HAND)
+    for card in cards:
+        rest.remove(card)
+    assert sorted(tabled) == sorted(rest)
+    assert list(EB.hand(1)) == []
+    assert sorted(EB.available_cards) == sorted(rest)
+    assert EB.bands == [(1, leader, tuple(cards))]
+    assert kingdom == leader.split()[0]
+
+@pytest.mark.parametrize("cards, leader, problem", [
+    ([], "Red Dwarf", "A band needs at least one card."),
+    (["Red Dwarf", "Blue Dwarf"], "Green Dwarf", "The leader, Green Dwarf, must be one of the cards in the band."),
+    (["Pink Dwarf"], "Pink Dwarf", "Pink Dwarf is not a legal card name; check spelling."),
+    (["Gray Dwarf"], "Gray Dwarf", "You don't have Gray Dwarf in your hand."),
+    (["Red Giant", "Red Giant"], "Red Giant", "You don't have that many copies of Red Giant in your hand."),
+    (["Red Dwarf", "Blue Wizard"], "Red Dwarf",
+     "The cards in a band must all be of the same tribe or all of the same color."),
+    (["Blue Dwarf", "Red Dwarf", "Red Giant"], "Red Dwarf",
+     "The cards in a band must all be of the same tribe or all of the same color."),
+])
+def test_illegal_bands(cards, leader, problem):
+    EB = game_with_hand(HAND)
+    assert EB.band_problem(1, cards, leader) == problem
+
+    with pytest.raises(ValueError, match=problem[:20]):
+        EB.form_band(1, cards, leader)
+    assert sorted(EB.hand(1)) == sorted(HAND)
+    assert EB.bands == []
+
+@pytest.mark.parametrize("cards, bands", [
+    ([], []),
+    # A single card is both a tribe and a color
+    (["Red Dwarf"], [["Red Dwarf"]]),
+    (["Red Dwarf", "Red Dwarf"], [["Red Dwarf", "Red Dwarf"]]),
+    (["Red Dwarf", "Red Giant"], [["Red Dwarf", "Red Giant"], ["Red Dwarf"], ["Red Giant"]]),
+    # The duplicates are dropped before the limit, so it still finds 3
+    (["Red Dwarf", "Red Dwarf", "Blue Giant", "Green Troll"],
+     [["Red Dwarf", "Red Dwarf"], ["Blue Giant"], ["Green Troll"]]),
+    # Tribes come before colors of the same size
+    (HAND, [["Blue Dwarf", "Green Dwarf", "Red Dwarf", "Red Dwarf"],
+            ["Red Dwarf", "Red Dwarf", "Red Giant", "Red Troll"],
+            ["Blue Dwarf", "Blue Wizard"]]),
+])
+def test_largest_bands_suggests_each_band_once(cards, bands):
+    EB = game_with_hand(cards)
+    suggested = EB.largest_bands(1)
+    assert suggested == bands
+    for band in suggested:
+        assert EB.band_problem(1, band, band[0]) is None
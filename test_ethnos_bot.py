@@ -0,0 +1,75 @@
+"""
+Tests of the Ethnos bot's commands, run against fake_discord.py.
+
+Usage:
+python3 -m pytest test_ethnos_bot.py
+"""
+
+import asyncio, os
+
+from fake_discord import FakeContext, fake_bot
+from game_sessions import GameSessions
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def stop(module):
+    """Cancels the module's board updates and send workers, and lets them
+    finish being cancelled."""
+    tasks = list(module.BOARDS.pending.values()) + list(module.SCHEDULER.workers.values())
+    module.BOARDS.close()
+    module.SCHEDULER.close()
+    run(asyncio.gather(*tasks, return_exceptions=True))
+
+def test_commands_outside_a_game_create_none():
+    with fake_bot("ethnos_bot") as (ethnos_bot, users):
+        ctx = FakeContext(users.get_or_create(1), channel_id=10)
+        run(ethnos_bot.hand.callback(ctx))
+        run(ethnos_bot.draw.callback(ctx))
+        run(ethnos_bot.odds.callback(ctx))
+        run(ethnos_bot.SCHEDULER.drain())
+
+        assert len(ethnos_bot.SESSIONS) == 0
+        assert os.listdir(ethnos_bot.GAMES_DIR) == []
+        assert ctx.channel.sent == ["There is no game in this channel."] * 3
+        stop(ethnos_bot)
+
+def test_idle_games_are_evicted_with_their_journals():
+    with fake_bot("ethnos_bot") as (ethnos_bot, users):
+        ctx = FakeContext(users.get_or_create(1), channel_id=10)
+        run(ethnos_bot.join.callback(ctx))
+        key = GameSessions.key(ctx)
+        EB = ethnos_bot.SESSIONS.games[key]
+        assert os.listdir(ethnos_bot.GAMES_DIR) != []
+
+        now = ethnos_bot.SESSIONS.last_used[key] + ethnos_bot.MAX_IDLE_SECONDS + 1
+        assert ethnos_bot.SESSIONS.evict_idle(now) == [key]
+        assert EB.journal is None
+        assert os.listdir(ethnos_bot.GAMES_DIR) == []
+        stop(ethnos_bot)
+
+def test_turns_are_enforced_until_nobody_is_seated():
+    with fake_bot("ethnos_bot") as (ethnos_bot, users):
+        alice = FakeContext(users.get_or_create(1, "Alice"), channel_id=10)
+        bob = FakeContext(users.get_or_create(2, "Bob"), channel_id=10)
+        run(ethnos_bot.join.callback(alice))
+        run(ethnos_bot.join.callback(bob))
+        run(ethnos_bot.start.callback(alice))
+
+        run(ethnos_bot.draw.callback(bob))
+        run(ethnos_bot.SCHEDULER.drain())
+        assert alice.channel.sent[-1] == "Sorry Bob, it is <@1>'s turn."
+
+        # Leaving on your turn passes it on
+        run(ethnos_bot.leave.callback(alice))
+        run(ethnos_bot.SCHEDULER.drain())
+        assert alice.channel.sent[-1] == "Alice has left the game.\nIt is now <@2>'s turn."
+
+        run(ethnos_bot.leave.callback(bob))
+        for command in (ethnos_bot.draw, ethnos_bot.band, ethnos_bot.odds):
+            run(command.callback(bob))
+        run(ethnos_bot.skip.callback(bob))
+        run(ethnos_bot.SCHEDULER.drain())
+        assert alice.channel.sent[-5:] == ["Bob has left the game."] + ["Nobody has joined the game."] * 3 + \
+                                          ["Nobody has a turn until the game has been started."]
+        stop(ethnos_bot)
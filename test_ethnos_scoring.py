@@ -0,0 +1,85 @@
+"""
+Tests of how the Ethnos engine places control markers, counts band points
+and scores the Age.
+
+Usage:
+python3 -m pytest test_ethnos_scoring.py
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from ethnos_engine import COLORS, KINGDOM_GLORY, EthnosBot
+
+def new_game(players):
+    EB = EthnosBot()
+    for id in players:
+        EB.add_player(SimpleNamespace(id=id, name=f"Player {id}"))
+    return EB
+
+def form(EB, id, *cards):
+    """Gives player id cards and has them form a band of them led by the
+    first. Returns the kingdom a marker was placed in, or None."""
+    for card in cards:
+        EB.add_card(id, card)
+    return EB.form_band(id, list(cards), cards[0])[1]
+
+def dwarves(size):
+    """Returns a band of size Dwarves, led by the Red Dwarf."""
+    return [f"{COLORS[i % len(COLORS)]} Dwarf" for i in range(size)]
+
+@pytest.mark.parametrize("size, points", [(1, 0), (2, 1), (3, 3), (4, 6), (5, 10), (6, 15), (7, 15)])
+def test_band_points(size, points):
+    EB = new_game([1])
+    form(EB, 1, *dwarves(size))
+    assert EB.band_points == {1: points}
+    assert EB.score_age() == [(1, points, KINGDOM_GLORY[0])]
+
+def test_markers_need_bands_larger_than_those_placed():
+    EB = new_game([1, 2])
+    red = COLORS.index("Red")
+    assert form(EB, 1, "Red Dwarf") == "Red"
+    assert form(EB, 1, "Red Giant") is None
+    assert form(EB, 1, "Red Troll", "Red Wizard") == "Red"
+    assert form(EB, 1, "Red Centaur", "Red Skeleton") is None
+    assert form(EB, 1, *dwarves(3)) == "Red"
+    # Other players' markers don't raise the bar
+    assert form(EB, 2, "Red Giant") == "Red"
+    assert EB.markers[red] == {1: 3, 2: 1}
+
+    # The leader's color picks the kingdom, whatever the other cards' colors
+    assert form(EB, 2, "Blue Dwarf", "Red Dwarf") == "Blue"
+    assert EB.markers[COLORS.index("Blue")] == {2: 1}
+
+def kingdom_scores(markers):
+    """Returns the kingdom points of players 1 to 4 at the end of an Age
+    with markers, a dict of color to a dict of player id to marker count."""
+    EB = new_game([1, 2, 3, 4])
+    for color, counts in markers.items():
+        EB.markers[COLORS.index(color)] = counts
+    return {id: kingdom for id, _, kingdom in EB.score_age()}
+
+def test_kingdom_glory_by_place():
+    assert kingdom_scores({"Red": {1: 3, 2: 2, 3: 1, 4: 1}}) == {1: 8, 2: 4, 3: 1, 4: 1}
+    assert kingdom_scores({"Red": {1: 3, 2: 2, 3: 1}}) == {1: 8, 2: 4, 3: 2, 4: 0}
+
+def test_tie_for_first_splits_first_and_second():
+    assert kingdom_scores({"Green": {1: 2, 2: 2, 3: 1}}) == {1: 6, 2: 6, 3: 2, 4: 0}
+
+def test_tie_for_second_splits_second_and_third():
+    assert kingdom_scores({"Blue": {3: 2, 1: 1, 2: 1}}) == {1: 3, 2: 3, 3: 8, 4: 0}
+
+def test_ties_past_third_place_share_less_glory():
+    assert kingdom_scores({"Gray": {1: 2, 2: 1, 3: 1, 4: 1}}) == {1: 8, 2: 2, 3: 2, 4: 2}
+
+def test_kingdoms_add_up():
+    scores = kingdom_scores({"Red": {1: 1}, "Green": {1: 1, 2: 1}, "Purple": {2: 2, 1: 1}})
+    assert scores == {1: 8 + 6 + 4, 2: 6 + 8, 3: 0, 4: 0}
+
+def test_scores_are_highest_total_first():
+    EB = new_game([1, 2, 3])
+    form(EB, 2, *dwarves(4))
+    form(EB, 3, "Blue Giant", "Blue Troll")
+    form(EB, 1, "Green Wizard")
+    assert EB.score_age() == [(2, 6, 8), (3, 1, 8), (1, 0, 8)]
@@ -0,0 +1,119 @@
+"""
+Tests that Ethnos games survive saving and loading: compact snapshots, the
+journal, and backups pickled with dill by the original bot.
+
+testdata/backup_ethnos_bot_2020-06-13_20-15-02.dat was written by !pickle
+in the original ethnos_bot.py, whose EthnosBot and Player were defined in
+__main__: three players (Alice 101, Bob 202, Carol 303), started, six cards
+drawn and Alice's pickup of Gray Centaur from the table.
+
+Usage:
+python3 -m pytest test_ethnos_snapshot.py
+"""
+
+import os, shutil, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from ethnos_engine import EthnosBot, save_backup
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_BACKUP = os.path.join(HERE, "testdata", "backup_ethnos_bot_2020-06-13_20-15-02.dat")
+
+BASELINE_HANDS = {101: ["Blue Skeleton", "Gray Centaur", "Orange Wizard", "Purple Dwarf"],
+                  202: ["Gray Dwarf", "Purple Skeleton", "Purple Wizard"],
+                  303: ["Blue Giant", "Gray Giant", "Green Troll"]}
+BASELINE_TABLE = ["Gray Centaur", "Green Giant", "Orange Skeleton", "Purple Centaur", "Red Dwarf"]
+
+def check_baseline_game(EB):
+    assert list(EB.turn_order) == [101, 202, 303]
+    assert EB.turn_order.current == 101
+    assert {id: list(player.cards) for id, player in EB.players.items()} == BASELINE_HANDS
+    assert EB.players[202].name == "Bob"
+    assert list(EB.available_cards) == BASELINE_TABLE
+    assert len(EB.deck) == 60 and EB.deck.count("Dragon") == 3
+    assert EB.started and EB.dragons == 0
+    assert EB.journal is None and EB.bands == []
+    assert EB.validate() == []
+
+def sample_game():
+    EB = EthnosBot()
+    for id in (1, 2, 3):
+        EB.add_player(SimpleNamespace(id=id, name=f"Player {id}"))
+    EB.start()
+    for _ in range(9):
+        EB.draw(EB.turn_order.current)
+        EB.end_turn()
+    return EB
+
+def same_game(a, b):
+    assert a.deck == b.deck
+    assert list(a.turn_order) == list(b.turn_order)
+    assert a.turn_order.current == b.turn_order.current
+    assert list(a.available_cards) == list(b.available_cards)
+    assert {id: list(p.cards) for id, p in a.players.items()} == {id: list(p.cards) for id, p in b.players.items()}
+    assert (a.started, a.dragons, a.dragon_zone, a.bands) == (b.started, b.dragons, b.dragon_zone, b.bands)
+
+def test_baseline_backup_loads():
+    check_baseline_game(EthnosBot.load_ethnos_bot(BASELINE_BACKUP))
+
+@pytest.mark.parametrize("command", [["ethnos_snapshot.py", "migrate"], ["ethnos_bot.py", "--check"]])
+def test_baseline_backup_loads_where_main_imports_the_engine(tmp_path, command):
+    # These scripts import EthnosBot into __main__, so dill unpickles the
+    # backup as the current class with the original bot's attributes
+    backup = tmp_path / os.path.basename(BASELINE_BACKUP)
+    shutil.copy(BASELINE_BACKUP, backup)
+    result = subprocess.run([sys.executable, os.path.join(HERE, command[0]), *command[1:], str(backup)],
+                            cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    if command[1] == "migrate":
+        check_baseline_game(EthnosBot.load_ethnos_bot(str(backup.with_suffix(".eth"))))
+
+def test_pickles_load_only_from_dat_files(tmp_path):
+    renamed = tmp_path / "backup_ethnos_bot_1_2_2020-06-13_20-15-02.eth"
+    shutil.copy(BASELINE_BACKUP, renamed)
+    with pytest.raises(ValueError):
+        EthnosBot.load_ethnos_bot(str(renamed))
+
+def test_snapshot_round_trip():
+    EB = sample_game()
+    EB.form_band(1, [next(iter(EB.hand(1)))], next(iter(EB.hand(1))))
+    same_game(EB, EthnosBot.from_bytes(EB.to_bytes()))
+
+def test_journal_replay(tmp_path):
+    EB = sample_game()
+    EB.attach_journal(str(tmp_path / "ethnos_1_2"))
+    for _ in range(5):
+        EB.draw(EB.turn_order.current)
+        EB.end_turn()
+    EB.pickup(EB.turn_order.current, next(iter(EB.available_cards)))
+    EB.close_journal()
+
+    replayed = EthnosBot.load_ethnos_bot(str(tmp_path / "ethnos_1_2.ckpt"))
+    replayed.close_journal()
+    same_game(EB, replayed)
+
+def test_backups_saved_at_once_are_all_kept(tmp_path):
+    prefix = str(tmp_path / "backup_ethnos_bot_1_2")
+    snapshots = [sample_game().to_bytes() for _ in range(8)]
+    with ThreadPoolExecutor(len(snapshots)) as pool:
+        filenames = list(pool.map(lambda data: save_backup(data, prefix), snapshots))
+
+    assert len(set(filenames)) == len(snapshots)
+    for filename, data in zip(filenames, snapshots):
+        with open(filename, "rb") as f:
+            assert f.read() == data
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(filename) for filename in filenames)
+
+def test_backups_beyond_keep_are_deleted(tmp_path):
+    prefix = str(tmp_path / "backup_ethnos_bot_1_2")
+    data = sample_game().to_bytes()
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: save_backup(data, prefix, keep=3), range(8)))
+    assert len(os.listdir(tmp_path)) == 3
+
+    newest = save_backup(data, prefix, keep=3)
+    assert os.path.basename(newest) in os.listdir(tmp_path)
+    assert len(os.listdir(tmp_path)) == 3
@@ -0,0 +1,52 @@
+"""
+Tests of the Game of 99 bot's commands, run against fake_discord.py.
+
+Usage:
+python3 -m pytest test_ninety_nine.py
+"""
+
+import asyncio
+
+from fake_discord import FakeContext, fake_bot
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def stop(module):
+    """Cancels the module's board updates and send workers, and lets them
+    finish being cancelled."""
+    tasks = list(module.BOARDS.pending.values()) + list(module.SCHEDULER.workers.values())
+    module.BOARDS.close()
+    module.SCHEDULER.close()
+    run(asyncio.gather(*tasks, return_exceptions=True))
+
+def test_turns_are_enforced_until_nobody_is_seated():
+    with fake_bot("ninety_nine") as (ninety_nine, users):
+        alice = FakeContext(users.get_or_create(1, "Alice"), channel_id=10)
+        bob = FakeContext(users.get_or_create(2, "Bob"), channel_id=10)
+        run(ninety_nine._99draw.callback(alice))
+        run(ninety_nine.SCHEDULER.drain())
+        assert alice.channel.sent == ["Nobody has joined the game yet."]
+
+        run(ninety_nine._99join.callback(alice))
+        run(ninety_nine._99join.callback(bob))
+        run(ninety_nine._99draw.callback(bob))
+        run(ninety_nine.SCHEDULER.drain())
+        assert alice.channel.sent[-1] == "Sorry Bob, it is <@1>'s turn."
+
+        run(ninety_nine._99draw.callback(alice))
+        run(ninety_nine.SCHEDULER.drain())
+        assert alice.channel.sent[-1] == "It is now <@2>'s turn."
+        assert len(ninety_nine.SESSIONS.games[(1, 10)].hand(1)) == 1
+
+        # Leaving on your turn passes it on, around to the first seat
+        run(ninety_nine._99leave.callback(bob))
+        run(ninety_nine.SCHEDULER.drain())
+        assert alice.channel.sent[-1] == "Bob has left the game.\nIt is now <@1>'s turn."
+
+        run(ninety_nine._99leave.callback(alice))
+        run(ninety_nine._99draw.callback(alice))
+        run(ninety_nine._99skip.callback(alice))
+        run(ninety_nine.SCHEDULER.drain())
+        assert alice.channel.sent[-3:] == ["Alice has left the game."] + ["Nobody has joined the game yet."] * 2
+        stop(ninety_nine)
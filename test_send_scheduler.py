@@ -0,0 +1,65 @@
+"""
+Tests that the send scheduler paces messages under the fake gateway's rate
+limits, which are Discord's scaled down to keep the tests quick.
+
+Usage:
+python3 -m pytest test_send_scheduler.py
+"""
+
+import asyncio, time
+
+from fake_discord import FakeChannel, FakeGateway
+from send_scheduler import INFO, TURN, SendScheduler
+
+LIMIT = (5, 0.5)
+
+def test_burst_to_one_channel_gets_no_429s():
+    gateway = FakeGateway(rate_limit=LIMIT)
+    channel = FakeChannel(10, gateway)
+
+    async def burst():
+        scheduler = SendScheduler(limit=LIMIT)
+        start = time.monotonic()
+        for i in range(12):
+            scheduler.to_channel(channel, f"Message {i}")
+        await scheduler.drain()
+        scheduler.close()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(burst())
+    assert gateway.rate_limited == 0
+    assert channel.sent == [f"Message {i}" for i in range(12)]
+    # 5 go out at once, 5 a window later and 2 a window after that
+    assert 2 * LIMIT[1] <= elapsed < 3 * LIMIT[1]
+
+def test_edits_count_toward_the_channel_limit():
+    gateway = FakeGateway(rate_limit=LIMIT)
+    channel = FakeChannel(10, gateway)
+
+    async def post_and_edit():
+        scheduler = SendScheduler(limit=LIMIT)
+        message = await scheduler.request(channel, lambda: channel.send("Board"))
+        edits = [scheduler.request(channel, lambda i=i: message.edit(content=f"Board {i}"))
+                 for i in range(6)]
+        sends = [scheduler.to_channel(channel, f"Message {i}") for i in range(6)]
+        await asyncio.gather(*edits, *sends)
+        scheduler.close()
+        return message
+
+    message = asyncio.run(post_and_edit())
+    assert gateway.rate_limited == 0
+    assert message.content == "Board 5" and len(channel.sent) == 7
+
+def test_turn_messages_go_first():
+    channel = FakeChannel(10)
+
+    async def queue():
+        scheduler = SendScheduler(limit=None, global_limit=None)
+        scheduler.to_channel(channel, "Your hand", INFO)
+        scheduler.to_channel(channel, "It is now Bob's turn.", TURN)
+        scheduler.to_channel(channel, "The table", INFO)
+        await scheduler.drain()
+        scheduler.close()
+
+    asyncio.run(queue())
+    assert channel.sent == ["It is now Bob's turn.", "Your hand", "The table"]
@@ -0,0 +1,85 @@
+"""
+Tests of TurnOrder, the ring of seated players both bots take turns with.
+
+Usage:
+python3 -m pytest test_turn_order.py
+"""
+
+import pytest
+
+from turn_order import TurnOrder
+
+def test_empty():
+    turns = TurnOrder()
+    assert len(turns) == 0 and list(turns) == []
+    assert turns.current is None
+    assert turns.advance() is None
+
+def test_first_seated_goes_first():
+    turns = TurnOrder([3, 1, 2])
+    assert list(turns) == [3, 1, 2]
+    assert turns.current == 3
+    assert 1 in turns and 4 not in turns
+
+def test_advance_wraps_around():
+    turns = TurnOrder([1, 2, 3])
+    assert [turns.advance() for _ in range(4)] == [2, 3, 1, 2]
+    assert turns.next_after(3) == 1
+
+def test_single_player_keeps_the_turn():
+    turns = TurnOrder([1])
+    assert turns.advance() == 1
+    assert turns.next_after(1) == 1
+
+def test_removing_the_current_player_passes_the_turn_on():
+    turns = TurnOrder([1, 2, 3])
+    turns.advance()
+    turns.remove(2)
+    assert turns.current == 3
+    assert list(turns) == [1, 3]
+
+def test_removing_the_last_seat_on_its_turn_wraps_around():
+    turns = TurnOrder([1, 2, 3])
+    turns.set_current(3)
+    turns.remove(3)
+    assert turns.current == 1
+    assert turns.advance() == 2
+    assert turns.advance() == 1
+
+def test_removing_another_player_keeps_the_turn():
+    turns = TurnOrder([1, 2, 3])
+    turns.advance()
+    turns.remove(1)
+    assert turns.current == 2
+    assert list(turns) == [2, 3]
+    assert turns.advance() == 3
+    assert turns.advance() == 2
+
+def test_players_seated_later_sit_last():
+    turns = TurnOrder([1, 2, 3])
+    turns.remove(2)
+    turns.add(4)
+    assert list(turns) == [1, 3, 4]
+    assert [turns.advance() for _ in range(3)] == [3, 4, 1]
+
+def test_removing_everyone_leaves_nobody_to_play():
+    turns = TurnOrder([1, 2])
+    turns.remove(1)
+    turns.remove(2)
+    assert len(turns) == 0 and list(turns) == []
+    assert turns.current is None
+    assert turns.advance() is None
+
+    # The next player seated has the turn
+    turns.add(5)
+    assert turns.current == 5 and list(turns) == [5]
+
+def test_errors():
+    turns = TurnOrder([1, 2])
+    with pytest.raises(ValueError):
+        turns.add(1)
+    with pytest.raises(ValueError):
+        turns.remove(3)
+    with pytest.raises(ValueError):
+        turns.set_current(3)
+    assert list(turns) == [1, 2] and turns.current == 1
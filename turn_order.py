@@ -0,0 +1,92 @@
+"""
+Seating and turn order for a game: the players in a ring, and whose turn it
+is.
+
+Usage:
+turns = TurnOrder([alice_id, bob_id])
+if turns.current == author_id:
+    ...
+    turns.advance()
+"""
+
+class TurnOrder:
+    """Player ids in seat order, as a ring linked in both directions, with a
+    pointer to the player whose turn it is. Seating and unseating a player,
+    advancing the turn and finding the player after another are O(1)."""
+
+    def __init__(self, ids=()):
+        self.following = {}
+        self.preceding = {}
+        self.first = None
+        self.current = None
+        for id in ids:
+            self.add(id)
+
+    def __len__(self):
+        return len(self.following)
+
+    def __contains__(self, id):
+        return id in self.following
+
+    def __iter__(self):
+        """Yields the ids in seat order, starting from the first seat."""
+        id = self.first
+        for _ in range(len(self.following)):
+            yield id
+            id = self.following[id]
+
+    def __str__(self):
+        return str(list(self))
+
+    __repr__ = __str__
+
+    def add(self, id):
+        """Seats id after everyone else. The first player seated has the first
+        turn. Raises ValueError if id is already seated."""
+        if id in self.following:
+            raise ValueError(f"{id} is already seated")
+        if self.first is None:
+            self.first = self.current = id
+            self.following[id] = self.preceding[id] = id
+            return
+
+        last = self.preceding[self.first]
+        self.following[last] = id
+        self.preceding[id] = last
+        self.following[id] = self.first
+        self.preceding[self.first] = id
+
+    def remove(self, id):
+        """Unseats id. If it was id's turn, it is now the next player's. Raises
+        ValueError if id isn't seated."""
+        if id not in self.following:
+            raise ValueError(f"{id} is not seated")
+        following = self.following.pop(id)
+        preceding = self.preceding.pop(id)
+        if following == id:
+            self.first = self.current = None
+            return
+
+        self.following[preceding] = following
+        self.preceding[following] = preceding
+        if self.first == id:
+            self.first = following
+        if self.current == id:
+            self.current = following
+
+    def next_after(self, id):
+        """Returns the id of the player seated after id."""
+        return self.following[id]
+
+    def advance(self):
+        """Ends the current turn. Returns the id of the player whose turn it is
+        now, or None if nobody is seated."""
+        if self.current is not None:
+            self.current = self.following[self.current]
+        return self.current
+
+    def set_current(self, id):
+        """Makes it id's turn. Raises ValueError if id isn't seated."""
+        if id not in self.following:
+            raise ValueError(f"{id} is not seated")
+        self.current = id